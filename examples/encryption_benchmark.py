@@ -0,0 +1,74 @@
+"""Compare the Fernet and compact AES-GCM secret formats
+
+Reports the stored size of an encrypted TOTP secret and the time of
+single and bulk encrypt/decrypt operations for both formats.
+
+    python examples/encryption_benchmark.py --bulk 10000
+"""
+import argparse
+import statistics
+import timeit
+import pyotp
+from cryptography.fernet import Fernet
+from two_fast_auth import TwoFactorAuth
+
+
+def best_of(function, number, repeat=5):
+    """Fastest mean seconds per call over ``repeat`` runs"""
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bulk", type=int, default=10000)
+    parser.add_argument("--single", type=int, default=2000)
+    args = parser.parse_args()
+
+    key = Fernet.generate_key()
+    secrets = [pyotp.random_base32(32) for _ in range(args.bulk)]
+    print(f"{'format':<8} {'bytes':>6} {'encrypt':>10} {'decrypt':>10} "
+          f"{'bulk enc':>10} {'bulk dec':>10}")
+
+    for name, compact in (("fernet", False), ("compact", True)):
+        tokens = [
+            TwoFactorAuth.encrypt_secret(secret, key, compact=compact)
+            for secret in secrets
+        ]
+        size = statistics.mean(len(token) for token in tokens)
+
+        encrypt = best_of(
+            lambda: TwoFactorAuth.encrypt_secret(
+                secrets[0],
+                key,
+                compact=compact
+            ),
+            args.single
+        )
+        decrypt = best_of(
+            lambda: TwoFactorAuth.decrypt_secret(tokens[0], key),
+            args.single
+        )
+        bulk_encrypt = best_of(
+            lambda: [
+                TwoFactorAuth.encrypt_secret(secret, key, compact=compact)
+                for secret in secrets
+            ],
+            1,
+            repeat=3
+        )
+        bulk_decrypt = best_of(
+            lambda: [
+                TwoFactorAuth.decrypt_secret(token, key) for token in tokens
+            ],
+            1,
+            repeat=3
+        )
+        print(
+            f"{name:<8} {size:>6.0f} "
+            f"{encrypt * 1e6:>8.1f}us {decrypt * 1e6:>8.1f}us "
+            f"{bulk_encrypt * 1e3:>8.1f}ms {bulk_decrypt * 1e3:>8.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -25,14 +25,15 @@ from fastapi import (
     FastAPI,
     Body,
     Depends,
-    Header,
     HTTPException,
     status
 )
 from fastapi.responses import StreamingResponse
 from two_fast_auth import (
     TwoFactorMiddleware,
-    TwoFactorAuth
+    TwoFactorAuth,
+    TwoFactorResult,
+    verified_2fa
 )
 
 
@@ -60,6 +61,9 @@ app.add_middleware(
     TwoFactorMiddleware,
     get_user_secret_callback=get_user_encrypted_secret_callback,
     encryption_key=ENCRYPTION_KEY,
+    # Read the secret from the user the auth backend already loaded,
+    # only querying the DB through the callback when it is missing
+    user_secret_attribute="two_fa_secret",
     excluded_paths=[
         "/docs", # Swagger UI
         "/openapi.json", # OpenAPI JSON
@@ -217,28 +221,13 @@ async def use_recovery_code(
     tags=["Protected"]
 )
 async def protected_route(
-    user: User = Depends(current_active_user),
-    x_2fa_code: str = Header(
-        ...,
-        alias="X-2FA-Code"
-    )
+    # The middleware already verified the X-2FA-Code header;
+    # read its result instead of verifying the code again
+    two_fa: TwoFactorResult = Depends(verified_2fa)
 ):
-    # Explicit 2FA verification for demonstration
-    if not user.two_fa_secret:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="2FA not configured"
-        )
-
-    if not TwoFactorAuth(user.two_fa_secret).verify_code(x_2fa_code):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid 2FA code"
-        )
-
     return {
         "message": "You've accessed a protected route with valid 2FA!",
-        "user_id": str(user.id)
+        "user_id": two_fa.user_id
     }
 
 
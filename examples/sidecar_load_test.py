@@ -0,0 +1,138 @@
+"""Load test for the 2FA verification sidecar
+
+Starts the sidecar in its own process on a local port, backed by an
+in-memory stand-in user store with simulated database latency, and
+drives ``/verify`` over keep-alive connections the way a reverse proxy
+does.
+
+    pip install 'two_fast_auth[sidecar]' httpx
+    python examples/sidecar_load_test.py --users 10000 --concurrency 64
+"""
+import argparse
+import asyncio
+import base64
+import multiprocessing
+import random
+import statistics
+import time
+import httpx
+import pyotp
+import uvicorn
+from two_fast_auth import (
+    SecretCache,
+    TwoFactorVerifier
+)
+from two_fast_auth.sidecar import create_sidecar_app
+
+
+def user_secrets(users: int) -> dict[str, str]:
+    """Deterministic secrets, so the load generator knows them too"""
+    rng = random.Random(0)
+    return {
+        f"user{i}": base64.b32encode(rng.randbytes(20)).decode()
+        for i in range(users)
+    }
+
+
+class UserStore:
+    """Stand-in for the user database"""
+
+    def __init__(self, users: int, latency: float):
+        self.secrets = user_secrets(users)
+        self.latency = latency
+
+    async def get_secret(self, user_id: str):
+        await asyncio.sleep(self.latency)
+        return self.secrets.get(user_id)
+
+
+def serve(args):
+    store = UserStore(args.users, args.db_latency)
+    verifier = TwoFactorVerifier(
+        store.get_secret,
+        secret_cache=SecretCache(ttl=args.cache_ttl) if args.cache_ttl else None
+    )
+    uvicorn.run(
+        create_sidecar_app(verifier),
+        host="127.0.0.1",
+        port=args.port,
+        timeout_keep_alive=75,
+        access_log=False,
+        log_level="warning"
+    )
+
+
+async def worker(client, secrets, deadline, latencies, statuses):
+    user_ids = list(secrets)
+    while time.perf_counter() < deadline:
+        user_id = random.choice(user_ids)
+        code = pyotp.TOTP(secrets[user_id]).now()
+        start = time.perf_counter()
+        response = await client.get(
+            "/verify",
+            headers={"X-User-Id": user_id, "X-2FA-Code": code}
+        )
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = (
+            statuses.get(response.status_code, 0) + 1
+        )
+
+
+async def run(args):
+    secrets = user_secrets(args.users)
+    server = multiprocessing.Process(target=serve, args=(args,), daemon=True)
+    server.start()
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{args.port}"
+    ) as probe:
+        while True:
+            try:
+                await probe.get("/healthz")
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.05)
+
+    limits = httpx.Limits(
+        max_connections=args.concurrency,
+        max_keepalive_connections=args.concurrency
+    )
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{args.port}",
+        limits=limits
+    ) as client:
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            worker(client, secrets, deadline, latencies, statuses)
+            for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+        metrics = (await client.get("/metrics")).json()
+
+    server.terminate()
+    server.join()
+
+    latencies.sort()
+    print(f"requests:    {len(latencies)} in {elapsed:.1f}s")
+    print(f"throughput:  {len(latencies) / elapsed:.0f} req/s")
+    print(f"latency p50: {statistics.median(latencies) * 1000:.2f} ms")
+    print(f"latency p99: {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms")
+    print(f"statuses:    {statuses}")
+    print(f"metrics:     {metrics}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--db-latency", type=float, default=0.002)
+    parser.add_argument("--cache-ttl", type=float, default=300.0)
+    parser.add_argument("--port", type=int, default=8091)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
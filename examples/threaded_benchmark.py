@@ -0,0 +1,137 @@
+"""Multi-threaded 2FA verification throughput
+
+Runs one event loop per thread, all sharing a single TwoFactorVerifier
+(secret decryption, device code indexes, drift tracker and throttle),
+and reports verifications per second as the thread count grows. On a
+free-threaded interpreter (``python3.14t``) throughput should scale
+close to linearly up to the number of cores; with the GIL it stays flat.
+
+    python3.14t examples/threaded_benchmark.py --threads 1 2 4 8
+"""
+import argparse
+import asyncio
+import base64
+import os
+import random
+import sys
+import threading
+import time
+import pyotp
+from cryptography.fernet import Fernet
+from fastapi import Request
+from two_fast_auth import (
+    AttemptThrottle,
+    DriftTracker,
+    TwoFactorAuth,
+    TwoFactorVerifier
+)
+
+
+class User:
+    is_authenticated = True
+
+    def __init__(self, user_id):
+        self.id = user_id
+
+
+def build(users, devices):
+    key = Fernet.generate_key()
+    rng = random.Random(0)
+    plain = {}
+    stored = {}
+    for i in range(users):
+        secrets = {
+            f"device{d}": base64.b32encode(rng.randbytes(20)).decode()
+            for d in range(devices)
+        }
+        plain[f"user{i}"] = secrets
+        encrypted = {
+            device_id: TwoFactorAuth.encrypt_secret(secret, key, compact=True)
+            for device_id, secret in secrets.items()
+        }
+        stored[f"user{i}"] = (
+            encrypted if devices > 1 else encrypted["device0"]
+        )
+
+    async def get_secret(user_id):
+        return stored.get(user_id)
+
+    verifier = TwoFactorVerifier(
+        get_secret,
+        encryption_key=key,
+        drift_tracker=DriftTracker(),
+        throttle=AttemptThrottle()
+    )
+    return verifier, plain
+
+
+def requests_for(plain, count, seed):
+    """Pre-built requests, so the timed loop only verifies"""
+    rng = random.Random(seed)
+    user_ids = list(plain)
+    requests = []
+    for _ in range(count):
+        user_id = rng.choice(user_ids)
+        secret = rng.choice(list(plain[user_id].values()))
+        requests.append((user_id, pyotp.TOTP(secret).now().encode()))
+    return requests
+
+
+async def verify_all(verifier, requests):
+    for user_id, code in requests:
+        await verifier.verify_request(Request(scope={
+            "type": "http",
+            "method": "GET",
+            "path": "/protected",
+            "headers": [(b"x-2fa-code", code)],
+            "client": ("127.0.0.1", 0),
+            "user": User(user_id)
+        }))
+
+
+def run(verifier, plain, threads, per_thread):
+    work = [requests_for(plain, per_thread, seed) for seed in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(requests):
+        barrier.wait()
+        asyncio.run(verify_all(verifier, requests))
+
+    pool = [
+        threading.Thread(target=worker, args=(requests,))
+        for requests in work
+    ]
+    for thread in pool:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in pool:
+        thread.join()
+    return threads * per_thread / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=20000,
+                        help="verifications per thread")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--devices", type=int, default=2)
+    args = parser.parse_args()
+
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    print(f"python {sys.version.split()[0]}, GIL {'on' if gil else 'off'}, "
+          f"{os.cpu_count()} CPUs")
+    verifier, plain = build(args.users, args.devices)
+    run(verifier, plain, 1, min(args.requests, 1000))  # warm the indexes
+
+    baseline = None
+    print(f"{'threads':>7} {'verif/s':>10} {'speedup':>8}")
+    for threads in args.threads:
+        rate = run(verifier, plain, threads, args.requests)
+        baseline = baseline or rate
+        print(f"{threads:>7} {rate:>10.0f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,12 +17,16 @@ setup(
         ]
     ),
     install_requires=[
+        "cryptography",
         "fastapi",
         "pyotp",
         "qrcode",
         "pillow"
     ],
     extras_require={
+        "sidecar": [
+            "uvicorn"
+        ],
         "dev": [
             "black",
             "fastapi-users",
@@ -35,6 +39,11 @@ setup(
             "sqlalchemy"
         ]
     },
+    entry_points={
+        "console_scripts": [
+            "two-fast-auth-sidecar=two_fast_auth.sidecar:main"
+        ]
+    },
     python_requires=">=3.10",
     author="Renzo Franceschini",
     author_email="rennf93@gmail.com",
@@ -1,6 +1,9 @@
 from cryptography.fernet import Fernet
 import pytest
-from fastapi import FastAPI
+from fastapi import (
+    FastAPI,
+    Request
+)
 from fastapi.testclient import TestClient
 from two_fast_auth import (
     TwoFactorAuth,
@@ -65,6 +68,52 @@ def mock_user():
     return MockUser()
 
 
+@pytest.fixture
+def make_request():
+    """Factory for a request as the authentication middleware leaves it
+
+    ``user`` may be a user object or just an id; ``code`` goes in the
+    default 2FA header.
+    """
+    def _make_request(
+        user=None,
+        code=None,
+        *,
+        path="/protected",
+        client="203.0.113.7"
+    ):
+        if isinstance(user, str):
+            user = type("User", (), {"id": user, "is_authenticated": True})()
+        return Request(scope={
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "headers": [(b"x-2fa-code", code.encode())] if code else [],
+            "client": (client, 1234) if client else None,
+            "user": user
+        })
+
+    return _make_request
+
+
+@pytest.fixture
+def authenticate(mock_user):
+    """Sign every HTTP and WebSocket connection to an app in as mock_user"""
+    class AuthenticatedUser:
+        def __init__(self, app):
+            self.app = app
+
+        async def __call__(self, scope, receive, send):
+            if scope["type"] in ("http", "websocket"):
+                scope["user"] = mock_user
+            await self.app(scope, receive, send)
+
+    def _authenticate(app):
+        app.add_middleware(AuthenticatedUser)
+
+    return _authenticate
+
+
 @pytest.fixture
 def valid_encryption_key():
     return Fernet.generate_key()
@@ -0,0 +1,163 @@
+import gc
+import tracemalloc
+import pytest
+import pyotp
+from fastapi import Response
+from two_fast_auth import (
+    SecretCache,
+    TwoFactorMiddleware
+)
+
+
+
+# Recorded per-request budgets for one ``dispatch`` pass:
+# (peak traced bytes, blocks still allocated afterwards).
+# Raise these only on purpose, never to make a regression pass.
+ALLOCATION_BUDGETS = {
+    "excluded": (2048, 8),
+    "anonymous": (2048, 8),
+    "cache_hit": (4096, 32),
+    "cold": (8192, 32),
+}
+
+_TRACEMALLOC_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__)
+]
+
+
+async def _call_next(request):
+    return Response("OK")
+
+
+async def _measure(middleware, request):
+    """Peak bytes and retained blocks of a single dispatch pass"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+
+        response = await middleware.dispatch(request, _call_next)
+        assert response.status_code == 200
+        del response
+
+        _, peak = tracemalloc.get_traced_memory()
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    before = before.filter_traces(_TRACEMALLOC_FILTERS)
+    after = after.filter_traces(_TRACEMALLOC_FILTERS)
+    retained = sum(
+        stat.count_diff
+        for stat in after.compare_to(before, "lineno")
+        if stat.count_diff > 0
+    )
+    return peak - baseline, retained
+
+
+def _assert_within_budget(name, measured):
+    peak_bytes, blocks = measured
+    max_bytes, max_blocks = ALLOCATION_BUDGETS[name]
+    assert peak_bytes <= max_bytes, (
+        f"{name}: peak {peak_bytes} B exceeds budget of {max_bytes} B"
+    )
+    assert blocks <= max_blocks, (
+        f"{name}: {blocks} retained blocks exceed budget of {max_blocks}"
+    )
+
+
+@pytest.fixture
+def budget_user(mock_user):
+    mock_user.id = "user_with_2fa"
+    return mock_user
+
+
+@pytest.fixture
+def make_middleware(test_app, mock_get_user_secret):
+    def _make(**verifier_options):
+        return TwoFactorMiddleware(
+            app=test_app,
+            get_user_secret_callback=mock_get_user_secret,
+            excluded_paths=["/excluded"],
+            **verifier_options
+        )
+    return _make
+
+
+@pytest.fixture
+async def warmed_middleware(
+    make_middleware,
+    budget_user,
+    make_request
+):
+    """Middleware after one pass of every scenario, so one-time
+    interpreter and import costs never count against a budget"""
+    middleware = make_middleware(secret_cache=SecretCache())
+    code = pyotp.TOTP("SECRETEXAMPLE").now()
+    # The verified request runs twice: cold, then from the caches
+    for request in (
+        make_request(budget_user, path="/excluded"),
+        make_request(),
+        make_request(budget_user, code),
+        make_request(budget_user, code)
+    ):
+        await middleware.dispatch(request, _call_next)
+    return middleware
+
+
+@pytest.mark.asyncio
+async def test_excluded_path_allocation_budget(
+    warmed_middleware,
+    budget_user,
+    make_request
+):
+    measured = await _measure(
+        warmed_middleware,
+        make_request(budget_user, path="/excluded")
+    )
+    _assert_within_budget("excluded", measured)
+
+
+@pytest.mark.asyncio
+async def test_anonymous_request_allocation_budget(
+    warmed_middleware,
+    make_request
+):
+    measured = await _measure(
+        warmed_middleware,
+        make_request()
+    )
+    _assert_within_budget("anonymous", measured)
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_verified_allocation_budget(
+    warmed_middleware,
+    budget_user,
+    make_request
+):
+    code = pyotp.TOTP("SECRETEXAMPLE").now()
+    measured = await _measure(
+        warmed_middleware,
+        make_request(budget_user, code)
+    )
+    _assert_within_budget("cache_hit", measured)
+
+
+@pytest.mark.asyncio
+async def test_cold_verified_allocation_budget(
+    warmed_middleware,
+    make_middleware,
+    budget_user,
+    make_request
+):
+    code = pyotp.TOTP("SECRETEXAMPLE").now()
+    measured = await _measure(
+        make_middleware(),
+        make_request(budget_user, code)
+    )
+    _assert_within_budget("cold", measured)
@@ -0,0 +1,248 @@
+import asyncio
+import json
+import pytest
+import pyotp
+from fastapi import (
+    FastAPI,
+    HTTPException
+)
+from fastapi.testclient import TestClient
+from two_fast_auth import (
+    AuditEvent,
+    AuditQueue,
+    CallbackAuditSink,
+    JsonlAuditSink,
+    TwoFactorMiddleware,
+    TwoFactorVerifier
+)
+from two_fast_auth.audit import AuditBatch
+
+
+
+class RecordingSink:
+    def __init__(self):
+        self.batches = []
+
+    async def write(self, batch):
+        self.batches.append(batch)
+
+
+def _event(user_id, outcome="success", timestamp=1.0):
+    return AuditEvent(
+        user_id,
+        outcome,
+        200 if outcome == "success" else 401,
+        "/",
+        timestamp=timestamp
+    )
+
+
+@pytest.mark.asyncio
+async def test_verifier_emits_success_and_failure(
+    mock_get_user_secret,
+    mock_user,
+    make_request
+):
+    sink = RecordingSink()
+    audit = AuditQueue(sink)
+    verifier = TwoFactorVerifier(mock_get_user_secret, audit=audit)
+
+    await verifier.verify_request(
+        make_request(mock_user, pyotp.TOTP("SECRETEXAMPLE").now())
+    )
+    with pytest.raises(HTTPException):
+        await verifier.verify_request(make_request(mock_user, "000000"))
+    mock_user.id = "user_no_2fa"
+    await verifier.verify_request(make_request(mock_user))
+    await audit.close()
+
+    events = [event for batch in sink.batches for event in batch.events]
+    assert [(e.outcome, e.status_code) for e in events] == [
+        ("success", 200),
+        ("failure", 401)
+    ]
+    assert events[0].user_id == "user_with_2fa"
+    assert events[0].client == "203.0.113.7"
+    assert events[1].detail == "Invalid or missing 2FA code"
+    last_used = sink.batches[0].last_used
+    assert last_used == {"user_with_2fa": events[0].timestamp}
+    assert verifier.metrics()["audit"]["written"] == 2
+
+
+@pytest.mark.asyncio
+async def test_last_used_is_coalesced_per_user():
+    sink = RecordingSink()
+    audit = AuditQueue(sink)
+    audit.emit(_event("alice", timestamp=1.0))
+    audit.emit(_event("alice", timestamp=3.0))
+    audit.emit(_event("alice", timestamp=2.0))
+    audit.emit(_event("bob", "failure", timestamp=4.0))
+    await audit.close()
+
+    assert len(sink.batches) == 1
+    assert len(sink.batches[0].events) == 4
+    assert sink.batches[0].last_used == {"alice": 3.0}
+    assert audit.stats()["coalesced"] == 2
+
+
+@pytest.mark.asyncio
+async def test_full_batch_flushes_without_waiting():
+    sink = RecordingSink()
+    audit = AuditQueue(sink, batch_size=2, flush_interval=60)
+    audit.emit(_event("alice"))
+    audit.emit(_event("bob"))
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert [len(batch.events) for batch in sink.batches] == [2]
+    await audit.close()
+
+
+def test_a_flusher_left_in_another_loop_is_cancelled():
+    sink = RecordingSink()
+    audit = AuditQueue(sink, flush_interval=60)
+
+    async def emit():
+        audit.emit(_event("alice"))
+        return audit._flusher
+
+    first_loop = asyncio.new_event_loop()
+    first = first_loop.run_until_complete(emit())
+
+    async def emit_and_close():
+        assert await emit() is not first
+        await audit.close()
+
+    asyncio.run(emit_and_close())
+    first_loop.run_until_complete(asyncio.wait([first]))
+    assert first.cancelled()
+    first_loop.close()
+    assert [len(batch.events) for batch in sink.batches] == [2]
+
+
+@pytest.mark.asyncio
+async def test_interval_flushes_partial_batches():
+    sink = RecordingSink()
+    audit = AuditQueue(sink, flush_interval=0.01)
+    audit.emit(_event("alice"))
+    await asyncio.sleep(0.05)
+    assert len(sink.batches) == 1
+    await audit.close()
+
+
+@pytest.mark.asyncio
+async def test_overflow_drops_new_events():
+    sink = RecordingSink()
+    audit = AuditQueue(sink, max_queue=2, flush_interval=60)
+    for user_id in ("a", "b", "c"):
+        audit.emit(_event(user_id, "failure"))
+    await audit.close()
+
+    assert [e.user_id for e in sink.batches[0].events] == ["a", "b"]
+    assert audit.stats()["dropped"] == 1
+    assert audit.stats()["emitted"] == 3
+
+
+@pytest.mark.asyncio
+async def test_overflow_drops_oldest_events():
+    sink = RecordingSink()
+    audit = AuditQueue(
+        sink,
+        max_queue=2,
+        flush_interval=60,
+        overflow="drop_oldest"
+    )
+    for user_id in ("a", "b", "c"):
+        audit.emit(_event(user_id, "failure"))
+    await audit.close()
+
+    assert [e.user_id for e in sink.batches[0].events] == ["b", "c"]
+    assert audit.stats()["dropped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sink_errors_are_counted():
+    class FailingSink:
+        async def write(self, batch):
+            raise RuntimeError("database down")
+
+    audit = AuditQueue(FailingSink())
+    audit.emit(_event("alice"))
+    await audit.close()
+
+    stats = audit.stats()
+    assert stats["sink_errors"] == 1
+    assert stats["dropped"] == 1
+    assert stats["written"] == 0
+    assert stats["queued"] == 0
+
+
+@pytest.mark.parametrize("options", [
+    {"overflow": "block"},
+    {"max_queue": 0},
+    {"batch_size": 0},
+    {"flush_interval": 0}
+])
+def test_invalid_options(options):
+    with pytest.raises(ValueError):
+        AuditQueue(RecordingSink(), **options)
+
+
+@pytest.mark.asyncio
+async def test_jsonl_sink_appends_events(tmp_path):
+    path = tmp_path / "audit.jsonl"
+    sink = JsonlAuditSink(str(path))
+    await sink.write(AuditBatch([_event("alice")], {"alice": 1.0}))
+    await sink.write(AuditBatch([_event("bob", "failure")], {}))
+    await sink.write(AuditBatch([], {"alice": 2.0}))
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(r["user_id"], r["outcome"]) for r in records] == [
+        ("alice", "success"),
+        ("bob", "failure")
+    ]
+
+
+@pytest.mark.asyncio
+async def test_callback_sink_accepts_async_and_sync_callbacks():
+    events = []
+    last_used = []
+
+    async def on_events(batch):
+        events.extend(batch)
+
+    sink = CallbackAuditSink(on_events, last_used.append)
+    await sink.write(AuditBatch([_event("alice")], {"alice": 1.0}))
+    await sink.write(AuditBatch([], {}))
+
+    assert [e.user_id for e in events] == ["alice"]
+    assert last_used == [{"alice": 1.0}]
+
+
+def test_middleware_flushes_audit_on_shutdown(
+    mock_get_user_secret,
+    authenticate
+):
+    sink = RecordingSink()
+    app = FastAPI()
+
+    @app.get("/protected")
+    async def protected():
+        return {}
+
+    app.add_middleware(
+        TwoFactorMiddleware,
+        get_user_secret_callback=mock_get_user_secret,
+        excluded_paths=[],
+        audit=AuditQueue(sink, flush_interval=60)
+    )
+
+    authenticate(app)
+
+    with TestClient(app) as client:
+        response = client.get(
+            "/protected",
+            headers={"X-2FA-Code": pyotp.TOTP("SECRETEXAMPLE").now()}
+        )
+        assert response.status_code == 200
+        assert sink.batches == []
+    assert [e.outcome for e in sink.batches[0].events] == ["success"]
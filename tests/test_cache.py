@@ -0,0 +1,314 @@
+import asyncio
+import pytest
+import pyotp
+from cryptography.fernet import Fernet
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from two_fast_auth import (
+    DriftTracker,
+    SecretCache,
+    TwoFactorAuth,
+    TwoFactorMiddleware,
+    TwoFactorVerifier
+)
+
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _loader(values, calls):
+    async def load():
+        calls.append(1)
+        return values.pop(0)
+    return load
+
+
+async def _drain(cache):
+    """Let the background refresher process its queue"""
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_fresh_entries_are_served_from_cache():
+    cache = SecretCache(ttl=10, jitter=0, clock=FakeClock())
+    calls = []
+    load = _loader(["a"], calls)
+    assert await cache.get("u", load) == "a"
+    assert await cache.get("u", load) == "a"
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_entry_is_served_while_refreshing():
+    clock = FakeClock()
+    cache = SecretCache(ttl=10, grace=5, jitter=0, clock=clock)
+    calls = []
+    load = _loader(["old", "new"], calls)
+    await cache.get("u", load)
+
+    clock.now += 12
+    assert await cache.get("u", load) == "old"
+    assert await cache.get("u", load) == "old"
+    await _drain(cache)
+    assert len(calls) == 2
+    assert await cache.get("u", load) == "new"
+    assert cache.stats()["refreshes"] == 1
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_expired_entry_is_loaded_on_the_request_path():
+    clock = FakeClock()
+    cache = SecretCache(ttl=10, grace=5, jitter=0, clock=clock)
+    calls = []
+    load = _loader(["old", "new"], calls)
+    await cache.get("u", load)
+
+    clock.now += 20
+    assert await cache.get("u", load) == "new"
+    assert cache.stats()["misses"] == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_refresh_keeps_stale_value():
+    clock = FakeClock()
+    cache = SecretCache(ttl=10, grace=5, jitter=0, clock=clock)
+    await cache.get("u", _loader(["old"], []))
+
+    async def broken():
+        raise RuntimeError("db down")
+
+    clock.now += 12
+    assert await cache.get("u", broken) == "old"
+    await _drain(cache)
+    assert await cache.get("u", broken) == "old"
+    assert cache.stats()["refresh_errors"] == 1
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load():
+    cache = SecretCache()
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "a"
+
+    results = await asyncio.gather(*(cache.get("u", slow) for _ in range(5)))
+    assert results == ["a"] * 5
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_refresh_queue_is_bounded():
+    clock = FakeClock()
+    cache = SecretCache(
+        ttl=10,
+        jitter=0,
+        max_pending_refreshes=1,
+        clock=clock
+    )
+    for key in ("a", "b"):
+        await cache.get(key, _loader([key, key], []))
+
+    clock.now += 12
+    await cache.get("a", _loader(["a"], []))
+    await cache.get("b", _loader(["b"], []))
+    assert cache.stats()["refresh_dropped"] == 1
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_invalidate_discards_running_refresh():
+    clock = FakeClock()
+    cache = SecretCache(ttl=10, grace=5, jitter=0, clock=clock)
+    await cache.get("u", _loader(["old"], []))
+    release = asyncio.Event()
+
+    async def slow_refresh():
+        await release.wait()
+        return "stale-refresh"
+
+    clock.now += 12
+    await cache.get("u", slow_refresh)
+    await asyncio.sleep(0)
+    cache.invalidate("u")
+    release.set()
+    await _drain(cache)
+
+    assert len(cache) == 0
+    assert await cache.get("u", _loader(["reset"], [])) == "reset"
+    await cache.close()
+
+
+def test_jitter_spreads_expiry():
+    cache = SecretCache(ttl=100, jitter=0.5, clock=FakeClock())
+    for key in range(50):
+        cache._store(key, "s")
+    expiries = {cache._entries.get(key)[1] for key in range(50)}
+    assert len(expiries) > 1
+    assert all(1050 <= expiry <= 1100 for expiry in expiries)
+
+
+def test_invalid_cache_configuration():
+    with pytest.raises(ValueError):
+        SecretCache(ttl=0)
+    with pytest.raises(ValueError):
+        SecretCache(grace=-1)
+    with pytest.raises(ValueError):
+        SecretCache(jitter=1)
+    with pytest.raises(ValueError):
+        SecretCache(max_pending_refreshes=0)
+
+
+@pytest.mark.asyncio
+async def test_verifier_caches_lookups_and_invalidates(
+    mock_user,
+    make_request
+):
+    secrets = {"user_with_2fa": "SECRETEXAMPLE"}
+    calls = []
+
+    async def get_secret(user_id):
+        calls.append(user_id)
+        return secrets.get(user_id)
+
+    verifier = TwoFactorVerifier(
+        get_secret,
+        secret_cache=SecretCache(),
+        drift_tracker=DriftTracker()
+    )
+
+    def request(secret):
+        return make_request(mock_user, pyotp.TOTP(secret).now())
+
+    await verifier.verify_request(request("SECRETEXAMPLE"))
+    await verifier.verify_request(request("SECRETEXAMPLE"))
+    assert len(calls) == 1
+    assert verifier.metrics()["secret_cache"]["hits"] == 1
+
+    secrets["user_with_2fa"] = "NEWSECRETEXAMPLE"
+    verifier.invalidate("user_with_2fa")
+    result = await verifier.verify_request(request("NEWSECRETEXAMPLE"))
+    assert result.user_id == "user_with_2fa"
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_load_is_not_cached():
+    cache = SecretCache()
+
+    async def broken():
+        raise RuntimeError("db down")
+
+    with pytest.raises(RuntimeError):
+        await cache.get("u", broken)
+    assert len(cache) == 0
+    assert await cache.get("u", _loader(["a"], [])) == "a"
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_invalidate_while_queued_skips_refresh():
+    clock = FakeClock()
+    cache = SecretCache(ttl=10, grace=5, jitter=0, clock=clock)
+    calls = []
+    await cache.get("u", _loader(["old"], []))
+
+    clock.now += 12
+    await cache.get("u", _loader(["new"], calls))
+    cache.invalidate("u")
+    await _drain(cache)
+    assert calls == []
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_leaves_the_load_to_the_others():
+    cache = SecretCache()
+    release = asyncio.Event()
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await release.wait()
+        return "secret"
+
+    owner = asyncio.create_task(cache.get("u", slow))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(cache.get("u", slow))
+    await asyncio.sleep(0)
+    owner.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await owner
+
+    release.set()
+    assert await waiter == "secret"
+    assert await cache.get("u", slow) == "secret"
+    assert calls == [1]
+
+
+@pytest.mark.asyncio
+async def test_cached_secret_is_decrypted_once(
+    mocker,
+    mock_user,
+    make_request
+):
+    key = Fernet.generate_key()
+    secrets = {
+        "user_with_2fa": TwoFactorAuth.encrypt_secret("SECRETEXAMPLE", key)
+    }
+
+    async def get_secret(user_id):
+        return secrets[user_id]
+
+    verifier = TwoFactorVerifier(
+        get_secret,
+        encryption_key=key,
+        secret_cache=SecretCache()
+    )
+
+    def request(secret):
+        return make_request(mock_user, pyotp.TOTP(secret).now())
+
+    decrypt = mocker.spy(TwoFactorAuth, "decrypt_secret")
+    await verifier.verify_request(request("SECRETEXAMPLE"))
+    await verifier.verify_request(request("SECRETEXAMPLE"))
+    assert decrypt.call_count == 1
+
+    # A rotated secret reaching the cache is decrypted afresh
+    secrets["user_with_2fa"] = TwoFactorAuth.encrypt_secret(
+        "NEWSECRETEXAMPLE",
+        key
+    )
+    verifier.secret_cache.invalidate("user_with_2fa")
+    await verifier.verify_request(request("NEWSECRETEXAMPLE"))
+    assert decrypt.call_count == 2
+
+
+def test_middleware_stops_the_refresher(mock_get_user_secret):
+    cache = SecretCache(ttl=10, grace=5, jitter=0, clock=FakeClock())
+    app = FastAPI()
+    app.add_middleware(
+        TwoFactorMiddleware,
+        get_user_secret_callback=mock_get_user_secret,
+        secret_cache=cache
+    )
+    with TestClient(app) as client:
+        client.portal.call(cache.get, "u", _loader(["old"], []))
+        cache._clock.now += 12
+        client.portal.call(cache.get, "u", _loader(["new"], []))
+        assert cache._refresher is not None
+    assert cache._refresher is None
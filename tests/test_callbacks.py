@@ -0,0 +1,222 @@
+import asyncio
+import functools
+import threading
+import warnings
+import pytest
+import pyotp
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    status
+)
+from fastapi.testclient import TestClient
+from two_fast_auth import (
+    CallbackPool,
+    LookupLimiter,
+    SnapshotResolver,
+    TwoFactorMiddleware,
+    TwoFactorVerifier
+)
+from two_fast_auth.callbacks import is_async_callable
+from two_fast_auth.limits import LookupRejected
+
+
+
+def test_async_callable_detection(tmp_path):
+    async def lookup(user_id):
+        return None
+
+    def sync_lookup(user_id):
+        return None
+
+    assert is_async_callable(lookup)
+    assert is_async_callable(functools.partial(lookup))
+    assert is_async_callable(SnapshotResolver(str(tmp_path / "s")))
+    assert not is_async_callable(sync_lookup)
+    assert not is_async_callable(lambda user_id: None)
+
+
+@pytest.mark.asyncio
+async def test_sync_callback_runs_in_pool(mock_user, make_request):
+    loop_thread = threading.get_ident()
+    threads = []
+
+    def get_secret(user_id):
+        threads.append(threading.current_thread().name)
+        assert threading.get_ident() != loop_thread
+        return "SECRETEXAMPLE"
+
+    verifier = TwoFactorVerifier(get_secret)
+    result = await verifier.verify_request(
+        make_request(mock_user, pyotp.TOTP("SECRETEXAMPLE").now())
+    )
+
+    assert result.user_id == "user_with_2fa"
+    assert threads[0].startswith("two-fast-auth")
+    assert verifier.metrics()["callback_pool"]["completed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_async_callback_does_not_create_pool(mock_get_user_secret):
+    verifier = TwoFactorVerifier(mock_get_user_secret)
+    assert verifier.callback_pool is None
+    assert "callback_pool" not in verifier.metrics()
+
+
+@pytest.mark.asyncio
+async def test_saturated_pool_rejects_calls():
+    pool = CallbackPool(1, max_queue=1)
+    release = threading.Event()
+
+    tasks = [
+        asyncio.create_task(pool.run(release.wait))
+        for _ in range(2)
+    ]
+    await asyncio.sleep(0.05)
+    assert pool.stats()["active"] == 1
+    assert pool.stats()["queued"] == 1
+
+    with pytest.raises(LookupRejected):
+        await pool.run(release.wait)
+    assert pool.stats()["rejected"] == 1
+
+    release.set()
+    await asyncio.gather(*tasks)
+    stats = pool.stats()
+    assert stats["active"] == stats["queued"] == 0
+    assert stats["completed"] == 2
+    assert stats["peak_queued"] >= 1
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_saturated_pool_returns_503(mock_user, make_request):
+    release = threading.Event()
+
+    def get_secret(user_id):
+        release.wait()
+        return "SECRETEXAMPLE"
+
+    verifier = TwoFactorVerifier(
+        get_secret,
+        callback_pool=CallbackPool(1, max_queue=0)
+    )
+    code = pyotp.TOTP("SECRETEXAMPLE").now()
+    first = asyncio.create_task(
+        verifier.verify_request(make_request(mock_user, code))
+    )
+    await asyncio.sleep(0.05)
+
+    with pytest.raises(HTTPException) as exc:
+        await verifier.verify_request(make_request(mock_user, code))
+    assert exc.value.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+    release.set()
+    assert (await first).user_id == "user_with_2fa"
+    verifier.callback_pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_callers_release_their_slots(mock_user, make_request):
+    started = threading.Event()
+    release = threading.Event()
+
+    def get_secret(user_id):
+        started.set()
+        release.wait()
+        return "SECRETEXAMPLE"
+
+    pool = CallbackPool(1, max_queue=2)
+    verifier = TwoFactorVerifier(
+        get_secret,
+        callback_pool=pool,
+        lookup_limiter=LookupLimiter(timeout=0.05)
+    )
+    # Hold the only thread before any verification times out
+    holder = asyncio.create_task(pool.run(get_secret, "holder"))
+    assert await asyncio.to_thread(started.wait, 5)
+
+    code = pyotp.TOTP("SECRETEXAMPLE").now()
+    for _ in range(3):
+        with pytest.raises(HTTPException) as exc:
+            await verifier.verify_request(make_request(mock_user, code))
+        assert exc.value.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+    # The holder keeps the thread; the timed-out calls left the queue
+    assert pool.stats()["active"] == 1
+    assert pool.stats()["queued"] == 0
+    assert pool.stats()["rejected"] == 0
+
+    release.set()
+    assert await holder == "SECRETEXAMPLE"
+    assert (
+        await verifier.verify_request(make_request(mock_user, code))
+    ).user_id == "user_with_2fa"
+    assert pool.stats()["active"] == pool.stats()["queued"] == 0
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_sync_callback_returning_an_awaitable(mock_user, make_request):
+    async def fetch(user_id):
+        return "SECRETEXAMPLE"
+
+    verifier = TwoFactorVerifier(lambda user_id: fetch(user_id))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        result = await verifier.verify_request(
+            make_request(mock_user, pyotp.TOTP("SECRETEXAMPLE").now())
+        )
+    assert result.user_id == "user_with_2fa"
+    verifier.callback_pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_callback_errors_propagate():
+    pool = CallbackPool(1)
+
+    def broken():
+        raise RuntimeError("ldap down")
+
+    with pytest.raises(RuntimeError):
+        await pool.run(broken)
+    assert pool.stats()["active"] == 0
+    pool.shutdown()
+
+
+def test_invalid_pool_configuration():
+    with pytest.raises(ValueError):
+        CallbackPool(0)
+    with pytest.raises(ValueError):
+        CallbackPool(max_queue=-1)
+
+
+def test_middleware_stops_the_pool_threads(mock_user, authenticate):
+    pool = CallbackPool(2, thread_name_prefix="pool-under-test")
+    app = FastAPI()
+
+    @app.get("/protected")
+    async def protected():
+        return {}
+
+    app.add_middleware(
+        TwoFactorMiddleware,
+        get_user_secret_callback=lambda user_id: "SECRETEXAMPLE",
+        callback_pool=pool
+    )
+    authenticate(app)
+
+    def pool_threads():
+        return [
+            thread for thread in threading.enumerate()
+            if thread.name.startswith("pool-under-test")
+        ]
+
+    for _ in range(2):
+        with TestClient(app) as client:
+            assert client.get(
+                "/protected",
+                headers={"X-2FA-Code": pyotp.TOTP("SECRETEXAMPLE").now()}
+            ).status_code == 200
+            assert pool_threads()
+        assert pool_threads() == []
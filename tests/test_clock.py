@@ -0,0 +1,63 @@
+import pytest
+from two_fast_auth import (
+    StepClock,
+    TwoFactorAuth,
+    TwoFactorMiddleware
+)
+
+
+
+def test_tick_is_cached_within_a_step():
+    now = [1_000_000.0]
+    clock = StepClock(clock=lambda: now[0])
+    tick = clock.tick()
+
+    now[0] = 1_000_019.9
+    assert clock.tick() is tick
+    assert tick.step == 1_000_000 // 30
+
+    now[0] = 1_000_020.0
+    assert clock.step() == tick.step + 1
+
+
+def test_clock_moving_backwards_refreshes():
+    now = [1_000_000.0]
+    clock = StepClock(clock=lambda: now[0])
+    step = clock.step()
+
+    now[0] -= 60
+    assert clock.step() == step - 2
+
+
+def test_packed_counters():
+    clock = StepClock(window=1, clock=lambda: 30 * 5)
+    tick = clock.tick()
+
+    assert tick.counter() == (5).to_bytes(8, "big")
+    assert tick.counter(-1) == (4).to_bytes(8, "big")
+    assert tick.counter(1) == (6).to_bytes(8, "big")
+    assert tick.counter(3) == (8).to_bytes(8, "big")
+
+
+def test_shared_clock_per_interval():
+    assert StepClock.shared(30) is StepClock.shared(30)
+    assert StepClock.shared(60) is not StepClock.shared(30)
+    assert StepClock.shared(60).interval == 60
+
+
+def test_invalid_clock_configuration():
+    with pytest.raises(ValueError):
+        StepClock(0)
+    with pytest.raises(ValueError):
+        StepClock(window=-1)
+
+
+def test_clock_interval_must_match(test_app, mock_get_user_secret):
+    with pytest.raises(ValueError):
+        TwoFactorAuth(interval=60, clock=StepClock(30))
+    with pytest.raises(ValueError):
+        TwoFactorMiddleware(
+            app=test_app,
+            get_user_secret_callback=mock_get_user_secret,
+            clock=StepClock(60)
+        )
@@ -1,7 +1,11 @@
+import hashlib
 import pytest
 from io import BytesIO
 import pyotp
-from two_fast_auth import TwoFactorAuth
+from two_fast_auth import (
+    StepClock,
+    TwoFactorAuth
+)
 
 
 
@@ -70,3 +74,68 @@ def test_verify_code_edge_cases(two_factor_auth):
     assert two_factor_auth.verify_code("") is False
     assert two_factor_auth.verify_code("12345") is False  # 5 digits
     assert two_factor_auth.verify_code("1234567") is False  # 7 digits
+
+
+@pytest.mark.parametrize("algorithm", ["sha1", "sha256", "sha512"])
+def test_configurable_totp_parameters(algorithm):
+    """Test 8-digit codes with custom algorithm and interval"""
+    tfa = TwoFactorAuth(digits=8, interval=60, algorithm=algorithm)
+    totp = pyotp.TOTP(
+        tfa.secret,
+        digits=8,
+        interval=60,
+        digest=getattr(hashlib, algorithm)
+    )
+    assert tfa.verify_code(totp.now())
+    assert tfa.verify_code(totp.now()[:6]) is False
+
+
+def test_match_code_returns_time_step():
+    tfa = TwoFactorAuth(clock=StepClock(clock=lambda: 1_000_000))
+    code = pyotp.TOTP(tfa.secret).at(1_000_000)
+    assert tfa.match_code(code) == 1_000_000 // 30
+    assert tfa.match_code("000000" if code != "000000" else "111111") is None
+
+
+@pytest.mark.parametrize("options", [
+    {"digits": 5},
+    {"digits": 11},
+    {"interval": 0},
+    {"algorithm": "md5"},
+    {"mode": "motp"}
+])
+def test_invalid_otp_parameters(options):
+    """Test parameters are validated at construction"""
+    with pytest.raises(ValueError):
+        TwoFactorAuth(**options)
+
+
+def test_hotp_verification():
+    tfa = TwoFactorAuth(mode="hotp")
+    hotp = pyotp.HOTP(tfa.secret)
+    assert tfa.verify_code(hotp.at(7), counter=7)
+    assert tfa.verify_code(hotp.at(7), counter=8) is False
+
+    with pytest.raises(ValueError):
+        tfa.verify_code(hotp.at(7))
+
+
+def test_hotp_resync():
+    """Test look-ahead resynchronization returns the next counter"""
+    tfa = TwoFactorAuth(mode="hotp", digits=8, algorithm="sha256")
+    hotp = pyotp.HOTP(tfa.secret, digits=8, digest=hashlib.sha256)
+
+    assert tfa.resync_hotp(hotp.at(112), counter=100, look_ahead=20) == 113
+    assert tfa.resync_hotp(hotp.at(130), counter=100, look_ahead=20) is None
+    assert tfa.resync_hotp("123", counter=100) is None
+
+    with pytest.raises(ValueError):
+        tfa.resync_hotp(hotp.at(100), counter=100, look_ahead=-1)
+    with pytest.raises(ValueError):
+        TwoFactorAuth().resync_hotp("123456", counter=0)
+
+
+def test_hotp_provisioning_qr_code(mock_user):
+    tfa = TwoFactorAuth(mode="hotp")
+    qr_code = tfa.generate_qr_code(mock_user.email)
+    assert qr_code.getbuffer().nbytes > 0
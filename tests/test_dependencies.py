@@ -0,0 +1,110 @@
+import pytest
+import pyotp
+from fastapi import (
+    APIRouter,
+    Depends,
+    FastAPI,
+    status
+)
+from fastapi.testclient import TestClient
+from two_fast_auth import (
+    TwoFactorMiddleware,
+    TwoFactorVerifier,
+    require_2fa
+)
+
+
+
+class ScopeUserMiddleware:
+    """Stand-in for an authentication middleware"""
+
+    def __init__(self, app, user):
+        self.app = app
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope["user"] = self.user
+        await self.app(scope, receive, send)
+
+
+@pytest.fixture
+def dependency_client(test_app, mock_get_user_secret, mock_user):
+    router = APIRouter(
+        prefix="/secure",
+        dependencies=[Depends(require_2fa(mock_get_user_secret))]
+    )
+
+    @router.get("/data")
+    async def secure_data():
+        return {"message": "Protected"}
+
+    @test_app.get("/open")
+    async def open_route():
+        return {"message": "OK"}
+
+    test_app.include_router(router)
+    test_app.add_middleware(ScopeUserMiddleware, user=mock_user)
+    return TestClient(test_app)
+
+
+def test_dependency_only_protects_annotated_routes(dependency_client):
+    assert dependency_client.get("/open").status_code == status.HTTP_200_OK
+
+    response = dependency_client.get("/secure/data")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    response = dependency_client.get(
+        "/secure/data",
+        headers={"X-2FA-Code": pyotp.TOTP("SECRETEXAMPLE").now()}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+
+def test_dependency_resolves_settings_once(mock_get_user_secret, mocker):
+    build = mocker.spy(TwoFactorVerifier, "__init__")
+    dependency = require_2fa(mock_get_user_secret, header_name="X-OTP")
+    assert build.call_count == 1
+
+    app = FastAPI()
+
+    @app.get("/a", dependencies=[Depends(dependency)])
+    async def route_a():
+        return {}
+
+    @app.get("/b", dependencies=[Depends(dependency)])
+    async def route_b():
+        return {}
+
+    client = TestClient(app)
+    client.get("/a")
+    client.get("/b")
+    assert build.call_count == 1
+
+
+def test_dependency_validates_at_declaration(mock_get_user_secret):
+    with pytest.raises(ValueError) as exc:
+        require_2fa(mock_get_user_secret, encryption_key="invalid_key")
+    assert "Invalid encryption key" in str(exc.value)
+
+    with pytest.raises(ValueError):
+        require_2fa()
+
+    verifier = TwoFactorVerifier(mock_get_user_secret)
+    with pytest.raises(ValueError):
+        require_2fa(verifier=verifier, header_name="X-OTP")
+
+
+def test_shared_verifier_between_middleware_and_dependency(
+    test_app,
+    mock_get_user_secret
+):
+    verifier = TwoFactorVerifier(mock_get_user_secret)
+    middleware = TwoFactorMiddleware(test_app, verifier=verifier)
+    assert middleware.verifier is verifier
+    assert require_2fa(verifier=verifier) is not None
+
+    with pytest.raises(ValueError):
+        TwoFactorMiddleware(test_app)
+    with pytest.raises(ValueError):
+        TwoFactorMiddleware(test_app, verifier=verifier, digits=8)
@@ -0,0 +1,181 @@
+import pytest
+import pyotp
+from fastapi import (
+    HTTPException,
+    Response,
+    status
+)
+from two_fast_auth import (
+    DeviceCodeIndex,
+    StepClock,
+    TwoFactorAuth,
+    TwoFactorMiddleware
+)
+from two_fast_auth.devices import normalize_secrets
+
+
+
+PHONE = "JBSWY3DPEHPK3PXP"
+TABLET = "KRSXG5CTMVRXEZLU"
+
+
+def test_normalize_secrets():
+    assert normalize_secrets("SECRET") == {"0": "SECRET"}
+    assert normalize_secrets(["A", None, "B"]) == {"0": "A", "2": "B"}
+    assert normalize_secrets({"phone": "A", "old": ""}) == {"phone": "A"}
+
+
+def test_index_reports_matching_device():
+    index = DeviceCodeIndex(
+        {"phone": PHONE, "tablet": TABLET},
+        clock=StepClock(clock=lambda: 1_000_000)
+    )
+
+    assert len(index) == 2
+    assert index.match(pyotp.TOTP(TABLET).at(1_000_000)) == (
+        "tablet",
+        1_000_000 // 30
+    )
+    assert index.match(pyotp.TOTP(PHONE).at(1_000_000)) == (
+        "phone",
+        1_000_000 // 30
+    )
+    assert index.match(pyotp.TOTP(PHONE).at(1_000_000, 1)) is None
+    assert index.match("") is None
+    assert index.secret("tablet") == TABLET
+
+
+def test_index_is_built_once_per_step(mocker):
+    now = [1_000_000]
+    index = DeviceCodeIndex(
+        {"phone": PHONE, "tablet": TABLET},
+        window=1,
+        clock=StepClock(clock=lambda: now[0])
+    )
+    spy = mocker.spy(TwoFactorAuth, "_generate_packed")
+
+    for _ in range(5):
+        index.match(pyotp.TOTP(PHONE).at(1_000_000, -1))
+    assert spy.call_count == 6
+
+    now[0] = 1_000_030
+    assert index.match(pyotp.TOTP(PHONE).at(1_000_030, 1))
+    assert spy.call_count == 12
+
+
+def test_index_validation():
+    with pytest.raises(ValueError):
+        DeviceCodeIndex({})
+    with pytest.raises(ValueError):
+        DeviceCodeIndex({"phone": PHONE}, window=-1)
+
+
+@pytest.fixture
+def device_middleware(test_app, valid_encryption_key):
+    devices = {
+        "phone": TwoFactorAuth.encrypt_secret(PHONE, valid_encryption_key),
+        "tablet": TwoFactorAuth.encrypt_secret(TABLET, valid_encryption_key)
+    }
+
+    async def get_devices(user_id):
+        return devices if user_id == "user_with_2fa" else None
+
+    return TwoFactorMiddleware(
+        app=test_app,
+        get_user_secret_callback=get_devices,
+        encryption_key=valid_encryption_key,
+        excluded_paths=[]
+    )
+
+
+@pytest.mark.asyncio
+async def test_middleware_reports_matched_device(
+    device_middleware,
+    mock_user,
+    make_request
+):
+    seen = {}
+
+    async def call_next(request):
+        seen["device"] = request.state.two_fa.device_id
+        return Response("OK")
+
+    response = await device_middleware.dispatch(
+        make_request(mock_user, pyotp.TOTP(TABLET).now()),
+        call_next
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert seen["device"] == "tablet"
+
+
+@pytest.mark.asyncio
+async def test_middleware_rejects_unknown_device_code(
+    device_middleware,
+    mock_user,
+    make_request
+):
+    async def call_next(request):
+        return Response("OK")
+
+    for code in (None, "12345", "000000"):
+        with pytest.raises(HTTPException) as exc:
+            await device_middleware.dispatch(
+                make_request(mock_user, code),
+                call_next
+            )
+        assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_middleware_reuses_index_until_devices_change(
+    test_app,
+    mock_user,
+    mocker,
+    make_request
+):
+    devices = [PHONE]
+
+    async def get_devices(user_id):
+        return list(devices)
+
+    middleware = TwoFactorMiddleware(
+        app=test_app,
+        get_user_secret_callback=get_devices,
+        excluded_paths=[]
+    )
+    build = mocker.spy(DeviceCodeIndex, "__init__")
+
+    async def call_next(request):
+        return Response("OK")
+
+    for _ in range(3):
+        await middleware.dispatch(
+            make_request(mock_user, pyotp.TOTP(PHONE).now()),
+            call_next
+        )
+    assert build.call_count == 1
+
+    devices.append(TABLET)
+    await middleware.dispatch(
+        make_request(mock_user, pyotp.TOTP(TABLET).now()),
+        call_next
+    )
+    assert build.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_middleware_without_enrolled_devices(test_app, mock_user, make_request):
+    async def get_devices(user_id):
+        return [None]
+
+    middleware = TwoFactorMiddleware(
+        app=test_app,
+        get_user_secret_callback=get_devices,
+        excluded_paths=[]
+    )
+
+    async def call_next(request):
+        return Response("OK")
+
+    response = await middleware.dispatch(make_request(mock_user), call_next)
+    assert response.status_code == status.HTTP_200_OK
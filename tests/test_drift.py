@@ -0,0 +1,127 @@
+import pytest
+import pyotp
+from fastapi import (
+    Request,
+    Response,
+    status
+)
+from two_fast_auth import (
+    DriftTracker,
+    StepClock,
+    TwoFactorAuth,
+    TwoFactorMiddleware
+)
+
+
+
+def test_search_order_starts_at_learned_offset():
+    tracker = DriftTracker(max_window=2)
+    assert tracker.candidate_offsets("alice") == (0, 1, -1, 2, -2)
+
+    tracker.record("alice", -2)
+    assert tracker.candidate_offsets("alice") == (-2, -1, 0, 1, 2)
+
+
+def test_zero_offset_is_not_stored():
+    tracker = DriftTracker()
+    tracker.record("alice", 1)
+    assert len(tracker) == 1
+
+    tracker.record("alice", 0)
+    assert len(tracker) == 0
+    assert tracker.get_offset("alice") == 0
+
+
+def test_store_is_bounded():
+    tracker = DriftTracker(max_window=1, max_entries=2)
+    tracker.record("a", 1)
+    tracker.record("b", -1)
+    tracker.get_offset("a")
+    tracker.record("c", 1)
+
+    assert len(tracker) == 2
+    assert tracker.get_offset("b") == 0
+    assert tracker.get_offset("a") == 1
+
+
+def test_invalid_configuration():
+    with pytest.raises(ValueError):
+        DriftTracker(max_window=-1)
+    with pytest.raises(ValueError):
+        DriftTracker(max_entries=0)
+    with pytest.raises(ValueError):
+        DriftTracker(max_window=1).record("alice", 2)
+
+
+FIXED_CLOCK = StepClock(clock=lambda: 1_000_000)
+
+
+def test_drifted_code_is_learned():
+    tracker = DriftTracker(max_window=2)
+    tfa = TwoFactorAuth(drift_tracker=tracker, clock=FIXED_CLOCK)
+    drifted = pyotp.TOTP(tfa.secret).at(1_000_000, 2)
+
+    assert tfa.verify_code(drifted, "alice")
+    assert tracker.get_offset("alice") == 2
+
+    tracker.forget("alice")
+    assert tracker.get_offset("alice") == 0
+
+
+def test_drift_outside_window_fails():
+    tracker = DriftTracker(max_window=1)
+    tfa = TwoFactorAuth(drift_tracker=tracker, clock=FIXED_CLOCK)
+    totp = pyotp.TOTP(tfa.secret)
+
+    assert not tfa.verify_code(totp.at(1_000_000, 3), "alice")
+    assert tfa.verify_code(totp.at(1_000_000, -1), "alice")
+    assert tracker.get_offset("alice") == -1
+
+
+def test_learned_offset_costs_one_hmac(mocker):
+    tracker = DriftTracker(max_window=2)
+    tracker.record("alice", 1)
+    tfa = TwoFactorAuth(drift_tracker=tracker, clock=FIXED_CLOCK)
+    code = pyotp.TOTP(tfa.secret).at(1_000_000, 1)
+    spy = mocker.spy(TwoFactorAuth, "_generate_packed")
+
+    assert tfa.verify_code(code, "alice")
+    assert spy.call_count == 1
+
+
+def test_without_user_id_uses_default_window():
+    tfa = TwoFactorAuth(drift_tracker=DriftTracker())
+    assert tfa.verify_code(pyotp.TOTP(tfa.secret).now())
+
+
+@pytest.mark.asyncio
+async def test_middleware_accepts_drifted_code(
+    test_app,
+    mock_get_user_secret,
+    mock_user
+):
+    tracker = DriftTracker(max_window=1)
+    middleware = TwoFactorMiddleware(
+        app=test_app,
+        get_user_secret_callback=mock_get_user_secret,
+        excluded_paths=[],
+        drift_tracker=tracker,
+        clock=FIXED_CLOCK
+    )
+    code = pyotp.TOTP("SECRETEXAMPLE").at(1_000_000, 1)
+
+    async def call_next(request):
+        return Response("OK")
+
+    response = await middleware.dispatch(
+        Request(scope={
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "headers": [(b"x-2fa-code", code.encode())],
+            "user": mock_user
+        }),
+        call_next
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert tracker.get_offset("user_with_2fa") == 1
@@ -1,4 +1,5 @@
 import pytest
+import pyotp
 from cryptography.fernet import Fernet
 from fastapi import (
     Request,
@@ -10,6 +11,10 @@ from two_fast_auth import (
     TwoFactorAuth,
     TwoFactorMiddleware
 )
+from two_fast_auth.compact import (
+    COMPACT_PREFIX,
+    CompactCipher
+)
 
 
 
@@ -193,12 +198,13 @@ async def test_decryption_failure_handling(
         encryption_key=Fernet.generate_key()
     )
 
-    # Create request with encrypted secret
+    # Create request with encrypted secret and a well-formed code,
+    # so the request reaches the decryption stage
     request = Request(scope={
         "type": "http",
         "method": "GET",
         "path": "/protected",
-        "headers": [],
+        "headers": [(b"x-2fa-code", b"123456")],
         "user": type("User", (), {
             "id": "user_with_2fa",
             "is_authenticated": True
@@ -213,3 +219,119 @@ async def test_decryption_failure_handling(
 
     assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
     assert "Decryption failed" in str(exc.value.detail)
+
+
+class TestCompactFormat:
+    """Test suite for the compact AES-GCM format"""
+
+    def test_compact_cycle_and_size(self, valid_encryption_key):
+        """Compact tokens decrypt and are much shorter than Fernet"""
+        secret = pyotp.random_base32(32)
+        compact = TwoFactorAuth.encrypt_secret(
+            secret,
+            valid_encryption_key,
+            compact=True
+        )
+        fernet = TwoFactorAuth.encrypt_secret(secret, valid_encryption_key)
+
+        assert compact.startswith(COMPACT_PREFIX)
+        assert len(compact) < len(fernet) * 0.7
+        assert TwoFactorAuth.decrypt_secret(
+            compact,
+            valid_encryption_key
+        ) == secret
+
+    def test_fernet_tokens_still_decrypt(self, valid_encryption_key):
+        """Existing Fernet ciphertexts are detected and decrypted"""
+        token = Fernet(valid_encryption_key).encrypt(b"SECRET").decode()
+        assert TwoFactorAuth.decrypt_secret(
+            token,
+            valid_encryption_key
+        ) == "SECRET"
+
+    def test_nonces_are_unique(self, valid_encryption_key):
+        tokens = {
+            TwoFactorAuth.encrypt_secret(
+                "SECRET",
+                valid_encryption_key,
+                compact=True
+            )
+            for _ in range(50)
+        }
+        assert len(tokens) == 50
+
+    def test_key_id_identifies_the_key(self, valid_encryption_key):
+        """Decrypting with another key fails on the key id"""
+        token = TwoFactorAuth.encrypt_secret(
+            "SECRET",
+            valid_encryption_key,
+            compact=True
+        )
+        other_key = Fernet.generate_key()
+        assert CompactCipher(other_key).key_id not in token
+        with pytest.raises(ValueError, match="different key"):
+            TwoFactorAuth.decrypt_secret(token, other_key)
+
+    @pytest.mark.parametrize("tamper", [
+        lambda token: token[:-2] + ("AA" if token[-2:] != "AA" else "BB"),
+        lambda token: token[:20],
+        lambda token: token + "!!"
+    ])
+    def test_tampered_tokens_are_rejected(self, tamper, valid_encryption_key):
+        token = TwoFactorAuth.encrypt_secret(
+            "SECRET",
+            valid_encryption_key,
+            compact=True
+        )
+        with pytest.raises(ValueError, match="Decryption failed"):
+            TwoFactorAuth.decrypt_secret(tamper(token), valid_encryption_key)
+
+    def test_invalid_keys_are_rejected(self):
+        with pytest.raises(ValueError):
+            CompactCipher(b"short")
+        with pytest.raises(ValueError):
+            CompactCipher(b"!not base64!")
+        with pytest.raises(ValueError):
+            CompactCipher(b"c2l4dGVlbiBieXRlcyBrZXk=")
+        with pytest.raises(ValueError, match="Encryption failed"):
+            TwoFactorAuth.encrypt_secret("SECRET", "short", compact=True)
+
+    def test_cipher_rejects_other_formats(self, valid_encryption_key):
+        with pytest.raises(ValueError, match="Not a compact token"):
+            CompactCipher(valid_encryption_key).decrypt("gAAAAA")
+
+    @pytest.mark.asyncio
+    async def test_middleware_verifies_compact_secrets(
+        self,
+        test_app,
+        valid_encryption_key,
+        mock_user
+    ):
+        secret = pyotp.random_base32()
+        encrypted = TwoFactorAuth.encrypt_secret(
+            secret,
+            valid_encryption_key,
+            compact=True
+        )
+
+        async def get_secret(user_id):
+            return encrypted
+
+        middleware = TwoFactorMiddleware(
+            app=test_app,
+            get_user_secret_callback=get_secret,
+            encryption_key=valid_encryption_key
+        )
+        request = Request(scope={
+            "type": "http",
+            "method": "GET",
+            "path": "/protected",
+            "headers": [(b"x-2fa-code", pyotp.TOTP(secret).now().encode())],
+            "user": mock_user
+        })
+
+        async def call_next(request):
+            return Response("OK")
+
+        response = await middleware.dispatch(request, call_next)
+        assert response.status_code == status.HTTP_200_OK
@@ -0,0 +1,244 @@
+import asyncio
+import pytest
+import pyotp
+from fastapi import (
+    FastAPI,
+    HTTPException
+)
+from fastapi.testclient import TestClient
+from two_fast_auth import (
+    EnrollmentFilter,
+    TwoFactorMiddleware,
+    TwoFactorVerifier
+)
+
+
+
+async def _ids(ids):
+    for user_id in ids:
+        yield user_id
+
+
+def test_sizing_follows_the_target_rate():
+    enrollment = EnrollmentFilter(1000, false_positive_rate=0.01)
+    assert enrollment.size == 9586
+    assert enrollment.hashes == 7
+    assert enrollment.estimated_false_positive_rate() == 0
+
+
+@pytest.mark.parametrize("options", [
+    {"capacity": 0},
+    {"capacity": 10, "false_positive_rate": 0},
+    {"capacity": 10, "false_positive_rate": 1}
+])
+def test_invalid_options(options):
+    with pytest.raises(ValueError):
+        EnrollmentFilter(**options)
+
+
+@pytest.mark.asyncio
+async def test_no_false_negatives_and_a_bounded_false_positive_rate(mocker):
+    mocker.patch("two_fast_auth.enrollment.LOAD_BATCH", 1000)
+    enrollment = EnrollmentFilter(5000, false_positive_rate=0.01)
+    assert await enrollment.load(f"user{i}" for i in range(5000)) == 5000
+
+    assert all(f"user{i}" in enrollment for i in range(5000))
+    false_positives = sum(
+        enrollment.might_be_enrolled(f"other{i}") for i in range(20000)
+    )
+    assert false_positives / 20000 < 0.02
+    assert enrollment.estimated_false_positive_rate() == pytest.approx(
+        0.01,
+        rel=0.1
+    )
+    assert enrollment.skipped == 20000 - false_positives
+
+
+@pytest.mark.asyncio
+async def test_add_and_remove():
+    enrollment = EnrollmentFilter(100)
+    await enrollment.load(_ids(["alice"]))
+    enrollment.add("bob")
+    assert "bob" in enrollment
+    assert len(enrollment) == 2
+
+    enrollment.remove("bob")
+    enrollment.remove("carol")
+    assert "bob" not in enrollment
+    assert "alice" in enrollment
+    assert 42 not in enrollment
+    assert len(enrollment) == 1
+
+
+@pytest.mark.asyncio
+async def test_saturated_counters_are_never_decremented():
+    enrollment = EnrollmentFilter(1)
+    for _ in range(300):
+        enrollment.add("alice")
+    for _ in range(300):
+        enrollment.remove("alice")
+    assert "alice" in enrollment
+
+
+@pytest.mark.asyncio
+async def test_enrollments_during_a_load_are_kept():
+    enrollment = EnrollmentFilter(100)
+    release = asyncio.Event()
+
+    async def slow_ids():
+        yield "alice"
+        await release.wait()
+        yield "bob"
+
+    load = asyncio.create_task(enrollment.load(slow_ids()))
+    await asyncio.sleep(0)
+    assert enrollment.might_be_enrolled("carol")  # not ready yet
+    enrollment.add("carol")
+    release.set()
+    assert await load == 2
+
+    assert all(
+        user_id in enrollment for user_id in ("alice", "bob", "carol")
+    )
+    assert len(enrollment) == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_load_is_counted_and_keeps_contents():
+    enrollment = EnrollmentFilter(100)
+    await enrollment.load(["alice"])
+
+    async def broken():
+        yield "bob"
+        raise RuntimeError("database down")
+
+    with pytest.raises(RuntimeError):
+        await enrollment.load(broken())
+    assert "alice" in enrollment
+    assert enrollment.stats()["load_errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_verifier_skips_lookups_for_users_not_enrolled(make_request):
+    secret = pyotp.random_base32()
+    calls = []
+
+    async def get_secret(user_id):
+        calls.append(user_id)
+        return secret if user_id == "alice" else None
+
+    enrollment = EnrollmentFilter(1000)
+    verifier = TwoFactorVerifier(get_secret, enrollment_filter=enrollment)
+
+    # Not loaded yet: every lookup goes through
+    assert await verifier.verify_request(make_request("bob")) is None
+    assert calls == ["bob"]
+
+    await enrollment.load(["alice"])
+    assert await verifier.verify_request(make_request("bob")) is None
+    assert calls == ["bob"]
+    with pytest.raises(HTTPException):
+        await verifier.verify_request(make_request("alice"))
+    result = await verifier.verify_request(
+        make_request("alice", pyotp.TOTP(secret).now())
+    )
+    assert result.user_id == "alice"
+
+    enrollment.add("dave")
+    assert await verifier.verify_request(make_request("dave")) is None
+    stats = verifier.metrics()["enrollment_filter"]
+    assert stats["skipped"] == 1
+    assert stats["false_positives"] == 1
+    assert stats["observed_false_positive_rate"] == 0.5
+
+
+def test_middleware_loads_and_refreshes_the_filter(mock_get_user_secret):
+    loads = []
+
+    def enrolled_ids():
+        loads.append(1)
+        if len(loads) == 2:
+            raise RuntimeError("database down")
+        return ["user_with_2fa"]
+
+    enrollment = EnrollmentFilter(100)
+    app = FastAPI()
+    app.add_middleware(
+        TwoFactorMiddleware,
+        get_user_secret_callback=mock_get_user_secret,
+        enrollment_filter=enrollment,
+        enrollment_source=enrolled_ids,
+        enrollment_refresh_interval=0.01
+    )
+    with TestClient(app) as client:
+        assert enrollment.ready
+        assert "user_with_2fa" in enrollment
+        while len(loads) < 3:
+            client.portal.call(asyncio.sleep, 0.01)
+    assert enrollment.load_errors == 1
+
+
+def test_failed_startup_load_leaves_the_filter_cold(mock_get_user_secret):
+    def enrolled_ids():
+        raise RuntimeError("database down")
+
+    enrollment = EnrollmentFilter(100)
+    app = FastAPI()
+    app.add_middleware(
+        TwoFactorMiddleware,
+        get_user_secret_callback=mock_get_user_secret,
+        enrollment_filter=enrollment,
+        enrollment_source=enrolled_ids
+    )
+    with TestClient(app):
+        assert not enrollment.ready
+        assert enrollment.might_be_enrolled("anyone")
+
+
+def test_middleware_refreshes_the_filter_by_default(
+    test_app,
+    mock_get_user_secret
+):
+    middleware = TwoFactorMiddleware(
+        test_app,
+        mock_get_user_secret,
+        enrollment_filter=EnrollmentFilter(10),
+        enrollment_source=lambda: []
+    )
+    assert middleware.enrollment_refresh_interval == 60.0
+
+    app = FastAPI()
+    app.add_middleware(
+        TwoFactorMiddleware,
+        get_user_secret_callback=mock_get_user_secret,
+        enrollment_filter=EnrollmentFilter(10),
+        enrollment_source=lambda: []
+    )
+    with TestClient(app) as client:
+        middleware = client.app.middleware_stack
+        while not isinstance(middleware, TwoFactorMiddleware):
+            middleware = middleware.app
+        assert middleware._enrollment_refresher is not None
+    assert middleware._enrollment_refresher is None
+
+
+@pytest.mark.parametrize("options", [
+    {"enrollment_source": lambda: []},
+    {
+        "enrollment_filter": EnrollmentFilter(10),
+        "enrollment_source": lambda: [],
+        "enrollment_refresh_interval": 0
+    }
+])
+def test_middleware_enrollment_validation(
+    test_app,
+    mock_get_user_secret,
+    options
+):
+    with pytest.raises(ValueError):
+        TwoFactorMiddleware(test_app, mock_get_user_secret, **options)
+
+
+@pytest.mark.asyncio
+async def test_load_enrollment_without_source(two_factor_middleware):
+    assert await two_factor_middleware.load_enrollment() is None
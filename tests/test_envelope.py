@@ -0,0 +1,214 @@
+import json
+import os
+import threading
+import time
+import pytest
+import pyotp
+from cryptography.fernet import Fernet
+from two_fast_auth import (
+    CachingKeyProvider,
+    LocalKMS,
+    TwoFactorAuth,
+    TwoFactorVerifier
+)
+from two_fast_auth.envelope import ENVELOPE_PREFIX
+
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def kms(tmp_path):
+    return LocalKMS(str(tmp_path / "kms.json"))
+
+
+def test_envelope_cycle(kms):
+    provider = CachingKeyProvider(kms)
+    secret = pyotp.random_base32()
+    token = TwoFactorAuth.encrypt_secret(secret, provider)
+
+    assert token.startswith(ENVELOPE_PREFIX)
+    assert TwoFactorAuth.decrypt_secret(token, provider) == secret
+    assert TwoFactorAuth.encrypt_secret(secret, provider) != token
+    assert kms.unwrap_calls == 1
+
+
+def test_tenants_get_their_own_data_keys(kms):
+    provider = CachingKeyProvider(kms)
+    acme = TwoFactorAuth.encrypt_secret("SECRET", provider, tenant="acme")
+    globex = TwoFactorAuth.encrypt_secret("SECRET", provider, tenant="globex")
+
+    assert acme.split(":")[1] == kms.current_key_id("acme")
+    assert globex.split(":")[1] == kms.current_key_id("globex")
+    assert acme.split(":")[1] != globex.split(":")[1]
+
+
+def test_unwrapped_keys_are_cached_with_ttl(kms):
+    clock = FakeClock()
+    provider = CachingKeyProvider(kms, ttl=10, clock=clock)
+    token = TwoFactorAuth.encrypt_secret("SECRET", provider)
+    for _ in range(20):
+        TwoFactorAuth.decrypt_secret(token, provider)
+    assert kms.unwrap_calls == 1
+
+    clock.now += 10
+    TwoFactorAuth.decrypt_secret(token, provider)
+    assert kms.unwrap_calls == 2
+    assert provider.stats()["unwraps"] == 2
+
+
+def test_concurrent_misses_unwrap_once(kms):
+    key_id = kms.create_data_key("default")
+    unwrap = kms.unwrap
+
+    def slow_unwrap(key_id, tenant):
+        time.sleep(0.05)
+        return unwrap(key_id, tenant)
+
+    kms.unwrap = slow_unwrap
+    provider = CachingKeyProvider(kms)
+    keys = []
+    threads = [
+        threading.Thread(
+            target=lambda: keys.append(provider.decryption_key(key_id))
+        )
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(keys)) == 1 and len(keys) == 8
+    assert kms.unwrap_calls == 1
+    assert provider._flights == {}
+
+
+def test_rotation_keeps_old_ciphertexts_readable(kms):
+    provider = CachingKeyProvider(kms)
+    old = TwoFactorAuth.encrypt_secret("OLD", provider)
+
+    kms.create_data_key("default")
+    provider.invalidate()
+    new = TwoFactorAuth.encrypt_secret("NEW", provider)
+
+    assert old.split(":")[1] != new.split(":")[1]
+    assert TwoFactorAuth.decrypt_secret(old, provider) == "OLD"
+    assert TwoFactorAuth.decrypt_secret(new, provider) == "NEW"
+    provider.invalidate(new.split(":")[1])
+    assert provider.stats()["cached_keys"] == 1
+
+
+def test_keys_survive_restart_and_other_processes(kms, tmp_path):
+    provider = CachingKeyProvider(kms)
+    token = TwoFactorAuth.encrypt_secret("SECRET", provider)
+
+    reopened = CachingKeyProvider(LocalKMS(kms.path))
+    assert TwoFactorAuth.decrypt_secret(token, reopened) == "SECRET"
+
+    # A key created by another process after this one loaded the file
+    other = LocalKMS(kms.path)
+    later = TwoFactorAuth.encrypt_secret(
+        "LATER",
+        CachingKeyProvider(other),
+        tenant="new-tenant"
+    )
+    assert TwoFactorAuth.decrypt_secret(
+        later,
+        provider,
+        tenant="new-tenant"
+    ) == "LATER"
+
+
+def test_data_keys_are_bound_to_their_tenant(kms):
+    provider = CachingKeyProvider(kms)
+    acme = TwoFactorAuth.encrypt_secret("SECRET", provider, tenant="acme")
+
+    # Rejected from the cache and, once it is gone, by the KMS itself
+    with pytest.raises(ValueError, match="does not belong to tenant globex"):
+        TwoFactorAuth.decrypt_secret(acme, provider, tenant="globex")
+    provider.invalidate()
+    with pytest.raises(ValueError, match="does not belong to tenant globex"):
+        TwoFactorAuth.decrypt_secret(acme, provider, tenant="globex")
+    assert TwoFactorAuth.decrypt_secret(acme, provider, tenant="acme") == "SECRET"
+
+
+def test_kms_file_is_private_and_keys_are_wrapped(kms):
+    key_id = kms.create_data_key("default")
+    assert os.stat(kms.path).st_mode & 0o077 == 0
+    with open(kms.path) as file:
+        state = json.load(file)
+    assert state["keys"][key_id]["tenant"] == "default"
+    assert len(state["keys"][key_id]["wrapped"]) > 43
+
+
+def test_decryption_errors(kms):
+    provider = CachingKeyProvider(kms)
+    token = TwoFactorAuth.encrypt_secret("SECRET", provider)
+
+    with pytest.raises(ValueError, match="Decryption failed"):
+        TwoFactorAuth.decrypt_secret(token[:-4] + "AAAA", provider)
+    with pytest.raises(ValueError, match="Unknown data key"):
+        TwoFactorAuth.decrypt_secret("e1:missing:AAAA", provider)
+    with pytest.raises(ValueError, match="Invalid envelope token"):
+        TwoFactorAuth.decrypt_secret("e1:nokeyid", provider)
+    with pytest.raises(ValueError, match="Not an envelope"):
+        TwoFactorAuth.decrypt_secret("gAAAAA", provider)
+
+    with open(kms.path) as file:
+        state = json.load(file)
+    key_id = token.split(":")[1]
+    state["keys"][key_id]["wrapped"] = state["keys"][key_id]["wrapped"][::-1]
+    with open(kms.path, "w") as file:
+        json.dump(state, file)
+    with pytest.raises(ValueError, match="Cannot unwrap"):
+        LocalKMS(kms.path).unwrap(key_id, "default")
+
+
+def test_legacy_fernet_secrets_still_decrypt(kms):
+    legacy_key = Fernet.generate_key()
+    legacy = TwoFactorAuth.encrypt_secret("OLD", legacy_key)
+    provider = CachingKeyProvider(kms, legacy_key=legacy_key)
+
+    assert TwoFactorAuth.decrypt_secret(legacy, provider) == "OLD"
+
+
+def test_invalid_provider_configuration(kms):
+    with pytest.raises(ValueError):
+        CachingKeyProvider(kms, ttl=0)
+    with pytest.raises(ValueError, match="KeyProvider"):
+        TwoFactorVerifier(lambda user_id: None, encryption_key=object())
+
+
+@pytest.mark.asyncio
+async def test_verifier_with_key_provider(kms, mock_user, make_request):
+    provider = CachingKeyProvider(kms)
+    secret = pyotp.random_base32()
+    encrypted = TwoFactorAuth.encrypt_secret(secret, provider)
+
+    async def get_secret(user_id):
+        return encrypted
+
+    unwrap = kms.unwrap
+    threads = []
+
+    def recording_unwrap(key_id, tenant):
+        threads.append(threading.get_ident())
+        return unwrap(key_id, tenant)
+
+    kms.unwrap = recording_unwrap
+    provider.invalidate()
+    verifier = TwoFactorVerifier(get_secret, encryption_key=provider)
+    result = await verifier.verify_request(make_request(
+        mock_user,
+        pyotp.TOTP(secret).now()
+    ))
+    assert result.user_id == "user_with_2fa"
+    # The KMS is called from a worker thread, never the event loop's
+    assert threads and threading.get_ident() not in threads
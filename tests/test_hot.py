@@ -0,0 +1,338 @@
+import asyncio
+import threading
+import pytest
+import pyotp
+from cryptography.fernet import Fernet
+from fastapi import (
+    FastAPI,
+    HTTPException
+)
+from fastapi.testclient import TestClient
+from two_fast_auth import (
+    DriftTracker,
+    HotCodes,
+    StepClock,
+    TwoFactorAuth,
+    TwoFactorMiddleware,
+    TwoFactorVerifier
+)
+from two_fast_auth.hot import (
+    HotKeys,
+    SpaceSaving
+)
+
+
+
+STEP = 1_000_000 // 30
+SECRET = pyotp.random_base32()
+KEY = Fernet.generate_key()
+
+
+@pytest.fixture
+def now():
+    return [STEP * 30 + 10.0]
+
+
+@pytest.fixture
+def clock(now):
+    return StepClock(clock=lambda: now[0])
+
+
+def _code(secret, step):
+    return pyotp.TOTP(secret).at(step * 30)
+
+
+def _keys(secret=SECRET, fingerprint="encrypted"):
+    return HotKeys(fingerprint, {None: TwoFactorAuth(secret)}, [0])
+
+
+def test_space_saving_keeps_heavy_hitters():
+    sketch = SpaceSaving(3)
+    for _ in range(10):
+        sketch.offer("alice")
+    for _ in range(5):
+        sketch.offer("bob")
+    for user_id in ["carol", "dave", "erin", "frank"]:
+        sketch.offer(user_id)
+
+    assert sketch.top(2) == [("alice", 10), ("bob", 5)]
+    assert "carol" not in sketch
+    # The newcomer inherits the count of the key it replaced
+    assert sketch.top(3)[2] == ("frank", 4)
+    assert len(sketch) == 3
+
+    sketch.decay(0.5)
+    assert sketch.top(3) == [("alice", 5), ("bob", 2), ("frank", 2)]
+    sketch.decay(0.1)
+    assert len(sketch) == 0
+    assert sketch.offer("alice") == 1
+    assert sketch.top(5) == [("alice", 1)]
+
+
+@pytest.mark.parametrize("options", [
+    {"top_k": 0},
+    {"decay": 0},
+    {"lead_time": 30},
+    {"sketch_size": 0}
+])
+def test_invalid_options(options):
+    with pytest.raises(ValueError):
+        HotCodes(**options)
+
+
+def test_verifier_rejects_an_interval_mismatch():
+    async def get_secret(user_id):
+        return SECRET
+
+    with pytest.raises(ValueError):
+        TwoFactorVerifier(
+            get_secret,
+            interval=60,
+            hot_codes=HotCodes()
+        )
+
+
+@pytest.mark.asyncio
+async def test_hot_user_is_verified_from_precomputed_codes(
+    mocker,
+    now,
+    clock,
+    make_request
+):
+    encrypted = TwoFactorAuth.encrypt_secret(SECRET, KEY)
+
+    async def get_secret(user_id):
+        return encrypted
+
+    hot = HotCodes(top_k=10, decay=1, clock=clock)
+    verifier = TwoFactorVerifier(
+        get_secret,
+        encryption_key=KEY,
+        clock=clock,
+        expose_secret=True,
+        hot_codes=hot
+    )
+    await verifier.verify_request(make_request("alice", _code(SECRET, STEP)))
+    hot.precompute(STEP)
+    hot.precompute(STEP + 1)
+
+    decrypt = mocker.spy(TwoFactorAuth, "decrypt_secret")
+    result = await verifier.verify_request(
+        make_request("alice", _code(SECRET, STEP))
+    )
+    assert result.step == STEP
+    assert result.secret == SECRET
+    now[0] += 30
+    result = await verifier.verify_request(
+        make_request("alice", _code(SECRET, STEP + 1))
+    )
+    assert result.step == STEP + 1
+    assert decrypt.call_count == 0
+
+    with pytest.raises(HTTPException):
+        await verifier.verify_request(make_request("alice", _code(SECRET, STEP)))
+    stats = verifier.metrics()["hot_codes"]
+    assert stats["hits"] == 2
+    assert stats["misses"] == 1
+    assert stats["hot_users"] == 1
+    assert stats["runs"] == 2
+    await hot.close()
+
+
+@pytest.mark.asyncio
+async def test_a_changed_secret_never_matches_old_codes(clock, make_request):
+    secrets = {"alice": SECRET}
+
+    async def get_secret(user_id):
+        return secrets[user_id]
+
+    hot = HotCodes(clock=clock)
+    verifier = TwoFactorVerifier(get_secret, clock=clock, hot_codes=hot)
+    await verifier.verify_request(make_request("alice", _code(SECRET, STEP)))
+    hot.precompute(STEP)
+
+    secrets["alice"] = pyotp.random_base32()
+    with pytest.raises(HTTPException):
+        await verifier.verify_request(make_request("alice", _code(SECRET, STEP)))
+    await verifier.verify_request(
+        make_request("alice", _code(secrets["alice"], STEP))
+    )
+    hot.precompute(STEP)
+    result = await verifier.verify_request(
+        make_request("alice", _code(secrets["alice"], STEP))
+    )
+    assert result.step == STEP
+    assert hot.stats()["hits"] == 1
+    await hot.close()
+
+
+@pytest.mark.asyncio
+async def test_devices_and_drift_use_the_verifier_windows(clock, make_request):
+    devices = {"phone": SECRET, "tablet": pyotp.random_base32()}
+
+    async def get_secret(user_id):
+        return devices if user_id == "alice" else SECRET
+
+    drift = DriftTracker(max_window=1)
+    hot = HotCodes(clock=clock)
+    verifier = TwoFactorVerifier(
+        get_secret,
+        clock=clock,
+        device_window=1,
+        drift_tracker=drift,
+        hot_codes=hot
+    )
+    await verifier.verify_request(make_request("alice", _code(SECRET, STEP)))
+    await verifier.verify_request(make_request("bob", _code(SECRET, STEP)))
+    hot.precompute(STEP)
+
+    result = await verifier.verify_request(
+        make_request("alice", _code(devices["tablet"], STEP - 1))
+    )
+    assert (result.device_id, result.step) == ("tablet", STEP - 1)
+    result = await verifier.verify_request(
+        make_request("bob", _code(SECRET, STEP + 1))
+    )
+    assert (result.device_id, result.step) == (None, STEP + 1)
+    assert drift.get_offset("bob") == 1
+    assert hot.stats()["hits"] == 2
+
+    verifier.invalidate("bob")
+    assert hot.stats()["precomputed_users"] == 1
+    await hot.close()
+
+
+@pytest.mark.asyncio
+async def test_only_the_top_k_users_keep_their_keys(clock, make_request):
+    async def get_secret(user_id):
+        return SECRET
+
+    hot = HotCodes(top_k=1, decay=1, clock=clock)
+    verifier = TwoFactorVerifier(get_secret, clock=clock, hot_codes=hot)
+    code = _code(SECRET, STEP)
+    await verifier.verify_request(make_request("alice", code))
+    for _ in range(3):
+        await verifier.verify_request(make_request("bob", code))
+    assert hot.stats()["hot_users"] == 1
+
+    # bob is hotter, so alice's slot goes to him after the next run
+    hot.precompute(STEP)
+    assert hot.stats()["hot_users"] == 0
+    await verifier.verify_request(make_request("alice", code))
+    assert hot.stats()["hot_users"] == 0
+    await verifier.verify_request(make_request("bob", code))
+    hot.precompute(STEP)
+    assert hot.stats() | {"last_run_seconds": 0} == {
+        "tracked": 2,
+        "hot_users": 1,
+        "precomputed_users": 1,
+        "hits": 0,
+        "misses": 0,
+        "runs": 2,
+        "last_run_seconds": 0
+    }
+    await hot.close()
+
+
+@pytest.mark.asyncio
+async def test_background_task_runs_before_each_boundary(now, clock, make_request):
+    async def get_secret(user_id):
+        return SECRET
+
+    hot = HotCodes(lead_time=5, decay=1, clock=clock)
+    verifier = TwoFactorVerifier(get_secret, clock=clock, hot_codes=hot)
+    now[0] = (STEP + 1) * 30 - 0.005
+    await verifier.verify_request(make_request("alice", _code(SECRET, STEP)))
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert hot.runs == 1
+
+    now[0] = (STEP + 2) * 30 - 1
+    while hot.runs < 2:
+        await asyncio.sleep(0.01)
+    result = await verifier.verify_request(
+        make_request("alice", _code(SECRET, STEP + 1))
+    )
+    assert result.step == STEP + 1
+    assert hot.hits == 1
+
+    await hot.close()
+    await hot.close()
+
+
+def test_middleware_stops_hot_codes(mock_get_user_secret):
+    hot = HotCodes()
+    app = FastAPI()
+    app.add_middleware(
+        TwoFactorMiddleware,
+        get_user_secret_callback=mock_get_user_secret,
+        hot_codes=hot
+    )
+    with TestClient(app) as client:
+        client.portal.call(hot.observe, "alice", "encrypted", _keys)
+        assert hot._task is not None
+    assert hot._task is None
+
+
+@pytest.mark.asyncio
+async def test_a_rotated_secret_drops_the_old_keys(clock):
+    hot = HotCodes(clock=clock)
+    hot.observe("alice", "encrypted", _keys)
+    hot.precompute(STEP)
+    assert hot.match("alice", "encrypted", _code(SECRET, STEP), STEP)
+
+    # The old plaintext keys go at the first sight of the new secret,
+    # before the user verifies with it
+    assert hot.match("alice", "rotated", _code(SECRET, STEP), STEP) is None
+    assert hot.stats()["hot_users"] == 0
+    assert hot.stats()["precomputed_users"] == 0
+    await hot.close()
+
+
+def test_concurrent_verifications_and_runs(clock):
+    hot = HotCodes(top_k=8, clock=clock)
+    errors = []
+
+    async def verify(number):
+        for round in range(200):
+            user_id = f"user-{(number + round) % 16}"
+            hot.observe(user_id, "encrypted", _keys)
+            hot.match(user_id, "encrypted", _code(SECRET, STEP), STEP)
+            if round % 20 == 0:
+                hot.precompute(STEP)
+            if round % 30 == 0:
+                hot.forget(user_id)
+
+    def run(number):
+        # Each thread verifies in its own event loop
+        try:
+            asyncio.run(verify(number))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert hot.hits > 0
+    assert hot.stats()["hot_users"] <= 16
+
+
+def test_a_task_left_in_a_stopped_loop_is_replaced(clock):
+    hot = HotCodes(clock=clock)
+
+    async def observe():
+        hot.observe("alice", "encrypted", _keys)
+        return hot._task
+
+    first_loop = asyncio.new_event_loop()
+    first = first_loop.run_until_complete(observe())
+    second = asyncio.run(observe())
+    assert second is not first
+
+    first_loop.run_until_complete(asyncio.wait([first]))
+    assert first.cancelled()
+    first_loop.close()
@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+import pyotp
+from fastapi import (
+    HTTPException,
+    status
+)
+from two_fast_auth import (
+    LookupLimiter,
+    TwoFactorVerifier
+)
+from two_fast_auth.limits import LookupRejected
+
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_bounded():
+    limiter = LookupLimiter(2, max_queue=10, timeout=1)
+    running = []
+    peak = []
+
+    async def lookup():
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+        return "ok"
+
+    results = await asyncio.gather(*(
+        limiter.run(lookup) for _ in range(6)
+    ))
+    assert results == ["ok"] * 6
+    assert max(peak) == 2
+    assert limiter.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_is_shed():
+    limiter = LookupLimiter(1, max_queue=1, timeout=1)
+    release = asyncio.Event()
+
+    async def slow():
+        await release.wait()
+        return "ok"
+
+    first = asyncio.create_task(limiter.run(slow))
+    second = asyncio.create_task(limiter.run(slow))
+    await asyncio.sleep(0)
+    assert limiter.stats()["queue_depth"] == 1
+
+    with pytest.raises(LookupRejected):
+        await limiter.run(slow)
+    assert limiter.stats()["shed"] == 1
+
+    release.set()
+    assert await first == "ok"
+    assert await second == "ok"
+
+
+@pytest.mark.asyncio
+async def test_timeouts_are_counted():
+    limiter = LookupLimiter(1, max_queue=5, timeout=0.02)
+
+    async def hang():
+        await asyncio.sleep(1)
+
+    results = await asyncio.gather(
+        limiter.run(hang),
+        limiter.run(hang),
+        return_exceptions=True
+    )
+    assert all(isinstance(r, LookupRejected) for r in results)
+    assert limiter.stats()["timeouts"] == 2
+
+
+def test_invalid_limiter_configuration():
+    with pytest.raises(ValueError):
+        LookupLimiter(0)
+    with pytest.raises(ValueError):
+        LookupLimiter(max_queue=-1)
+    with pytest.raises(ValueError):
+        LookupLimiter(timeout=0)
+
+
+@pytest.mark.asyncio
+async def test_verifier_fails_fast_with_503(mock_user, make_request):
+    async def slow_lookup(user_id):
+        await asyncio.sleep(1)
+
+    limiter = LookupLimiter(1, max_queue=0, timeout=0.02)
+    verifier = TwoFactorVerifier(slow_lookup, lookup_limiter=limiter)
+
+    with pytest.raises(HTTPException) as exc:
+        await verifier.verify_request(make_request(mock_user, "123456"))
+    assert exc.value.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert verifier.metrics()["lookup"]["timeouts"] == 1
+
+
+@pytest.mark.asyncio
+async def test_verifier_with_limiter_verifies(
+    mock_user,
+    mock_get_user_secret,
+    make_request
+):
+    verifier = TwoFactorVerifier(
+        mock_get_user_secret,
+        lookup_limiter=LookupLimiter(4)
+    )
+    result = await verifier.verify_request(
+        make_request(mock_user, pyotp.TOTP("SECRETEXAMPLE").now())
+    )
+    assert result.user_id == "user_with_2fa"
+    assert TwoFactorVerifier(mock_get_user_secret).metrics() == {}
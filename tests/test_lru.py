@@ -0,0 +1,32 @@
+import pytest
+from two_fast_auth.lru import LRUCache
+
+
+
+def test_lru_eviction_order():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert "a" in cache
+    assert len(cache) == 2
+    assert cache.get("b", 0) == 0
+
+
+def test_lru_pop_and_clear():
+    cache = LRUCache(4)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.pop("a") == 1
+    assert cache.pop("a") is None
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_lru_requires_capacity():
+    with pytest.raises(ValueError):
+        LRUCache(0)
@@ -216,3 +216,21 @@ async def test_middleware_scope_get_scenarios(
     with pytest.raises(HTTPException) as exc:
         await middleware.dispatch(request5, call_next)
     assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+def test_middleware_exposes_verifier_settings(test_app, mock_get_user_secret):
+    middleware = TwoFactorMiddleware(
+        test_app,
+        mock_get_user_secret,
+        header_name="X-OTP",
+        digits=8
+    )
+    assert middleware.header_name == "X-OTP"
+    assert middleware.digits == 8
+    assert middleware.interval == 30
+    assert middleware.clock is middleware.verifier.clock
+    assert middleware.encryption_key is None
+
+    middleware.verifier = None
+    with pytest.raises(AttributeError):
+        middleware.header_name
@@ -0,0 +1,141 @@
+import pytest
+import pyotp
+from fastapi import (
+    HTTPException,
+    status
+)
+from two_fast_auth import TwoFactorVerifier
+
+
+
+@pytest.fixture
+def counting_lookup():
+    calls = []
+
+    async def _lookup(user_id):
+        calls.append(user_id)
+        return "SECRETEXAMPLE" if user_id == "user_with_2fa" else None
+
+    _lookup.calls = calls
+    return _lookup
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("code", ["12345", "1234567", "12345a", "１２３４５６"])
+async def test_malformed_code_rejected_before_decrypt(
+    counting_lookup,
+    mock_user,
+    mocker,
+    code,
+    make_request
+):
+    verifier = TwoFactorVerifier(counting_lookup)
+    decrypt = mocker.spy(verifier, "_decrypt")
+
+    with pytest.raises(HTTPException) as exc:
+        await verifier.verify_request(make_request(mock_user, code))
+    assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
+    assert decrypt.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_malformed_code_for_user_without_2fa(counting_lookup, make_request):
+    verifier = TwoFactorVerifier(counting_lookup)
+    user = type("User", (), {"id": "user_no_2fa", "is_authenticated": True})()
+
+    assert await verifier.verify_request(make_request(user, "12345a")) is None
+    assert counting_lookup.calls == ["user_no_2fa"]
+
+
+@pytest.mark.asyncio
+async def test_strict_mode_rejects_malformed_code_before_lookup(
+    counting_lookup,
+    mock_user,
+    make_request
+):
+    verifier = TwoFactorVerifier(counting_lookup, reject_missing_code=True)
+
+    with pytest.raises(HTTPException) as exc:
+        await verifier.verify_request(make_request(mock_user, "12345"))
+    assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
+    assert counting_lookup.calls == []
+
+
+@pytest.mark.asyncio
+async def test_missing_code_rejected_before_decrypt(
+    mock_user,
+    valid_encryption_key,
+    encrypted_secret,
+    mocker,
+    make_request
+):
+    async def lookup(user_id):
+        return encrypted_secret
+
+    verifier = TwoFactorVerifier(lookup, encryption_key=valid_encryption_key)
+    decrypt = mocker.spy(verifier, "_decrypt")
+
+    with pytest.raises(HTTPException) as exc:
+        await verifier.verify_request(make_request(mock_user))
+    assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
+    assert decrypt.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_missing_code_for_user_without_2fa(counting_lookup, make_request):
+    verifier = TwoFactorVerifier(counting_lookup)
+    user = type("User", (), {"id": "user_no_2fa", "is_authenticated": True})()
+
+    assert await verifier.verify_request(make_request(user)) is None
+    assert counting_lookup.calls == ["user_no_2fa"]
+
+
+@pytest.mark.asyncio
+async def test_strict_mode_rejects_missing_code_before_lookup(
+    counting_lookup,
+    mock_user,
+    make_request
+):
+    verifier = TwoFactorVerifier(counting_lookup, reject_missing_code=True)
+
+    with pytest.raises(HTTPException):
+        await verifier.verify_request(make_request(mock_user))
+    assert counting_lookup.calls == []
+
+
+@pytest.mark.asyncio
+async def test_custom_stages_run_before_lookup(
+    counting_lookup,
+    mock_user,
+    make_request
+):
+    order = []
+
+    async def deny_listed(context):
+        order.append(("deny_listed", list(counting_lookup.calls)))
+        if context.user_id == "blocked":
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+        return True
+
+    async def skip_service_accounts(context):
+        return not context.user_id.startswith("svc-")
+
+    verifier = TwoFactorVerifier(
+        counting_lookup,
+        pre_lookup_stages=[deny_listed, skip_service_accounts]
+    )
+
+    result = await verifier.verify_request(
+        make_request(mock_user, pyotp.TOTP("SECRETEXAMPLE").now())
+    )
+    assert result.user_id == "user_with_2fa"
+    assert order == [("deny_listed", [])]
+
+    mock_user.id = "svc-backup"
+    assert await verifier.verify_request(make_request(mock_user)) is None
+
+    mock_user.id = "blocked"
+    with pytest.raises(HTTPException) as exc:
+        await verifier.verify_request(make_request(mock_user, "123456"))
+    assert exc.value.status_code == status.HTTP_403_FORBIDDEN
+    assert counting_lookup.calls == ["user_with_2fa"]
@@ -0,0 +1,214 @@
+import asyncio
+import pstats
+import pytest
+import pyotp
+from fastapi import (
+    FastAPI,
+    HTTPException
+)
+from fastapi.testclient import TestClient
+from two_fast_auth import (
+    RequestProfiler,
+    TwoFactorMiddleware
+)
+
+
+
+def _functions(path):
+    return {name for _, _, name in pstats.Stats(str(path)).stats}
+
+
+def _own_work():
+    return sum(range(100))
+
+
+def _other_work():
+    return sum(range(100))
+
+
+@pytest.mark.parametrize("options", [
+    {"every": -1},
+    {"dump_interval": 0}
+])
+def test_invalid_options(tmp_path, options):
+    with pytest.raises(ValueError):
+        RequestProfiler(str(tmp_path / "2fa.prof"), **options)
+
+
+def test_one_request_in_every_is_sampled(tmp_path):
+    profiler = RequestProfiler(str(tmp_path / "2fa.prof"), every=3)
+    assert [profiler.should_sample() for _ in range(6)] == [
+        False, False, True, False, False, True
+    ]
+
+    profiler.every = 0
+    assert not any(profiler.should_sample() for _ in range(10))
+    profiler.every = 1
+    assert profiler.should_sample()
+    assert profiler.every == profiler.stats()["every"] == 1
+
+
+@pytest.mark.asyncio
+async def test_only_the_sampled_request_is_profiled(tmp_path):
+    path = tmp_path / "2fa.prof"
+    profiler = RequestProfiler(str(path))
+    release = asyncio.Event()
+
+    async def sampled():
+        await release.wait()
+        _own_work()
+        return "done"
+
+    async def other():
+        _other_work()
+        release.set()
+
+    task = asyncio.create_task(profiler.run(sampled()))
+    await asyncio.sleep(0)
+    await other()
+    assert await task == "done"
+
+    await profiler.close()
+    functions = _functions(path)
+    assert "_own_work" in functions
+    assert "_other_work" not in functions
+    assert profiler.stats() == {
+        "every": 100,
+        "sampled": 1,
+        "busy_steps": 0,
+        "dumps": 1,
+        "dump_errors": 0
+    }
+
+
+@pytest.mark.asyncio
+async def test_errors_and_cancellation_pass_through(tmp_path):
+    profiler = RequestProfiler(str(tmp_path / "2fa.prof"))
+
+    async def rejected():
+        await asyncio.sleep(0)
+        raise HTTPException(status_code=401)
+
+    with pytest.raises(HTTPException):
+        await profiler.run(rejected())
+
+    task = asyncio.create_task(profiler.run(asyncio.sleep(10)))
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await profiler.close()
+
+
+@pytest.mark.asyncio
+async def test_busy_profiler_runs_steps_unprofiled(tmp_path, mocker):
+    profiler = RequestProfiler(str(tmp_path / "2fa.prof"))
+
+    async def work():
+        return _own_work()
+
+    with profiler._lock:
+        assert await profiler.run(work()) == 4950
+    mocker.patch.object(
+        profiler._profile,
+        "enable",
+        side_effect=ValueError("Another profiling tool is already active")
+    )
+    assert await profiler.run(work()) == 4950
+    assert profiler.busy_steps == 2
+    await profiler.close()
+
+
+@pytest.mark.asyncio
+async def test_periodic_dumps_and_reset(tmp_path):
+    path = tmp_path / "2fa.prof"
+    profiler = RequestProfiler(str(path), dump_interval=0.01)
+    await profiler.dump()
+    assert not path.exists()
+
+    async def work():
+        return _own_work()
+
+    await profiler.run(work())
+    while not profiler.dumps:
+        await asyncio.sleep(0.01)
+    assert "_own_work" in _functions(path)
+    assert profiler.last_dump is not None
+
+    profiler.reset()
+    assert profiler.sampled == 0
+    await profiler.close()
+
+
+@pytest.mark.asyncio
+async def test_dump_errors_are_counted(tmp_path):
+    profiler = RequestProfiler(
+        str(tmp_path / "missing" / "2fa.prof"),
+        dump_interval=0.01
+    )
+
+    async def work():
+        return _own_work()
+
+    await profiler.run(work())
+    while not profiler.dump_errors:
+        await asyncio.sleep(0.01)
+    with pytest.raises(OSError):
+        await profiler.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_dumps_use_their_own_temporary_files(tmp_path):
+    path = tmp_path / "2fa.prof"
+    profiler = RequestProfiler(str(path))
+
+    async def work():
+        return _own_work()
+
+    await profiler.run(work())
+    await asyncio.gather(*(profiler.dump() for _ in range(5)))
+    assert profiler.dumps == 5
+    assert "_own_work" in _functions(path)
+    assert [p.name for p in tmp_path.iterdir()] == ["2fa.prof"]
+    await profiler.close()
+
+
+def test_failed_dump_removes_its_temporary_file(tmp_path, mocker):
+    path = tmp_path / "2fa.prof"
+    profiler = RequestProfiler(str(path))
+    stats = mocker.Mock()
+    stats.dump_stats.side_effect = OSError("disk full")
+    with pytest.raises(OSError):
+        profiler._write(stats)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_middleware_profiles_sampled_verifications(
+    tmp_path,
+    mock_get_user_secret,
+    authenticate
+):
+    path = tmp_path / "2fa.prof"
+    profiler = RequestProfiler(str(path), every=2)
+    app = FastAPI()
+
+    @app.get("/protected")
+    async def protected():
+        return {}
+
+    app.add_middleware(
+        TwoFactorMiddleware,
+        get_user_secret_callback=mock_get_user_secret,
+        profiler=profiler
+    )
+
+    authenticate(app)
+    with TestClient(app) as client:
+        for _ in range(4):
+            assert client.get(
+                "/protected",
+                headers={"X-2FA-Code": pyotp.TOTP("SECRETEXAMPLE").now()}
+            ).status_code == 200
+        assert profiler.sampled == 2
+
+    assert "verify_request" in _functions(path)
@@ -0,0 +1,146 @@
+import pytest
+import pyotp
+from fastapi import (
+    Depends,
+    Request,
+    Response,
+    status
+)
+from fastapi.testclient import TestClient
+from two_fast_auth import (
+    StepClock,
+    TwoFactorMiddleware,
+    TwoFactorResult,
+    TwoFactorVerifier,
+    get_2fa_result,
+    require_2fa,
+    verified_2fa
+)
+
+
+
+class ScopeUserMiddleware:
+    def __init__(self, app, user):
+        self.app = app
+        self.user = user
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            scope["user"] = self.user
+        await self.app(scope, receive, send)
+
+
+@pytest.fixture
+def counting_secret_lookup():
+    calls = []
+
+    async def _lookup(user_id):
+        calls.append(user_id)
+        return "SECRETEXAMPLE" if user_id == "user_with_2fa" else None
+
+    _lookup.calls = calls
+    return _lookup
+
+
+def test_middleware_result_reaches_handler(
+    test_app,
+    mock_user,
+    counting_secret_lookup
+):
+    clock = StepClock(clock=lambda: 1_000_000)
+    verifier = TwoFactorVerifier(counting_secret_lookup, clock=clock)
+
+    @test_app.get("/protected", dependencies=[Depends(require_2fa(
+        verifier=verifier
+    ))])
+    async def protected(result: TwoFactorResult = Depends(verified_2fa)):
+        return {
+            "user_id": result.user_id,
+            "step": result.step,
+            "secret": result.secret
+        }
+
+    test_app.add_middleware(
+        TwoFactorMiddleware,
+        verifier=verifier,
+        excluded_paths=["/login"]
+    )
+    test_app.add_middleware(ScopeUserMiddleware, user=mock_user)
+
+    response = TestClient(test_app).get(
+        "/protected",
+        headers={"X-2FA-Code": pyotp.TOTP("SECRETEXAMPLE").at(1_000_000)}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {
+        "user_id": "user_with_2fa",
+        "step": 1_000_000 // 30,
+        "secret": None
+    }
+    assert counting_secret_lookup.calls == ["user_with_2fa"]
+
+
+@pytest.mark.asyncio
+async def test_secret_is_exposed_only_when_allowed(mock_user):
+    async def lookup(user_id):
+        return "SECRETEXAMPLE"
+
+    middleware = TwoFactorMiddleware(
+        app=None,
+        get_user_secret_callback=lookup,
+        excluded_paths=[],
+        expose_secret=True
+    )
+    seen = {}
+
+    async def call_next(request):
+        seen["result"] = get_2fa_result(request)
+        return Response("OK")
+
+    await middleware.dispatch(
+        Request(scope={
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "headers": [(
+                b"x-2fa-code",
+                pyotp.TOTP("SECRETEXAMPLE").now().encode()
+            )],
+            "user": mock_user
+        }),
+        call_next
+    )
+    assert seen["result"].secret == "SECRETEXAMPLE"
+    assert "SECRETEXAMPLE" not in repr(seen["result"])
+
+
+def test_verified_2fa_requires_upstream_result(test_app):
+    @test_app.get("/needs-2fa")
+    async def needs_2fa(result: TwoFactorResult = Depends(verified_2fa)):
+        return {}
+
+    response = TestClient(test_app).get("/needs-2fa")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_result_for_another_user_is_not_reused(
+    counting_secret_lookup,
+    mock_user
+):
+    verifier = TwoFactorVerifier(counting_secret_lookup)
+    request = Request(scope={
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(
+            b"x-2fa-code",
+            pyotp.TOTP("SECRETEXAMPLE").now().encode()
+        )],
+        "user": mock_user,
+        "state": {"two_fa": TwoFactorResult("someone_else", 0)}
+    })
+
+    result = await verifier.verify_request(request)
+    assert result.user_id == "user_with_2fa"
+    assert counting_secret_lookup.calls == ["user_with_2fa"]
@@ -0,0 +1,71 @@
+import pytest
+import pyotp
+from fastapi import (
+    HTTPException,
+    status
+)
+from two_fast_auth import TwoFactorVerifier
+
+
+
+@pytest.fixture
+def failing_lookup():
+    async def _lookup(user_id):
+        raise AssertionError("secret callback must not be called")
+    return _lookup
+
+
+@pytest.mark.asyncio
+async def test_secret_from_scope_user_attribute(
+    mock_user,
+    failing_lookup,
+    make_request
+):
+    verifier = TwoFactorVerifier(
+        failing_lookup,
+        user_secret_attribute="two_fa_secret"
+    )
+
+    result = await verifier.verify_request(
+        make_request(mock_user, pyotp.TOTP("SECRETEXAMPLE").now())
+    )
+    assert result.user_id == "user_with_2fa"
+
+    with pytest.raises(HTTPException) as exc:
+        await verifier.verify_request(make_request(mock_user, "000000"))
+    assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
+
+
+@pytest.mark.asyncio
+async def test_secret_from_accessor(mock_user, failing_lookup, make_request):
+    verifier = TwoFactorVerifier(
+        failing_lookup,
+        user_secret_attribute=lambda user: {"phone": user.two_fa_secret}
+    )
+
+    result = await verifier.verify_request(
+        make_request(mock_user, pyotp.TOTP("SECRETEXAMPLE").now())
+    )
+    assert result.device_id == "phone"
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_callback_when_missing(
+    mock_user,
+    mock_get_user_secret
+):
+    verifier = TwoFactorVerifier(
+        mock_get_user_secret,
+        user_secret_attribute="encrypted_secret"
+    )
+    assert await verifier.resolve_secret(
+        mock_user,
+        "user_with_2fa"
+    ) == "SECRETEXAMPLE"
+
+    mock_user.encrypted_secret = None
+    assert await verifier.resolve_secret(
+        mock_user,
+        "user_with_2fa"
+    ) == "SECRETEXAMPLE"
+    assert await verifier.resolve_secret(mock_user, "user_no_2fa") is None
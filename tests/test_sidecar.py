@@ -0,0 +1,191 @@
+import sys
+import types
+import pytest
+import pyotp
+from cryptography.fernet import Fernet
+from fastapi.testclient import TestClient
+from two_fast_auth import (
+    SecretCache,
+    TwoFactorAuth,
+    TwoFactorVerifier
+)
+from two_fast_auth.sidecar import (
+    STATUS_HEADER,
+    build_app,
+    create_sidecar_app,
+    import_callback,
+    main,
+    parse_args
+)
+
+
+
+SECRETS = {"alice": "SECRETEXAMPLE", "bob": None, "dave": "SECRETEXAMPLE"}
+
+
+async def get_secret(user_id):
+    return SECRETS.get(user_id)
+
+
+@pytest.fixture
+def sidecar():
+    verifier = TwoFactorVerifier(get_secret, secret_cache=SecretCache())
+    return TestClient(create_sidecar_app(verifier, max_batch=3))
+
+
+def _code():
+    return pyotp.TOTP("SECRETEXAMPLE").now()
+
+
+def test_verify_accepts_valid_code(sidecar):
+    response = sidecar.get(
+        "/verify",
+        headers={"X-User-Id": "alice", "X-2FA-Code": _code()}
+    )
+    assert response.status_code == 204
+    assert response.headers[STATUS_HEADER] == "verified"
+
+
+def test_verify_rejects_invalid_code(sidecar):
+    response = sidecar.get(
+        "/verify",
+        headers={"X-User-Id": "alice", "X-2FA-Code": "000000"}
+    )
+    assert response.status_code == 401
+
+
+def test_verify_passes_users_without_2fa(sidecar):
+    response = sidecar.post("/verify", headers={"X-User-Id": "bob"})
+    assert response.status_code == 204
+    assert response.headers[STATUS_HEADER] == "not_enrolled"
+
+
+def test_verify_requires_user_id(sidecar):
+    response = sidecar.get("/verify", headers={"X-2FA-Code": _code()})
+    assert response.status_code == 401
+
+
+def test_verify_accepts_original_path_suffix(sidecar):
+    response = sidecar.delete(
+        "/verify/api/orders/1",
+        headers={"X-User-Id": "alice", "X-2FA-Code": _code()}
+    )
+    assert response.status_code == 204
+
+
+def test_batch_verification(sidecar):
+    response = sidecar.post("/verify/batch", json=[
+        {"user_id": "alice", "code": _code()},
+        {"user_id": "dave", "code": "000000"},
+        {"user_id": "bob"}
+    ])
+    assert response.status_code == 200
+    assert [item["status"] for item in response.json()] == [204, 401, 204]
+
+    response = sidecar.post("/verify/batch", json=[
+        {"user_id": "alice", "code": "000000"},
+        {"user_id": "alice", "code": "000001"}
+    ])
+    assert response.status_code == 400
+
+    response = sidecar.post(
+        "/verify/batch",
+        json=[{"user_id": "bob"}] * 4
+    )
+    assert response.status_code == 413
+
+
+def test_metrics_and_health(sidecar):
+    sidecar.get("/verify", headers={"X-User-Id": "alice", "X-2FA-Code": _code()})
+    sidecar.get("/verify", headers={"X-User-Id": "alice", "X-2FA-Code": _code()})
+    sidecar.get("/verify", headers={"X-User-Id": "bob"})
+
+    metrics = sidecar.get("/metrics").json()
+    assert metrics["sidecar"] == {
+        "verified": 2,
+        "not_enrolled": 1,
+        "rejected": 0
+    }
+    assert metrics["secret_cache"]["hits"] == 1
+    assert sidecar.get("/healthz").status_code == 204
+
+
+def test_import_callback():
+    assert import_callback(f"{__name__}:get_secret") is get_secret
+    with pytest.raises(ValueError):
+        import_callback(__name__)
+    with pytest.raises(ValueError):
+        import_callback(f"{__name__}:SECRETS")
+
+
+def test_build_app_from_arguments(monkeypatch):
+    key = Fernet.generate_key()
+    encrypted = TwoFactorAuth.encrypt_secret("SECRETEXAMPLE", key)
+    monkeypatch.setenv("SIDECAR_KEY", key.decode())
+    monkeypatch.setitem(SECRETS, "carol", encrypted)
+
+    client = TestClient(build_app(parse_args([
+        f"{__name__}:get_secret",
+        "--encryption-key-env", "SIDECAR_KEY",
+        "--user-id-header", "X-Remote-User",
+        "--cache-ttl", "0"
+    ])))
+    response = client.get(
+        "/verify",
+        headers={"X-Remote-User": "carol", "X-2FA-Code": _code()}
+    )
+    assert response.status_code == 204
+    assert response.headers[STATUS_HEADER] == "verified"
+    assert "secret_cache" not in client.get("/metrics").json()
+
+
+def test_build_app_throttles_failed_codes_per_user():
+    client = TestClient(build_app(parse_args([
+        f"{__name__}:get_secret",
+        "--max-attempts", "2"
+    ])))
+    guesses = [
+        client.get(
+            "/verify",
+            headers={"X-User-Id": "alice", "X-2FA-Code": "000000"}
+        ).status_code
+        for _ in range(3)
+    ]
+    assert guesses == [401, 401, 429]
+
+    # Another user behind the same proxy is unaffected
+    response = client.get(
+        "/verify",
+        headers={"X-User-Id": "dave", "X-2FA-Code": _code()}
+    )
+    assert response.status_code == 204
+
+    client = TestClient(build_app(parse_args([
+        f"{__name__}:get_secret",
+        "--max-attempts", "0"
+    ])))
+    guesses = {
+        client.get(
+            "/verify",
+            headers={"X-User-Id": "alice", "X-2FA-Code": "000000"}
+        ).status_code
+        for _ in range(6)
+    }
+    assert guesses == {401}
+
+
+def test_main_runs_uvicorn(monkeypatch):
+    runs = []
+    fake_uvicorn = types.ModuleType("uvicorn")
+    fake_uvicorn.run = lambda app, **options: runs.append(options)
+    monkeypatch.setitem(sys.modules, "uvicorn", fake_uvicorn)
+
+    main([f"{__name__}:get_secret", "--port", "9000"])
+    assert runs[0]["port"] == 9000
+    assert runs[0]["timeout_keep_alive"] == 75
+
+
+def test_main_without_uvicorn(monkeypatch):
+    monkeypatch.setitem(sys.modules, "uvicorn", None)
+    with pytest.raises(SystemExit):
+        main([f"{__name__}:get_secret"])
@@ -0,0 +1,146 @@
+import os
+import pytest
+import pyotp
+from two_fast_auth import (
+    SnapshotResolver,
+    TwoFactorVerifier,
+    export_snapshot
+)
+from two_fast_auth.snapshot import Snapshot
+
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    return str(tmp_path / "secrets.snapshot")
+
+
+def test_export_and_lookup(snapshot_path):
+    secrets = {f"user{i}": f"secret-{i}" * (i % 3 + 1) for i in range(500)}
+    assert export_snapshot(snapshot_path, secrets.items()) == 500
+
+    snapshot = Snapshot(snapshot_path)
+    try:
+        assert len(snapshot) == 500
+        for user_id, secret in secrets.items():
+            assert snapshot.get(user_id) == secret
+        assert snapshot.get("user500") is None
+        assert snapshot.get("user") is None
+        assert snapshot.get("x" * 100) is None
+    finally:
+        snapshot.close()
+
+
+def test_empty_snapshot(snapshot_path):
+    assert export_snapshot(snapshot_path, []) == 0
+    snapshot = Snapshot(snapshot_path)
+    assert snapshot.get("user1") is None
+    snapshot.close()
+
+
+def test_export_rejects_bad_input(snapshot_path):
+    with pytest.raises(ValueError):
+        export_snapshot(snapshot_path, [("a", "x"), ("a", "y")])
+    with pytest.raises(ValueError):
+        export_snapshot(snapshot_path, [("a\0", "x")])
+    with pytest.raises(ValueError):
+        export_snapshot(snapshot_path, [("a", "x" * 70000)])
+    assert not os.path.exists(snapshot_path)
+    assert os.listdir(os.path.dirname(snapshot_path)) == []
+
+
+def test_invalid_file_is_rejected(snapshot_path):
+    with open(snapshot_path, "wb") as file:
+        file.write(b"not a snapshot at all, definitely")
+    with pytest.raises(ValueError):
+        Snapshot(snapshot_path)
+
+    with open(snapshot_path, "wb") as file:
+        file.write(b"2FAS")
+    with pytest.raises(ValueError):
+        Snapshot(snapshot_path)
+
+
+@pytest.mark.asyncio
+async def test_resolver_falls_back_for_unknown_users(snapshot_path):
+    export_snapshot(snapshot_path, [("user1", "from-snapshot")])
+    calls = []
+
+    async def fallback(user_id):
+        calls.append(user_id)
+        return "from-callback"
+
+    resolver = SnapshotResolver(snapshot_path, fallback)
+    assert await resolver("user1") == "from-snapshot"
+    assert await resolver("user2") == "from-callback"
+    assert calls == ["user2"]
+    assert resolver.stats()["hits"] == 1
+    assert resolver.stats()["misses"] == 1
+    resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_resolver_without_file_or_fallback(snapshot_path):
+    resolver = SnapshotResolver(snapshot_path)
+    assert await resolver("user1") is None
+    assert resolver.stats()["records"] == 0
+
+
+@pytest.mark.asyncio
+async def test_resolver_remaps_replaced_snapshot(snapshot_path):
+    clock = FakeClock()
+    export_snapshot(snapshot_path, [("user1", "old")])
+    resolver = SnapshotResolver(snapshot_path, check_interval=5, clock=clock)
+    assert await resolver("user1") == "old"
+
+    export_snapshot(snapshot_path, [("user1", "new"), ("user2", "added")])
+    assert await resolver("user1") == "old"
+
+    clock.now += 5
+    assert await resolver("user1") == "new"
+    assert await resolver("user2") == "added"
+    assert resolver.stats()["reloads"] == 2
+    resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_resolver_keeps_snapshot_when_replacement_is_invalid(
+    snapshot_path
+):
+    clock = FakeClock()
+    export_snapshot(snapshot_path, [("user1", "old")])
+    resolver = SnapshotResolver(snapshot_path, check_interval=1, clock=clock)
+    assert await resolver("user1") == "old"
+
+    with open(snapshot_path + ".new", "wb") as file:
+        file.write(b"garbage that is long enough")
+    os.replace(snapshot_path + ".new", snapshot_path)
+    clock.now += 1
+    assert await resolver("user1") == "old"
+    assert resolver.stats()["errors"] == 1
+    resolver.close()
+
+
+@pytest.mark.asyncio
+async def test_resolver_as_secret_callback(
+    snapshot_path,
+    mock_user,
+    make_request
+):
+    secret = pyotp.random_base32()
+    export_snapshot(snapshot_path, [("user_with_2fa", secret)])
+    verifier = TwoFactorVerifier(SnapshotResolver(snapshot_path))
+
+    result = await verifier.verify_request(make_request(
+        mock_user,
+        pyotp.TOTP(secret).now()
+    ))
+    assert result.user_id == "user_with_2fa"
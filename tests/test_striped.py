@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import pytest
+from two_fast_auth import MemoryThrottleBackend
+from two_fast_auth.lru import LRUCache
+from two_fast_auth.striped import (
+    StripedCounter,
+    StripedLock
+)
+
+
+
+def _in_threads(target, threads=8):
+    barrier = threading.Barrier(threads)
+
+    def run(number):
+        barrier.wait()
+        target(number)
+
+    pool = [
+        threading.Thread(target=run, args=(number,))
+        for number in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+
+def test_striped_lock_maps_keys_to_stable_locks():
+    locks = StripedLock(4)
+    assert len(locks) == 4
+    assert locks.lock_for("alice") is locks.lock_for("alice")
+    assert len({id(locks.lock_for(n)) for n in range(100)}) == 4
+
+
+def test_striped_counter_counts_every_increment():
+    counter = StripedCounter()
+
+    def work(number):
+        for _ in range(10000):
+            counter.add()
+
+    _in_threads(work)
+    assert counter.value == 80000
+
+
+@pytest.mark.parametrize("cls", [StripedLock, StripedCounter])
+def test_stripes_must_be_positive(cls):
+    with pytest.raises(ValueError):
+        cls(0)
+
+
+def test_lru_is_sharded_and_keeps_its_capacity():
+    cache = LRUCache(1000, stripes=8)
+    assert len(cache._shards) == 8
+    for n in range(5000):
+        cache.set(n, n)
+    assert len(cache) == 1000
+    assert cache.max_entries == 1000
+    assert len(LRUCache(100)._shards) == 1
+
+    with pytest.raises(ValueError):
+        LRUCache(10, stripes=0)
+
+
+def test_lru_survives_concurrent_updates():
+    cache = LRUCache(256)
+
+    def work(number):
+        for n in range(5000):
+            key = (n * 7 + number) % 512
+            cache.set(key, n)
+            cache.get(key)
+            cache.pop((key + 1) % 512)
+            key in cache
+
+    _in_threads(work)
+    assert len(cache) <= 256
+
+
+def test_throttle_counts_concurrent_attempts():
+    backend = MemoryThrottleBackend(capacity=1000, refill_per_second=1e-9)
+
+    def work(number):
+        for _ in range(100):
+            asyncio.run(backend.try_acquire("alice"))
+
+    _in_threads(work)
+    tokens = backend._buckets.get("alice")[0]
+    assert tokens == pytest.approx(200, abs=1e-3)
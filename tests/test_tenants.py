@@ -0,0 +1,266 @@
+import pytest
+import pyotp
+from cryptography.fernet import Fernet
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    Request
+)
+from fastapi.testclient import TestClient
+from two_fast_auth import (
+    AuditQueue,
+    CachingKeyProvider,
+    LocalKMS,
+    TenantPolicy,
+    TenantResolver,
+    TwoFactorAuth,
+    TwoFactorMiddleware
+)
+
+
+
+ACME_SECRET = pyotp.random_base32()
+GLOBEX_SECRET = pyotp.random_base32()
+ACME_KEY = Fernet.generate_key()
+
+
+class RecordingSink:
+    def __init__(self):
+        self.events = []
+
+    async def write(self, batch):
+        self.events.extend(batch.events)
+
+
+@pytest.fixture
+def policies():
+    async def acme_secret(user_id):
+        return TwoFactorAuth.encrypt_secret(ACME_SECRET, ACME_KEY)
+
+    async def globex_secret(user_id):
+        return GLOBEX_SECRET
+
+    return [
+        TenantPolicy.build(
+            "acme",
+            acme_secret,
+            encryption_key=ACME_KEY,
+            issuer_name="Acme",
+            qr_fill_color="navy",
+            excluded_paths=["/public"]
+        ),
+        TenantPolicy.build(
+            "globex",
+            globex_secret,
+            digits=8,
+            excluded_paths=[]
+        )
+    ]
+
+
+def _request(headers):
+    return Request(scope={
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [
+            (name.lower().encode(), value.encode())
+            for name, value in headers.items()
+        ]
+    })
+
+
+def test_resolve_by_host_then_header(policies):
+    tenants = TenantResolver(
+        policies,
+        header="X-Tenant",
+        hosts={"Acme.Example.com": "acme"}
+    )
+    assert tenants.resolve(_request({"X-Tenant": "globex"})).name == "globex"
+    assert tenants.resolve(
+        _request({"Host": "acme.example.com:8443"})
+    ).name == "acme"
+    assert tenants.resolve(
+        _request({"X-Tenant": "acme", "Host": "acme.example.com"})
+    ).name == "acme"
+    assert len(tenants) == 2
+    assert tenants["acme"] is policies[0]
+
+    with pytest.raises(HTTPException) as e:
+        tenants.resolve(_request({"Host": "unknown.example.com"}))
+    assert e.value.status_code == 400
+
+
+@pytest.mark.parametrize("claimed", ["globex", "nobody"])
+def test_header_conflicting_with_host_is_rejected(policies, claimed):
+    tenants = TenantResolver(
+        policies,
+        header="X-Tenant",
+        hosts={"acme.example.com": "acme"}
+    )
+    with pytest.raises(HTTPException) as e:
+        tenants.resolve(
+            _request({"X-Tenant": claimed, "Host": "acme.example.com"})
+        )
+    assert e.value.status_code == 400
+
+
+def test_default_tenant(policies):
+    tenants = TenantResolver(policies, header="X-Tenant", default="globex")
+    assert tenants.resolve(_request({})).name == "globex"
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"header": "X-Tenant", "default": "initech"},
+    {"hosts": {"initech.example.com": "initech"}}
+])
+def test_resolver_validation(policies, options):
+    with pytest.raises(ValueError):
+        TenantResolver(policies, **options)
+
+
+def test_duplicate_tenants_are_rejected(policies):
+    with pytest.raises(ValueError):
+        TenantResolver(policies + policies[:1], header="X-Tenant")
+
+
+def test_policy_build_validation():
+    async def get_secret(user_id):
+        return None
+
+    with pytest.raises(ValueError):
+        TenantPolicy.build("acme")
+    with pytest.raises(ValueError):
+        TenantPolicy.build("acme", get_secret, digits=12)
+
+    policy = TenantPolicy.build("acme", get_secret)
+    assert policy.is_excluded("/login")
+    with pytest.raises(ValueError):
+        TenantPolicy.build("acme", verifier=policy.verifier, digits=8)
+    shared = TenantPolicy.build("other", verifier=policy.verifier)
+    assert shared.verifier is policy.verifier
+
+
+@pytest.mark.asyncio
+async def test_policies_only_decrypt_their_own_data_keys(
+    tmp_path,
+    mock_user,
+    make_request
+):
+    provider = CachingKeyProvider(LocalKMS(str(tmp_path / "kms.json")))
+    secrets = {}
+
+    async def get_secret(user_id):
+        return secrets["stored"]
+
+    acme, globex = (
+        TenantPolicy.build(name, get_secret, encryption_key=provider)
+        for name in ("acme", "globex")
+    )
+    secrets["stored"] = acme.encrypt_secret(ACME_SECRET)
+    code = pyotp.TOTP(ACME_SECRET).now()
+
+    result = await acme.verifier.verify_request(make_request(mock_user, code))
+    assert result.user_id == "user_with_2fa"
+    with pytest.raises(HTTPException, match="does not belong"):
+        await globex.verifier.verify_request(make_request(mock_user, code))
+
+    with pytest.raises(ValueError, match="tenant acme"):
+        TenantPolicy.build("globex", verifier=acme.verifier)
+
+
+def test_policy_enrollment_helpers(policies):
+    acme, globex = policies
+    auth = acme.auth()
+    assert auth.issuer_name == "Acme"
+    assert auth.qr_fill_color == "navy"
+    assert globex.auth(GLOBEX_SECRET).digits == 8
+
+    token = acme.encrypt_secret("SECRET", compact=True)
+    assert TwoFactorAuth.decrypt_secret(token, ACME_KEY) == "SECRET"
+    assert globex.encrypt_secret("SECRET") == "SECRET"
+
+
+def test_policy_is_immutable(policies):
+    with pytest.raises(AttributeError):
+        policies[0].issuer_name = "Other"
+
+
+def test_middleware_uses_each_tenants_policy(policies, authenticate):
+    app = FastAPI()
+
+    @app.get("/public")
+    async def public():
+        return {}
+
+    @app.get("/private")
+    async def private():
+        return {}
+
+    app.add_middleware(
+        TwoFactorMiddleware,
+        tenants=TenantResolver(policies, header="X-Tenant")
+    )
+
+    authenticate(app)
+    client = TestClient(app)
+
+    acme_code = pyotp.TOTP(ACME_SECRET).now()
+    globex_code = pyotp.TOTP(GLOBEX_SECRET, digits=8).now()
+    assert client.get(
+        "/private",
+        headers={"X-Tenant": "acme", "X-2FA-Code": acme_code}
+    ).status_code == 200
+    assert client.get(
+        "/private",
+        headers={"X-Tenant": "globex", "X-2FA-Code": globex_code}
+    ).status_code == 200
+    assert client.get("/public", headers={"X-Tenant": "acme"}).status_code == 200
+
+    with pytest.raises(HTTPException) as e:
+        client.get("/public", headers={"X-Tenant": "globex"})
+    assert e.value.status_code == 401
+    with pytest.raises(HTTPException) as e:
+        client.get(
+            "/private",
+            headers={"X-Tenant": "globex", "X-2FA-Code": acme_code}
+        )
+    assert e.value.status_code == 401
+    with pytest.raises(HTTPException) as e:
+        client.get("/private")
+    assert e.value.status_code == 400
+
+
+def test_middleware_closes_tenant_audits(mock_get_user_secret):
+    sink = RecordingSink()
+    audit = AuditQueue(sink)
+    tenants = TenantResolver(
+        [
+            TenantPolicy.build("a", mock_get_user_secret, audit=audit),
+            TenantPolicy.build("b", mock_get_user_secret, audit=audit)
+        ],
+        header="X-Tenant"
+    )
+    app = FastAPI()
+    app.add_middleware(TwoFactorMiddleware, tenants=tenants)
+    with TestClient(app):
+        middleware = app.middleware_stack
+        while not isinstance(middleware, TwoFactorMiddleware):
+            middleware = middleware.app
+        assert middleware._closables == [audit]
+        assert middleware.verifier is None
+
+
+@pytest.mark.parametrize("options", [
+    {"excluded_paths": ["/login"]},
+    {"encryption_key": ACME_KEY},
+    {"warm_up_source": lambda: iter(())}
+])
+def test_tenants_exclude_single_tenant_options(test_app, policies, options):
+    with pytest.raises(ValueError):
+        TwoFactorMiddleware(
+            test_app,
+            tenants=TenantResolver(policies, header="X-Tenant"),
+            **options
+        )
@@ -0,0 +1,239 @@
+import asyncio
+import pytest
+import pyotp
+from cryptography.fernet import Fernet
+from fastapi import (
+    HTTPException,
+    status
+)
+from two_fast_auth import (
+    AttemptThrottle,
+    MemoryThrottleBackend,
+    TwoFactorVerifier
+)
+
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_refills():
+    now = [0.0]
+    backend = MemoryThrottleBackend(
+        capacity=2,
+        refill_per_second=0.5,
+        clock=lambda: now[0]
+    )
+
+    assert await backend.try_acquire("k") == 0
+    assert await backend.blocked_for("k") == 0
+    assert await backend.try_acquire("k") == 0
+    assert await backend.blocked_for("k") == pytest.approx(2.0)
+    assert await backend.try_acquire("k") == pytest.approx(2.0)
+
+    now[0] = 1.0
+    assert await backend.blocked_for("k") == pytest.approx(1.0)
+    now[0] = 2.0
+    assert await backend.blocked_for("k") == 0
+
+    await backend.refund("k")
+    await backend.refund("k")
+    assert backend._tokens("k", now[0]) == 2.0
+
+
+@pytest.mark.asyncio
+async def test_bucket_store_is_bounded():
+    backend = MemoryThrottleBackend(capacity=1, max_entries=3)
+    for key in range(10):
+        await backend.try_acquire(str(key))
+    assert len(backend) == 3
+    assert await backend.blocked_for("0") == 0
+    assert await backend.blocked_for("9") > 0
+
+
+def test_invalid_throttle_configuration():
+    with pytest.raises(ValueError):
+        MemoryThrottleBackend(capacity=0)
+    with pytest.raises(ValueError):
+        MemoryThrottleBackend(refill_per_second=0)
+    with pytest.raises(ValueError):
+        AttemptThrottle(per_user=False, per_client=False)
+
+
+@pytest.fixture
+def counting_lookup():
+    calls = []
+
+    async def _lookup(user_id):
+        calls.append(user_id)
+        return "SECRETEXAMPLE"
+
+    _lookup.calls = calls
+    return _lookup
+
+
+@pytest.mark.asyncio
+async def test_throttled_user_rejected_before_lookup(
+    counting_lookup,
+    mock_user,
+    make_request
+):
+    throttle = AttemptThrottle(
+        MemoryThrottleBackend(capacity=2),
+        per_client=False
+    )
+    verifier = TwoFactorVerifier(counting_lookup, throttle=throttle)
+
+    for code in ("000000", "111111"):
+        with pytest.raises(HTTPException) as exc:
+            await verifier.verify_request(make_request(mock_user, code))
+        assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
+    assert counting_lookup.calls == ["user_with_2fa"] * 2
+
+    with pytest.raises(HTTPException) as exc:
+        await verifier.verify_request(
+            make_request(mock_user, pyotp.TOTP("SECRETEXAMPLE").now())
+        )
+    assert exc.value.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert int(exc.value.headers["Retry-After"]) > 0
+    assert counting_lookup.calls == ["user_with_2fa"] * 2
+
+
+@pytest.mark.asyncio
+async def test_missing_and_malformed_codes_are_not_charged(
+    counting_lookup,
+    mock_user,
+    make_request
+):
+    throttle = AttemptThrottle(MemoryThrottleBackend(capacity=1))
+    verifier = TwoFactorVerifier(counting_lookup, throttle=throttle)
+
+    for code in (None, "", "abc", "1234567") * 3:
+        with pytest.raises(HTTPException) as exc:
+            await verifier.verify_request(make_request(mock_user, code))
+        assert exc.value.status_code == status.HTTP_401_UNAUTHORIZED
+
+    result = await verifier.verify_request(
+        make_request(mock_user, pyotp.TOTP("SECRETEXAMPLE").now())
+    )
+    assert result.user_id == "user_with_2fa"
+
+
+@pytest.mark.asyncio
+async def test_client_throttle_spans_users(counting_lookup, mock_user, make_request):
+    throttle = AttemptThrottle(
+        MemoryThrottleBackend(capacity=1),
+        per_user=False
+    )
+    verifier = TwoFactorVerifier(counting_lookup, throttle=throttle)
+
+    with pytest.raises(HTTPException):
+        await verifier.verify_request(make_request(mock_user, "000000"))
+
+    mock_user.id = "another_user"
+    with pytest.raises(HTTPException) as exc:
+        await verifier.verify_request(make_request(mock_user, "000000"))
+    assert exc.value.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+    result = await verifier.verify_request(make_request(
+        mock_user,
+        pyotp.TOTP("SECRETEXAMPLE").now(),
+        client="198.51.100.1"
+    ))
+    assert result.user_id == "another_user"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_attempts_cannot_bypass_the_throttle(
+    mock_user,
+    make_request
+):
+    async def slow_lookup(user_id):
+        await asyncio.sleep(0.01)
+        return "SECRETEXAMPLE"
+
+    throttle = AttemptThrottle(
+        MemoryThrottleBackend(capacity=5),
+        per_client=False
+    )
+    verifier = TwoFactorVerifier(slow_lookup, throttle=throttle)
+    wrong = "000000" if pyotp.TOTP("SECRETEXAMPLE").now() != "000000" else "111111"
+
+    results = await asyncio.gather(
+        *(
+            verifier.verify_request(make_request(mock_user, wrong))
+            for _ in range(100)
+        ),
+        return_exceptions=True
+    )
+    statuses = sorted(result.status_code for result in results)
+    assert statuses == [401] * 5 + [429] * 95
+
+
+@pytest.mark.asyncio
+async def test_users_without_2fa_pass_a_throttled_client(make_request):
+    async def lookup(user_id):
+        return "SECRETEXAMPLE" if user_id == "attacker" else None
+
+    throttle = AttemptThrottle(
+        MemoryThrottleBackend(capacity=1),
+        per_user=False
+    )
+    verifier = TwoFactorVerifier(lookup, throttle=throttle)
+    with pytest.raises(HTTPException):
+        await verifier.verify_request(make_request("attacker", "000000"))
+    with pytest.raises(HTTPException) as exc:
+        await verifier.verify_request(make_request("attacker", "000000"))
+    assert exc.value.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+    # Same address, a user without 2FA and no code
+    assert await verifier.verify_request(make_request("bystander")) is None
+
+
+@pytest.mark.asyncio
+async def test_attempts_of_users_without_2fa_are_refunded(make_request):
+    async def lookup(user_id):
+        return None
+
+    throttle = AttemptThrottle(MemoryThrottleBackend(capacity=1))
+    verifier = TwoFactorVerifier(lookup, throttle=throttle)
+    for _ in range(3):
+        assert await verifier.verify_request(
+            make_request("bystander", "123456")
+        ) is None
+
+
+@pytest.mark.asyncio
+async def test_successful_attempts_are_free(counting_lookup, mock_user, make_request):
+    throttle = AttemptThrottle(MemoryThrottleBackend(capacity=1))
+    verifier = TwoFactorVerifier(counting_lookup, throttle=throttle)
+
+    for _ in range(3):
+        await verifier.verify_request(
+            make_request(
+                mock_user,
+                pyotp.TOTP("SECRETEXAMPLE").now(),
+                client=None
+            )
+        )
+    assert throttle.keys(make_request(mock_user, client=None), "u") == ["user:u"]
+
+
+@pytest.mark.asyncio
+async def test_decryption_errors_are_not_charged(
+    mock_user,
+    encrypted_secret,
+    make_request
+):
+    async def lookup(user_id):
+        return encrypted_secret
+
+    throttle = AttemptThrottle(MemoryThrottleBackend(capacity=1))
+    verifier = TwoFactorVerifier(
+        lookup,
+        encryption_key=Fernet.generate_key(),
+        throttle=throttle
+    )
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc:
+            await verifier.verify_request(make_request(mock_user, "123456"))
+        assert "Decryption failed" in exc.value.detail
@@ -0,0 +1,248 @@
+import asyncio
+import pytest
+import time
+import pyotp
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from two_fast_auth import (
+    SecretCache,
+    TwoFactorAuth,
+    TwoFactorMiddleware,
+    TwoFactorVerifier,
+    warm_up
+)
+from two_fast_auth.lru import LRUCache
+from cryptography.fernet import Fernet
+
+
+
+async def _pairs(pairs):
+    for pair in pairs:
+        yield pair
+
+
+def _verifier(calls, **options):
+    async def get_secret(user_id):
+        calls.append(user_id)
+        return None
+
+    options.setdefault("secret_cache", SecretCache())
+    return TwoFactorVerifier(get_secret, **options)
+
+
+@pytest.mark.asyncio
+async def test_warm_up_fills_the_cache():
+    calls = []
+    verifier = _verifier(calls)
+    pairs = [(f"user{i}", pyotp.random_base32()) for i in range(20)]
+
+    report = await warm_up(verifier, _pairs(pairs), chunk_size=3)
+
+    assert report.loaded == 20
+    assert report.stopped is None
+    assert report.bytes_used > 0
+    assert await verifier.resolve_secret(None, "user7") == pairs[7][1]
+    assert calls == []
+
+
+@pytest.mark.asyncio
+async def test_undecryptable_secrets_are_skipped():
+    key = Fernet.generate_key()
+    good = TwoFactorAuth.encrypt_secret(pyotp.random_base32(), key)
+    verifier = _verifier([], encryption_key=key)
+
+    report = await warm_up(
+        verifier,
+        _pairs([
+            ("good", good),
+            ("bad", "not-a-token"),
+            ("devices", {"phone": good, "tablet": "broken"}),
+            ("none", None)
+        ])
+    )
+
+    assert report.loaded == 1
+    assert report.invalid == 2
+    assert len(verifier.secret_cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_memory_budget_stops_the_warm_up():
+    verifier = _verifier([])
+    pairs = [(f"user{i}", pyotp.random_base32()) for i in range(100)]
+
+    report = await warm_up(verifier, _pairs(pairs), memory_budget=3000)
+
+    assert report.stopped == "memory"
+    assert 0 < report.loaded < 100
+    assert report.bytes_used <= 3000
+
+
+@pytest.mark.asyncio
+async def test_capacity_stops_the_warm_up():
+    verifier = _verifier([], secret_cache=SecretCache(max_entries=5))
+    pairs = [(f"user{i}", "SECRET") for i in range(10)]
+
+    report = await warm_up(verifier, _pairs(pairs))
+
+    assert report.stopped == "capacity"
+    assert report.loaded == 5
+
+
+@pytest.mark.asyncio
+async def test_time_budget_stops_a_slow_source():
+    async def slow():
+        yield "user1", "SECRET"
+        await asyncio.sleep(1)
+        yield "user2", "SECRET"
+
+    verifier = _verifier([])
+    report = await warm_up(verifier, slow(), chunk_size=1, time_budget=0.05)
+
+    assert report.stopped == "time"
+    assert report.loaded == 1
+    assert report.elapsed < 0.5
+
+    report = await warm_up(verifier, _pairs([("user3", "SECRET")]), time_budget=0)
+    assert report.stopped == "time"
+
+
+@pytest.mark.asyncio
+async def test_time_budget_abandons_slow_decryption(mocker):
+    verifier = _verifier([])
+    preloaded = []
+
+    def slow_preload(user_id, secret):
+        time.sleep(0.02)
+        preloaded.append(user_id)
+
+    mocker.patch.object(verifier, "preload_secret", side_effect=slow_preload)
+    pairs = [(f"user{i}", "SECRET") for i in range(100)]
+    report = await warm_up(verifier, _pairs(pairs), time_budget=0.1)
+
+    assert report.stopped == "time"
+    assert report.loaded == 0
+    assert report.elapsed < 0.5
+    await asyncio.sleep(0.05)
+    assert len(preloaded) < 100
+    assert len(verifier.secret_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_decrypted_secrets_are_kept(mocker, mock_user, make_request):
+    key = Fernet.generate_key()
+    secret = pyotp.random_base32()
+    verifier = _verifier([], encryption_key=key)
+    await warm_up(
+        verifier,
+        _pairs([("user_with_2fa", TwoFactorAuth.encrypt_secret(secret, key))])
+    )
+
+    decrypt = mocker.spy(TwoFactorAuth, "decrypt_secret")
+    result = await verifier.verify_request(make_request(
+        mock_user,
+        pyotp.TOTP(secret).now()
+    ))
+    assert result.user_id == "user_with_2fa"
+    assert decrypt.call_count == 0
+
+
+@pytest.mark.asyncio
+async def test_source_errors_are_reported():
+    async def broken():
+        yield "user1", "SECRET"
+        raise RuntimeError("query failed")
+
+    verifier = _verifier([])
+    report = await warm_up(verifier, broken())
+
+    assert report.stopped == "error"
+    assert isinstance(report.error, RuntimeError)
+    assert report.loaded == 1
+
+
+@pytest.mark.asyncio
+async def test_warm_up_requires_a_cache():
+    verifier = _verifier([], secret_cache=None)
+    with pytest.raises(ValueError):
+        await warm_up(verifier, _pairs([]))
+    with pytest.raises(ValueError):
+        await warm_up(_verifier([]), _pairs([]), chunk_size=0)
+
+
+def test_middleware_warms_up_during_startup(mock_get_user_secret):
+    events = []
+
+    @asynccontextmanager
+    async def lifespan(app):
+        events.append("app startup")
+        yield
+
+    async def active_users():
+        events.append("warm-up")
+        yield "user1", "SECRET"
+        yield "user2", "SECRET"
+
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(
+        TwoFactorMiddleware,
+        get_user_secret_callback=mock_get_user_secret,
+        secret_cache=SecretCache(),
+        warm_up_source=active_users
+    )
+
+    with TestClient(app):
+        middleware = app.middleware_stack
+        while not isinstance(middleware, TwoFactorMiddleware):
+            middleware = middleware.app
+        report = middleware.warm_up_report
+        assert report.loaded == 2
+        assert len(middleware.verifier.secret_cache) == 2
+    assert events == ["app startup", "warm-up"]
+
+
+def test_warm_up_source_requires_a_cache(test_app, mock_get_user_secret):
+    async def active_users():
+        yield "user1", "SECRET"
+
+    with pytest.raises(ValueError):
+        TwoFactorMiddleware(
+            test_app,
+            mock_get_user_secret,
+            warm_up_source=active_users
+        )
+
+
+@pytest.mark.asyncio
+async def test_warm_up_without_source(two_factor_middleware):
+    assert await two_factor_middleware.warm_up() is None
+
+
+@pytest.mark.asyncio
+async def test_warm_up_stops_at_the_decrypted_capacity(mocker):
+    verifier = _verifier([], secret_cache=SecretCache(max_entries=5))
+    verifier._secret_auths = LRUCache(3)
+    preload = mocker.spy(verifier, "preload_secret")
+    pairs = [(f"user{i}", "SECRET") for i in range(10)]
+
+    report = await warm_up(verifier, _pairs(pairs))
+
+    assert report.stopped == "capacity"
+    assert report.loaded == 3
+    assert preload.call_count == 3
+
+
+def test_decrypted_secrets_cover_the_secret_cache():
+    verifier = _verifier(
+        [],
+        secret_cache=SecretCache(max_entries=5000),
+        device_index_size=16
+    )
+    assert verifier.decrypted_capacity == 5000
+    assert _verifier([], device_index_size=16).decrypted_capacity == 10000
+    assert _verifier(
+        [],
+        secret_cache=None,
+        device_index_size=16
+    ).decrypted_capacity == 16
@@ -0,0 +1,153 @@
+import pytest
+import pyotp
+from fastapi import (
+    FastAPI,
+    WebSocket,
+    status
+)
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from two_fast_auth import (
+    AttemptThrottle,
+    RequestProfiler,
+    TwoFactorMiddleware
+)
+
+
+
+@pytest.fixture
+def websocket_app(mock_get_user_secret, authenticate):
+    def build(**options):
+        app = FastAPI()
+
+        @app.websocket("/feed")
+        async def feed(websocket: WebSocket):
+            await websocket.accept(
+                subprotocol=(websocket.scope["subprotocols"] or [None])[0]
+            )
+            result = getattr(websocket.state, "two_fa", None)
+            await websocket.send_json({
+                "user_id": result.user_id if result else None,
+                "subprotocols": websocket.scope["subprotocols"]
+            })
+            await websocket.close()
+
+        @app.websocket("/public")
+        async def public(websocket: WebSocket):
+            await websocket.accept()
+            await websocket.close()
+
+        options.setdefault("excluded_paths", ["/public"])
+        app.add_middleware(
+            TwoFactorMiddleware,
+            get_user_secret_callback=mock_get_user_secret,
+            **options
+        )
+
+        authenticate(app)
+        return TestClient(app)
+
+    return build
+
+
+def _code():
+    return pyotp.TOTP("SECRETEXAMPLE").now()
+
+
+def _rejection(client, url, **options):
+    """The close a client receives right after the handshake"""
+    with client.websocket_connect(url, **options) as websocket:
+        with pytest.raises(WebSocketDisconnect) as e:
+            websocket.receive_text()
+    return e.value
+
+
+def test_handshake_code_from_header(websocket_app):
+    client = websocket_app()
+    with client.websocket_connect(
+        "/feed",
+        headers={"X-2FA-Code": _code()}
+    ) as websocket:
+        assert websocket.receive_json()["user_id"] == "user_with_2fa"
+
+
+def test_handshake_code_from_subprotocol(websocket_app):
+    client = websocket_app()
+    with client.websocket_connect(
+        "/feed",
+        subprotocols=["graphql-ws", f"2fa.{_code()}"]
+    ) as websocket:
+        message = websocket.receive_json()
+    assert message["user_id"] == "user_with_2fa"
+    assert message["subprotocols"] == ["graphql-ws"]
+
+
+def test_handshake_code_from_query_parameter(websocket_app):
+    client = websocket_app(websocket_query_param="code")
+    with client.websocket_connect(f"/feed?code={_code()}") as websocket:
+        assert websocket.receive_json()["user_id"] == "user_with_2fa"
+
+
+def test_query_parameter_is_off_by_default(websocket_app):
+    client = websocket_app()
+    assert _rejection(client, f"/feed?code={_code()}").code == (
+        status.WS_1008_POLICY_VIOLATION
+    )
+
+
+def test_invalid_code_closes_with_policy_violation(websocket_app):
+    client = websocket_app()
+    # The handshake succeeds and the close frame follows, so the client
+    # sees the code and reason instead of an HTTP 403
+    with client.websocket_connect(
+        "/feed",
+        headers={"X-2FA-Code": "000000"}
+    ) as websocket:
+        with pytest.raises(WebSocketDisconnect) as e:
+            websocket.receive_text()
+    assert e.value.code == status.WS_1008_POLICY_VIOLATION
+    assert e.value.reason == "Invalid or missing 2FA code"
+
+
+def test_rejection_accepts_an_offered_subprotocol(websocket_app):
+    client = websocket_app()
+    with client.websocket_connect(
+        "/feed",
+        subprotocols=["graphql-ws", "2fa.000000"]
+    ) as websocket:
+        assert websocket.accepted_subprotocol == "graphql-ws"
+        with pytest.raises(WebSocketDisconnect) as e:
+            websocket.receive_text()
+    assert e.value.code == status.WS_1008_POLICY_VIOLATION
+
+
+def test_throttled_handshake_asks_to_retry(websocket_app):
+    client = websocket_app(throttle=AttemptThrottle())
+    for _ in range(5):
+        _rejection(client, "/feed", headers={"X-2FA-Code": "000000"})
+    rejection = _rejection(client, "/feed", headers={"X-2FA-Code": _code()})
+    assert rejection.code == status.WS_1013_TRY_AGAIN_LATER
+
+
+def test_excluded_websocket_paths_skip_verification(websocket_app):
+    client = websocket_app()
+    with client.websocket_connect("/public"):
+        pass
+
+
+def test_users_without_2fa_connect(websocket_app, mock_user):
+    mock_user.id = "user_no_2fa"
+    client = websocket_app()
+    with client.websocket_connect("/feed") as websocket:
+        assert websocket.receive_json()["user_id"] is None
+
+
+def test_handshake_is_profiled(websocket_app, tmp_path):
+    profiler = RequestProfiler(str(tmp_path / "2fa.prof"), every=1)
+    client = websocket_app(profiler=profiler)
+    with client.websocket_connect(
+        "/feed",
+        headers={"X-2FA-Code": _code()}
+    ) as websocket:
+        assert websocket.receive_json()["user_id"] == "user_with_2fa"
+    assert profiler.sampled == 1
@@ -1,8 +1,86 @@
+from .audit import (
+    AuditEvent,
+    AuditQueue,
+    CallbackAuditSink,
+    JsonlAuditSink
+)
+from .cache import SecretCache
+from .callbacks import CallbackPool
+from .clock import StepClock
 from .core import TwoFactorAuth
+from .dependencies import (
+    get_2fa_result,
+    require_2fa,
+    verified_2fa
+)
+from .devices import DeviceCodeIndex
+from .drift import DriftTracker
+from .enrollment import EnrollmentFilter
+from .envelope import (
+    CachingKeyProvider,
+    KeyProvider,
+    LocalKMS
+)
+from .hot import HotCodes
+from .limits import LookupLimiter
 from .middleware import TwoFactorMiddleware
+from .profiling import RequestProfiler
+from .snapshot import (
+    SnapshotResolver,
+    export_snapshot
+)
+from .tenants import (
+    TenantPolicy,
+    TenantResolver
+)
+from .throttle import (
+    AttemptThrottle,
+    MemoryThrottleBackend,
+    ThrottleBackend
+)
+from .verifier import (
+    TwoFactorResult,
+    TwoFactorVerifier,
+    VerificationContext
+)
+from .warmup import (
+    WarmUpReport,
+    warm_up
+)
 
 
 __all__ = [
+    "AttemptThrottle",
+    "AuditEvent",
+    "AuditQueue",
+    "CachingKeyProvider",
+    "CallbackAuditSink",
+    "CallbackPool",
+    "DeviceCodeIndex",
+    "DriftTracker",
+    "EnrollmentFilter",
+    "HotCodes",
+    "JsonlAuditSink",
+    "KeyProvider",
+    "LocalKMS",
+    "LookupLimiter",
+    "MemoryThrottleBackend",
+    "RequestProfiler",
+    "SecretCache",
+    "SnapshotResolver",
+    "StepClock",
+    "TenantPolicy",
+    "TenantResolver",
+    "ThrottleBackend",
     "TwoFactorAuth",
-    "TwoFactorMiddleware"
+    "TwoFactorMiddleware",
+    "TwoFactorResult",
+    "TwoFactorVerifier",
+    "VerificationContext",
+    "WarmUpReport",
+    "export_snapshot",
+    "get_2fa_result",
+    "require_2fa",
+    "verified_2fa",
+    "warm_up"
 ]
@@ -0,0 +1,253 @@
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import (
+    asdict,
+    dataclass,
+    field
+)
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Optional,
+    Protocol,
+    Union
+)
+from .callbacks import is_async_callable
+from .tasks import (
+    cancel_task,
+    stop_task,
+    task_alive
+)
+
+
+OVERFLOW_POLICIES = ("drop_new", "drop_oldest")
+
+
+@dataclass(frozen=True)
+class AuditEvent:
+    user_id: str
+    outcome: str  # "success" or "failure"
+    status_code: int
+    path: str
+    client: Optional[str] = None
+    device_id: Optional[str] = None
+    detail: Optional[str] = None
+    timestamp: float = field(default_factory=time.time)
+
+
+@dataclass
+class AuditBatch:
+    events: list[AuditEvent]
+    # user_id -> latest successful verification, one entry per user
+    last_used: dict[str, float]
+
+
+class AuditSink(Protocol):
+    async def write(
+        self,
+        batch: AuditBatch
+    ) -> None:
+        ...
+
+
+class JsonlAuditSink:
+    def __init__(
+        self,
+        path: str
+    ):
+        """Append events to a JSON Lines file, one object per line
+
+        Writes run in a worker thread. ``last_used`` updates are not
+        written; they are meant for a database (see
+        ``CallbackAuditSink``).
+        """
+        self.path = path
+
+    async def write(
+        self,
+        batch: AuditBatch
+    ) -> None:
+        if batch.events:
+            lines = "".join(
+                json.dumps(asdict(event)) + "\n" for event in batch.events
+            )
+            await asyncio.to_thread(self._append, lines)
+
+    def _append(
+        self,
+        lines: str
+    ) -> None:
+        with open(self.path, "a") as file:
+            file.write(lines)
+
+
+BulkCallback = Callable[[Any], Union[Awaitable[None], None]]
+
+
+class CallbackAuditSink:
+    def __init__(
+        self,
+        on_events: Optional[BulkCallback] = None,
+        on_last_used: Optional[BulkCallback] = None
+    ):
+        """Hand each batch to bulk callbacks, e.g. an ``INSERT`` of all
+        events and one ``UPDATE ... last_verified_at`` per batch
+
+        Callbacks may be async or sync; sync ones run in a worker thread.
+        """
+        self.on_events = on_events
+        self.on_last_used = on_last_used
+
+    async def write(
+        self,
+        batch: AuditBatch
+    ) -> None:
+        if batch.events and self.on_events is not None:
+            await self._call(self.on_events, batch.events)
+        if batch.last_used and self.on_last_used is not None:
+            await self._call(self.on_last_used, batch.last_used)
+
+    @staticmethod
+    async def _call(
+        callback: BulkCallback,
+        argument: Any
+    ) -> None:
+        if is_async_callable(callback):
+            await callback(argument)
+        else:
+            await asyncio.to_thread(callback, argument)
+
+
+class AuditQueue:
+    def __init__(
+        self,
+        sink: AuditSink,
+        *,
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        overflow: str = "drop_new"
+    ):
+        """Bounded in-memory queue of audit events, flushed in batches
+
+        ``emit`` never waits: when ``max_queue`` events are pending, the
+        ``overflow`` policy drops either the new event (``drop_new``) or
+        the oldest pending one (``drop_oldest``), and counts it. A
+        background task hands the sink up to ``batch_size`` events at
+        least every ``flush_interval`` seconds, together with the
+        per-user last successful verification time, coalesced so each
+        user appears once per batch.
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"overflow must be one of {', '.join(OVERFLOW_POLICIES)}"
+            )
+        if max_queue < 1 or batch_size < 1:
+            raise ValueError("max_queue and batch_size must be at least 1")
+        if flush_interval <= 0:
+            raise ValueError("flush_interval must be positive")
+
+        self.sink = sink
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self._events: Deque[AuditEvent] = deque()
+        self._last_used: dict[str, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task[None]] = None
+        self.emitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.sink_errors = 0
+
+    def emit(
+        self,
+        event: AuditEvent
+    ) -> None:
+        """Queue an event without waiting"""
+        self.emitted += 1
+        if len(self._events) >= self.max_queue:
+            self.dropped += 1
+            if self.overflow == "drop_new":
+                return
+            self._events.popleft()
+        self._events.append(event)
+
+        if event.outcome == "success":
+            if event.user_id in self._last_used:
+                self.coalesced += 1
+            self._last_used[event.user_id] = max(
+                event.timestamp,
+                self._last_used.get(event.user_id, 0.0)
+            )
+
+        wakeup = self._ensure_flusher()
+        if len(self._events) >= self.batch_size:
+            wakeup.set()
+
+    async def flush(self) -> None:
+        """Write everything pending now"""
+        while self._events or self._last_used:
+            await self._write_batch()
+
+    async def close(self) -> None:
+        """Flush pending events and stop the background task"""
+        flusher, self._flusher = self._flusher, None
+        await stop_task(flusher)
+        await self.flush()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "queued": len(self._events),
+            "emitted": self.emitted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "sink_errors": self.sink_errors
+        }
+
+    def _ensure_flusher(self) -> asyncio.Event:
+        """Start the flusher in the running loop if it is not alive
+
+        The wakeup event belongs to one loop, so a flusher left in another
+        loop is cancelled and replaced.
+        """
+        loop = asyncio.get_running_loop()
+        if self._wakeup is None or not task_alive(self._flusher, loop):
+            cancel_task(self._flusher)
+            self._wakeup = asyncio.Event()
+            self._flusher = loop.create_task(
+                self._flush_loop(self._wakeup)
+            )
+        return self._wakeup
+
+    async def _flush_loop(
+        self,
+        wakeup: asyncio.Event
+    ) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+            await self.flush()
+
+    async def _write_batch(self) -> None:
+        count = min(len(self._events), self.batch_size)
+        events = [self._events.popleft() for _ in range(count)]
+        last_used, self._last_used = self._last_used, {}
+        try:
+            await self.sink.write(AuditBatch(events, last_used))
+        except Exception:
+            # Never let auditing take requests down; the loss is counted
+            self.sink_errors += 1
+            self.dropped += len(events)
+        else:
+            self.written += len(events)
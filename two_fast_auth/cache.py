@@ -0,0 +1,239 @@
+import asyncio
+import random
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Generic,
+    Hashable,
+    Optional,
+    TypeVar
+)
+from .lru import LRUCache
+from .tasks import (
+    cancel_task,
+    stop_task,
+    task_alive
+)
+
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+Loader = Callable[[], Awaitable[V]]
+
+
+class SecretCache(Generic[K, V]):
+    def __init__(
+        self,
+        *,
+        ttl: float = 300.0,
+        grace: float = 60.0,
+        jitter: float = 0.1,
+        max_entries: int = 10000,
+        max_pending_refreshes: int = 1000,
+        clock: Optional[Callable[[], float]] = None
+    ):
+        """Stale-while-revalidate cache for secret lookups
+
+        Entries are fresh for ``ttl`` seconds, shortened by up to
+        ``jitter`` (a fraction of ``ttl``) so that entries loaded together
+        do not expire together. For ``grace`` seconds after that the
+        stale value is still served while one background task reloads
+        it; at most ``max_pending_refreshes`` reloads wait in its queue.
+        Older entries are loaded on the request path, concurrent misses
+        for the same key sharing one load.
+        """
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+        if grace < 0:
+            raise ValueError("grace cannot be negative")
+        if not 0 <= jitter < 1:
+            raise ValueError("jitter must be in [0, 1)")
+        if max_pending_refreshes < 1:
+            raise ValueError("max_pending_refreshes must be at least 1")
+
+        self.ttl = ttl
+        self.grace = grace
+        self.jitter = jitter
+        self.max_pending_refreshes = max_pending_refreshes
+        self._clock = clock or time.monotonic
+        # key -> (value, fresh_until, stale_until)
+        self._entries: LRUCache[K, tuple[V, float, float]] = LRUCache(
+            max_entries
+        )
+        self._loading: dict[K, asyncio.Task[V]] = {}
+        self._pending: set[K] = set()
+        self._queue: Optional[asyncio.Queue[tuple[K, Loader[V]]]] = None
+        self._refresher: Optional[asyncio.Task[None]] = None
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.refresh_dropped = 0
+
+    async def get(
+        self,
+        key: K,
+        loader: Loader[V]
+    ) -> V:
+        """Cached value for ``key``, calling ``loader`` when needed"""
+        now = self._clock()
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fresh_until, stale_until = entry
+            if now < fresh_until:
+                self.hits += 1
+                return value
+            if now < stale_until:
+                self.stale_hits += 1
+                self._schedule_refresh(key, loader)
+                return value
+
+        self.misses += 1
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = asyncio.get_running_loop().create_task(
+                self._load(key, loader)
+            )
+            # Retrieve the exception even if every caller gave up
+            loading.add_done_callback(
+                lambda task: task.cancelled() or task.exception()
+            )
+            self._loading[key] = loading
+        # A caller that is cancelled (e.g. by a timeout) leaves the load
+        # running for the others, and its result still fills the cache
+        return await asyncio.shield(loading)
+
+    async def _load(
+        self,
+        key: K,
+        loader: Loader[V]
+    ) -> V:
+        task = asyncio.current_task()
+        try:
+            value = await loader()
+        except BaseException:
+            if self._loading.get(key) is task:
+                del self._loading[key]
+            raise
+        if self._loading.get(key) is task:
+            del self._loading[key]
+            self._store(key, value)
+        return value
+
+    def prime(
+        self,
+        key: K,
+        value: V
+    ) -> None:
+        """Insert a value loaded out of band, e.g. during warm-up"""
+        self._store(key, value)
+
+    @property
+    def max_entries(self) -> int:
+        return self._entries.max_entries
+
+    def invalidate(
+        self,
+        key: K
+    ) -> None:
+        """Drop a key at once, e.g. after the user resets 2FA
+
+        Loads and refreshes already running for the key are discarded
+        instead of re-inserting the old value.
+        """
+        self._entries.pop(key)
+        self._loading.pop(key, None)
+        self._pending.discard(key)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._loading.clear()
+        self._pending.clear()
+
+    async def close(self) -> None:
+        """Stop the background refresher"""
+        refresher, self._refresher = self._refresher, None
+        await stop_task(refresher)
+        self._queue = None
+        self._pending.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "refresh_dropped": self.refresh_dropped,
+            "refresh_queue": len(self._pending)
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _store(
+        self,
+        key: K,
+        value: V
+    ) -> None:
+        now = self._clock()
+        ttl = self.ttl * (1 - self.jitter * random.random())
+        self._entries.set(key, (value, now + ttl, now + ttl + self.grace))
+
+    def _schedule_refresh(
+        self,
+        key: K,
+        loader: Loader[V]
+    ) -> None:
+        if key in self._pending:
+            return
+        queue = self._ensure_refresher()
+        try:
+            queue.put_nowait((key, loader))
+        except asyncio.QueueFull:
+            self.refresh_dropped += 1
+            return
+        self._pending.add(key)
+
+    def _ensure_refresher(self) -> "asyncio.Queue[tuple[K, Loader[V]]]":
+        """Start the refresher in the running loop if it is not alive
+
+        The queue belongs to one loop, so a refresher left in another
+        loop is cancelled and replaced.
+        """
+        loop = asyncio.get_running_loop()
+        if self._queue is None or not task_alive(self._refresher, loop):
+            cancel_task(self._refresher)
+            self._pending.clear()
+            self._queue = asyncio.Queue(self.max_pending_refreshes)
+            self._refresher = loop.create_task(
+                self._refresh_loop(self._queue)
+            )
+        return self._queue
+
+    async def _refresh_loop(
+        self,
+        queue: "asyncio.Queue[tuple[K, Loader[V]]]"
+    ) -> None:
+        while True:
+            key, loader = await queue.get()
+            if key not in self._pending:
+                # Invalidated while queued
+                continue
+            entry = self._entries.get(key)
+            try:
+                value: Any = await loader()
+            except Exception:
+                # Keep serving the stale value until the grace period ends
+                self.refresh_errors += 1
+            else:
+                self.refreshes += 1
+                if key in self._pending and self._entries.get(key) is entry:
+                    self._store(key, value)
+            finally:
+                self._pending.discard(key)
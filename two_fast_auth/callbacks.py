@@ -0,0 +1,172 @@
+import asyncio
+import functools
+import inspect
+import threading
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor
+)
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Optional,
+    TypeGuard,
+    TypeVar,
+    Union
+)
+from .devices import SecretSet
+from .limits import LookupRejected
+
+
+T = TypeVar("T")
+
+# Async or plain function returning the user's encrypted secret(s)
+SecretCallback = Callable[
+    [str],
+    Union[Awaitable[Optional[SecretSet]], Optional[SecretSet]]
+]
+
+# A SecretCallback as the verifier calls it
+AsyncSecretCallback = Callable[[str], Awaitable[Optional[SecretSet]]]
+
+
+def is_async_callable(
+    obj: Any
+) -> TypeGuard[Callable[..., Awaitable[Any]]]:
+    """True for coroutine functions, also behind partials or ``__call__``"""
+    while isinstance(obj, functools.partial):
+        obj = obj.func
+    return inspect.iscoroutinefunction(obj) or (
+        callable(obj) and inspect.iscoroutinefunction(obj.__call__)
+    )
+
+
+class CallbackPool:
+    def __init__(
+        self,
+        max_workers: int = 8,
+        *,
+        max_queue: int = 64,
+        thread_name_prefix: str = "two-fast-auth"
+    ):
+        """Dedicated thread pool for blocking secret callbacks
+
+        Kept apart from Starlette's default threadpool so slow secret
+        lookups cannot starve sync routes, and vice versa. At most
+        ``max_queue`` calls wait for one of the ``max_workers`` threads;
+        further calls are rejected with ``LookupRejected``.
+        """
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        if max_queue < 0:
+            raise ValueError("max_queue cannot be negative")
+
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.thread_name_prefix = thread_name_prefix
+        self._executor = self._new_executor()
+        self._lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+        self.peak_queued = 0
+        self.rejected = 0
+        self.completed = 0
+
+    async def run(
+        self,
+        function: Callable[..., T],
+        *args: Any
+    ) -> T:
+        """Run ``function(*args)`` in the pool without blocking the loop"""
+        with self._lock:
+            if self.active + self.queued >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise LookupRejected("Secret callback pool is saturated")
+            self.queued += 1
+            self.peak_queued = max(self.peak_queued, self.queued)
+
+        try:
+            future = self._executor.submit(self._call, function, args)
+        except BaseException:
+            with self._lock:
+                self.queued -= 1
+            raise
+        # A caller cancelled before a thread picks the call up (e.g. by
+        # a lookup timeout) cancels the future; give its slot back
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def wrap(
+        self,
+        function: Callable[[str], Union[Awaitable[T], T]]
+    ) -> Callable[[str], Awaitable[T]]:
+        """Async version of a sync secret callback, run in this pool
+
+        A plain function that returns an awaitable, such as
+        ``lambda user_id: fetch(user_id)``, has its result awaited on the
+        event loop.
+        """
+        async def run_in_pool(user_id: str) -> T:
+            result = await self.run(function, user_id)
+            if inspect.isawaitable(result):
+                return await result
+            return result
+        return run_in_pool
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "max_workers": self.max_workers,
+            "active": self.active,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "rejected": self.rejected,
+            "completed": self.completed
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def close(self) -> None:
+        """Stop the worker threads, e.g. at application shutdown
+
+        Queued calls are cancelled and running ones waited for. Threads
+        are started again if the pool is used afterwards.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, self._new_executor()
+        await asyncio.to_thread(
+            executor.shutdown,
+            wait=True,
+            cancel_futures=True
+        )
+
+    def _new_executor(self) -> ThreadPoolExecutor:
+        # Threads are only started as calls are submitted
+        return ThreadPoolExecutor(
+            self.max_workers,
+            thread_name_prefix=self.thread_name_prefix
+        )
+
+    def _release(
+        self,
+        future: "Future[Any]"
+    ) -> None:
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    def _call(
+        self,
+        function: Callable[..., T],
+        args: tuple[Any, ...]
+    ) -> T:
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return function(*args)
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
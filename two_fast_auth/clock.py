@@ -0,0 +1,84 @@
+import time
+from typing import (
+    Callable,
+    NamedTuple,
+    Optional
+)
+
+
+class Tick(NamedTuple):
+    step: int
+    window: int
+    counters: tuple[bytes, ...]
+
+    def counter(
+        self,
+        offset: int = 0
+    ) -> bytes:
+        """Packed HMAC counter for a step offset"""
+        if -self.window <= offset <= self.window:
+            return self.counters[offset + self.window]
+        return (self.step + offset).to_bytes(8, "big")
+
+
+class StepClock:
+    _shared: dict[int, "StepClock"] = {}
+
+    def __init__(
+        self,
+        interval: int = 30,
+        *,
+        window: int = 2,
+        clock: Optional[Callable[[], float]] = None
+    ):
+        if interval < 1:
+            raise ValueError("Interval must be a positive number of seconds")
+        if window < 0:
+            raise ValueError("window cannot be negative")
+
+        self.interval = interval
+        self.window = window
+        self._clock = clock
+        self._state: Optional[tuple[float, float, Tick]] = None
+
+    @classmethod
+    def shared(
+        cls,
+        interval: int = 30
+    ) -> "StepClock":
+        """Process-wide clock for an interval"""
+        clock = cls._shared.get(interval)
+        if clock is None:
+            clock = cls._shared.setdefault(interval, cls(interval))
+        return clock
+
+    def now(self) -> float:
+        return self._clock() if self._clock else time.time()
+
+    def tick(self) -> Tick:
+        """Current step and packed counters, refreshed at step boundaries"""
+        now = self.now()
+        state = self._state
+        if state is None or not state[0] <= now < state[1]:
+            return self._refresh(now)
+        return state[2]
+
+    def step(self) -> int:
+        return self.tick().step
+
+    def _refresh(
+        self,
+        now: float
+    ) -> Tick:
+        step = int(now // self.interval)
+        tick = Tick(
+            step,
+            self.window,
+            tuple(
+                (step + offset).to_bytes(8, "big")
+                for offset in range(-self.window, self.window + 1)
+            )
+        )
+        start = step * self.interval
+        self._state = (start, start + self.interval, tick)
+        return tick
@@ -0,0 +1,98 @@
+import base64
+import binascii
+import os
+from functools import lru_cache
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+
+# Fernet tokens are pure url-safe base64, so the ":" can never clash
+COMPACT_PREFIX = "g1:"
+NONCE_SIZE = 12
+KEY_ID_SIZE = 4
+HKDF_INFO = b"two-fast-auth compact v1"
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def is_compact(token: str) -> bool:
+    """True for ciphertexts in the compact AES-GCM format"""
+    return token.startswith(COMPACT_PREFIX)
+
+
+class CompactCipher:
+    def __init__(
+        self,
+        key: bytes
+    ):
+        """AES-256-GCM secret encryption with a short, versioned envelope
+
+        Takes the same url-safe base64 key as Fernet. The AES key and a
+        4-byte key id are derived from it with HKDF-SHA256, so one
+        configured key serves both formats. Tokens look like
+        ``g1:<key id>:<nonce + ciphertext + tag>``; the version and key id
+        are authenticated as associated data.
+        """
+        try:
+            raw = base64.urlsafe_b64decode(key)
+        except binascii.Error as e:
+            raise ValueError(
+                "Key must be 32 url-safe base64-encoded bytes."
+            ) from e
+        if len(raw) != 32:
+            raise ValueError("Key must be 32 url-safe base64-encoded bytes.")
+
+        derived = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32 + KEY_ID_SIZE,
+            salt=None,
+            info=HKDF_INFO
+        ).derive(raw)
+        self._aead = AESGCM(derived[:32])
+        self.key_id = _b64encode(derived[32:])
+        self._header = f"{COMPACT_PREFIX}{self.key_id}:"
+        self._associated_data = self._header.encode()
+
+    def encrypt(
+        self,
+        plaintext: str
+    ) -> str:
+        nonce = os.urandom(NONCE_SIZE)
+        ciphertext = self._aead.encrypt(
+            nonce,
+            plaintext.encode(),
+            self._associated_data
+        )
+        return self._header + _b64encode(nonce + ciphertext)
+
+    def decrypt(
+        self,
+        token: str
+    ) -> str:
+        if not token.startswith(self._header):
+            if is_compact(token):
+                raise ValueError("Token was encrypted with a different key")
+            raise ValueError("Not a compact token")
+        try:
+            payload = _b64decode(token[len(self._header):])
+            return self._aead.decrypt(
+                payload[:NONCE_SIZE],
+                payload[NONCE_SIZE:],
+                self._associated_data
+            ).decode()
+        except (InvalidTag, binascii.Error, UnicodeDecodeError) as e:
+            raise ValueError("Invalid compact token") from e
+
+
+@lru_cache(maxsize=1024)
+def compact_cipher(key: bytes) -> CompactCipher:
+    """Cipher for a key, derived once and reused"""
+    return CompactCipher(key)
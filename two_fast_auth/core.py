@@ -2,14 +2,43 @@ from cryptography.fernet import (
     Fernet,
     InvalidToken
 )
+from functools import lru_cache
+import hashlib
+import hmac
 from io import BytesIO
 import secrets
 import pyotp
+from pyotp.utils import strings_equal
 import qrcode
 from typing import (
+    Callable,
     Optional,
     Union
 )
+from .clock import StepClock
+from .compact import (
+    compact_cipher,
+    is_compact
+)
+from .drift import DriftTracker
+from .envelope import (
+    DEFAULT_TENANT,
+    KeyProvider,
+    envelope_decrypt,
+    envelope_encrypt,
+    is_envelope
+)
+
+
+ALGORITHMS: dict[str, Callable] = {
+    "sha1": hashlib.sha1,
+    "sha256": hashlib.sha256,
+    "sha512": hashlib.sha512
+}
+MODES = ("totp", "hotp")
+
+# A static Fernet key, or a provider of envelope data keys
+EncryptionKey = Union[str, bytes, KeyProvider]
 
 
 class TwoFactorAuth:
@@ -19,12 +48,95 @@ class TwoFactorAuth:
         *,
         qr_fill_color: str = "black",
         qr_back_color: str = "white",
-        issuer_name: str = "2FastAuth"
+        issuer_name: str = "2FastAuth",
+        drift_tracker: Optional[DriftTracker] = None,
+        digits: int = 6,
+        interval: int = 30,
+        algorithm: str = "sha1",
+        mode: str = "totp",
+        clock: Optional[StepClock] = None
     ):
+        self.validate_parameters(
+            digits=digits,
+            interval=interval,
+            algorithm=algorithm,
+            mode=mode
+        )
         self.secret = secret or pyotp.random_base32()
         self.qr_fill_color = qr_fill_color
         self.qr_back_color = qr_back_color
         self.issuer_name = issuer_name
+        self.drift_tracker = drift_tracker
+        self.digits = digits
+        self.interval = interval
+        self.algorithm = algorithm
+        self.mode = mode
+        if clock is not None and clock.interval != interval:
+            raise ValueError("Clock interval does not match the OTP interval")
+        self.clock = clock or StepClock.shared(interval)
+        self._digest = ALGORITHMS[algorithm]
+        self._keyed_hmac: Optional[hmac.HMAC] = None
+
+    @staticmethod
+    def validate_parameters(
+        *,
+        digits: int = 6,
+        interval: int = 30,
+        algorithm: str = "sha1",
+        mode: str = "totp"
+    ) -> None:
+        """Validate OTP parameters"""
+        if not 6 <= digits <= 10:
+            raise ValueError("Digits must be between 6 and 10")
+        if interval < 1:
+            raise ValueError("Interval must be a positive number of seconds")
+        if algorithm not in ALGORITHMS:
+            raise ValueError(
+                f"Unsupported algorithm: {algorithm}. "
+                f"Use one of: {', '.join(ALGORITHMS)}"
+            )
+        if mode not in MODES:
+            raise ValueError(
+                f"Unsupported mode: {mode}. Use one of: {', '.join(MODES)}"
+            )
+
+    def _otp(self) -> Union[pyotp.TOTP, pyotp.HOTP]:
+        if self.mode == "hotp":
+            return pyotp.HOTP(
+                self.secret,
+                digits=self.digits,
+                digest=self._digest
+            )
+        return pyotp.TOTP(
+            self.secret,
+            digits=self.digits,
+            digest=self._digest,
+            interval=self.interval
+        )
+
+    def _generate(
+        self,
+        counter: int
+    ) -> str:
+        return self._generate_packed(counter.to_bytes(8, "big"))
+
+    def _generate_packed(
+        self,
+        counter: bytes
+    ) -> str:
+        """Compute the code for a packed counter, reusing the keyed HMAC"""
+        if self._keyed_hmac is None:
+            self._keyed_hmac = hmac.new(
+                pyotp.OTP(self.secret).byte_secret(),
+                digestmod=self._digest
+            )
+
+        mac = self._keyed_hmac.copy()
+        mac.update(counter)
+        digest = mac.digest()
+        offset = digest[-1] & 0xF
+        code = int.from_bytes(digest[offset:offset + 4], "big") & 0x7FFFFFFF
+        return str(code % 10 ** self.digits).zfill(self.digits)
 
     def generate_qr_code(
         self,
@@ -34,9 +146,7 @@ class TwoFactorAuth:
         if not user_email:
             raise ValueError("User email is required")
 
-        uri = pyotp.totp.TOTP(
-            self.secret
-        ).provisioning_uri(
+        uri = self._otp().provisioning_uri(
             name=user_email,
             issuer_name=self.issuer_name
         )
@@ -53,16 +163,91 @@ class TwoFactorAuth:
         byte_io.seek(0)
         return byte_io
 
+    def match_code(
+        self,
+        code: str,
+        user_id: Optional[str] = None,
+        *,
+        counter: Optional[int] = None
+    ) -> Optional[int]:
+        """Return the time step (TOTP) or counter (HOTP) a code matches
+
+        With a drift tracker and a user id, the user's learned clock
+        offset is checked first, then neighbouring offsets within the
+        tracker's window.
+        """
+        if not code or len(code) != self.digits:
+            return None
+        if self.mode == "hotp":
+            return self._match_hotp(code, counter)
+        return self._match_totp(code, user_id)
+
+    def _match_hotp(
+        self,
+        code: str,
+        counter: Optional[int]
+    ) -> Optional[int]:
+        if counter is None or counter < 0:
+            raise ValueError("HOTP verification requires a counter")
+        return counter if strings_equal(
+            code,
+            self._generate(counter)
+        ) else None
+
+    def _match_totp(
+        self,
+        code: str,
+        user_id: Optional[str]
+    ) -> Optional[int]:
+        tick = self.clock.tick()
+        if self.drift_tracker is None or user_id is None:
+            return tick.step if strings_equal(
+                code,
+                self._generate_packed(tick.counter())
+            ) else None
+
+        for offset in self.drift_tracker.candidate_offsets(user_id):
+            if strings_equal(code, self._generate_packed(tick.counter(offset))):
+                self.drift_tracker.record(user_id, offset)
+                return tick.step + offset
+        return None
+
     def verify_code(
         self,
-        code: str
+        code: str,
+        user_id: Optional[str] = None,
+        *,
+        counter: Optional[int] = None
     ) -> bool:
         """Verify the 2FA code"""
-        if not code or len(code) != 6:
-            return False
+        return self.match_code(
+            code,
+            user_id,
+            counter=counter
+        ) is not None
 
-        totp = pyotp.TOTP(self.secret)
-        return totp.verify(code)
+    def resync_hotp(
+        self,
+        code: str,
+        counter: int,
+        look_ahead: int = 20
+    ) -> Optional[int]:
+        """Search counters ahead of a HOTP fob and return the next counter
+
+        Returns the counter to store after the matching one, or None if
+        the code does not match within the look-ahead window.
+        """
+        if self.mode != "hotp":
+            raise ValueError("Resynchronization is only available for HOTP")
+        if counter < 0 or look_ahead < 0:
+            raise ValueError("Counter and look_ahead cannot be negative")
+        if not code or len(code) != self.digits:
+            return None
+
+        for candidate in range(counter, counter + look_ahead + 1):
+            if strings_equal(code, self._generate(candidate)):
+                return candidate + 1
+        return None
 
     @staticmethod
     def generate_recovery_codes(
@@ -78,23 +263,35 @@ class TwoFactorAuth:
     @staticmethod
     def encrypt_secret(
         secret: str,
-        encryption_key: Optional[Union[str, bytes]] = None
+        encryption_key: Optional[EncryptionKey] = None,
+        *,
+        compact: bool = False,
+        tenant: str = DEFAULT_TENANT
     ) -> str:
-        """Encrypt 2FA secret (optional)"""
+        """Encrypt 2FA secret (optional)
+
+        ``compact=True`` uses the shorter AES-GCM format instead of
+        Fernet. With a ``KeyProvider`` the secret is encrypted under
+        ``tenant``'s data key. ``decrypt_secret`` recognises all three.
+        """
         if not secret:
             raise ValueError("Secret cannot be empty")
 
         if not encryption_key:
             return secret
 
-        key_bytes = (
-            encryption_key
-            if isinstance(encryption_key, bytes)
-            else encryption_key.encode()
-        )
-
         try:
-            cipher = Fernet(key_bytes)
+            if not isinstance(encryption_key, (str, bytes)):
+                return envelope_encrypt(encryption_key, secret, tenant)
+
+            key_bytes = (
+                encryption_key
+                if isinstance(encryption_key, bytes)
+                else encryption_key.encode()
+            )
+            if compact:
+                return compact_cipher(key_bytes).encrypt(secret)
+            cipher = _fernet(key_bytes)
             return cipher.encrypt(
                 secret.encode()
             ).decode()
@@ -105,26 +302,50 @@ class TwoFactorAuth:
     @staticmethod
     def decrypt_secret(
         encrypted_secret: str,
-        encryption_key: Optional[Union[str, bytes]] = None
+        encryption_key: Optional[EncryptionKey] = None,
+        *,
+        tenant: str = DEFAULT_TENANT
     ) -> str:
-        """Decrypt 2FA secret (optional)"""
+        """Decrypt 2FA secret (optional), in any supported format
+
+        With a ``KeyProvider`` the data key must belong to ``tenant``.
+        """
         if not encrypted_secret:
             raise ValueError("No secret to decrypt")
 
         if not encryption_key:
             return encrypted_secret
 
-        key_bytes = (
-            encryption_key
-            if isinstance(encryption_key, bytes)
-            else encryption_key.encode()
-        )
-
         try:
-            cipher = Fernet(key_bytes)
+            if not isinstance(encryption_key, (str, bytes)):
+                if is_envelope(encrypted_secret):
+                    return envelope_decrypt(
+                        encryption_key,
+                        encrypted_secret,
+                        tenant
+                    )
+                if encryption_key.legacy_key is None:
+                    raise ValueError("Not an envelope-encrypted secret")
+                encryption_key = encryption_key.legacy_key
+
+            key_bytes = (
+                encryption_key
+                if isinstance(encryption_key, bytes)
+                else encryption_key.encode()
+            )
+            if is_compact(encrypted_secret):
+                return compact_cipher(key_bytes).decrypt(encrypted_secret)
+            cipher = _fernet(key_bytes)
             return cipher.decrypt(
                 encrypted_secret.encode()
             ).decode()
 
         except (InvalidToken, ValueError) as e:
             raise ValueError(f"Decryption failed: {str(e)}") from e
+
+
+# One entry per key in use, e.g. one per tenant
+@lru_cache(maxsize=1024)
+def _fernet(key: bytes) -> Fernet:
+    """Fernet instance for a key, validated once and reused"""
+    return Fernet(key)
@@ -0,0 +1,66 @@
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Optional
+)
+from .callbacks import SecretCallback
+from .verifier import (
+    STATE_KEY,
+    TwoFactorResult,
+    TwoFactorVerifier
+)
+from fastapi import (
+    HTTPException,
+    Request,
+    status
+)
+
+
+def require_2fa(
+    get_user_secret_callback: Optional[SecretCallback] = None,
+    *,
+    verifier: Optional[TwoFactorVerifier] = None,
+    **verifier_options: Any
+) -> Callable[[Request], Awaitable[None]]:
+    """Build a ``Depends``-compatible 2FA check for selected routes
+
+    Settings are validated and the verifier is built here, once, when the
+    route or router is declared; each request only runs the check.
+    """
+    if verifier is None:
+        if get_user_secret_callback is None:
+            raise ValueError(
+                "Either get_user_secret_callback or verifier is required"
+            )
+        verifier = TwoFactorVerifier(
+            get_user_secret_callback,
+            **verifier_options
+        )
+    elif verifier_options:
+        raise ValueError("Verifier options cannot be combined with verifier")
+
+    async def two_factor_dependency(request: Request) -> None:
+        await verifier.verify_request(request)
+
+    return two_factor_dependency
+
+
+def get_2fa_result(request: Request) -> Optional[TwoFactorResult]:
+    """Return the 2FA outcome recorded earlier in the request, if any"""
+    return getattr(request.state, STATE_KEY, None)
+
+
+def verified_2fa(request: Request) -> TwoFactorResult:
+    """Dependency requiring a 2FA verification recorded upstream
+
+    Reads the result left by ``TwoFactorMiddleware`` or ``require_2fa``
+    without another secret lookup, decryption or HMAC.
+    """
+    result = get_2fa_result(request)
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="2FA verification required"
+        )
+    return result
@@ -0,0 +1,122 @@
+from typing import (
+    Mapping,
+    Optional,
+    Sequence,
+    Union
+)
+from .clock import (
+    StepClock,
+    Tick
+)
+from .core import TwoFactorAuth
+
+
+SecretSet = Union[str, Sequence[str], Mapping[str, str]]
+
+
+def normalize_secrets(
+    secrets: SecretSet
+) -> dict[str, str]:
+    """Map device ids to secrets
+
+    A single secret becomes device ``"0"``, a sequence is numbered by
+    position and a mapping is used as given.
+    """
+    if isinstance(secrets, str):
+        return {"0": secrets}
+    if isinstance(secrets, Mapping):
+        return {
+            str(device_id): secret
+            for device_id, secret in secrets.items()
+            if secret
+        }
+    return {
+        str(position): secret
+        for position, secret in enumerate(secrets)
+        if secret
+    }
+
+
+class DeviceCodeIndex:
+    def __init__(
+        self,
+        secrets: Mapping[str, str],
+        *,
+        window: int = 0,
+        digits: int = 6,
+        interval: int = 30,
+        algorithm: str = "sha1",
+        clock: Optional[StepClock] = None
+    ):
+        if not secrets:
+            raise ValueError("At least one device secret is required")
+        if window < 0:
+            raise ValueError("window cannot be negative")
+
+        self.window = window
+        self.clock = clock or StepClock.shared(interval)
+        self._devices = {
+            device_id: TwoFactorAuth(
+                secret,
+                digits=digits,
+                interval=interval,
+                algorithm=algorithm,
+                clock=self.clock
+            )
+            for device_id, secret in secrets.items()
+        }
+        # Step and codes are published together, so a thread never pairs
+        # one step with another step's codes
+        self._current: tuple[Optional[int], dict[str, tuple[str, int]]] = (
+            None,
+            {}
+        )
+
+    def _build(
+        self,
+        tick: Tick
+    ) -> dict[str, tuple[str, int]]:
+        """Compute every device's codes for the window around a step"""
+        index: dict[str, tuple[str, int]] = {}
+        offsets = sorted(
+            range(-self.window, self.window + 1),
+            key=abs
+        )
+        for offset in offsets:
+            counter = tick.counter(offset)
+            for device_id, auth in self._devices.items():
+                index.setdefault(
+                    auth._generate_packed(counter),
+                    (device_id, tick.step + offset)
+                )
+        self._current = (tick.step, index)
+        return index
+
+    def match(
+        self,
+        code: str
+    ) -> Optional[tuple[str, int]]:
+        """Return the matching device id and time step, if any"""
+        if not code:
+            return None
+
+        tick = self.clock.tick()
+        step, index = self._current
+        if tick.step != step:
+            index = self._build(tick)
+        return index.get(code)
+
+    @property
+    def auths(self) -> Mapping[str, TwoFactorAuth]:
+        """Per-device ``TwoFactorAuth``, with their keyed HMACs"""
+        return self._devices
+
+    def secret(
+        self,
+        device_id: str
+    ) -> str:
+        """Decrypted secret of a device"""
+        return self._devices[device_id].secret
+
+    def __len__(self) -> int:
+        return len(self._devices)
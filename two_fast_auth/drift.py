@@ -0,0 +1,69 @@
+from .lru import LRUCache
+
+
+class DriftTracker:
+    def __init__(
+        self,
+        *,
+        max_window: int = 2,
+        max_entries: int = 10000
+    ):
+        if max_window < 0:
+            raise ValueError("max_window cannot be negative")
+
+        self.max_window = max_window
+        self.max_entries = max_entries
+        self._offsets: LRUCache[str, int] = LRUCache(max_entries)
+        self._search_orders = {
+            learned: self._build_search_order(learned)
+            for learned in range(-max_window, max_window + 1)
+        }
+
+    def _build_search_order(
+        self,
+        learned: int
+    ) -> tuple[int, ...]:
+        """Offsets to try, nearest to the learned offset first"""
+        return tuple(sorted(
+            range(-self.max_window, self.max_window + 1),
+            key=lambda offset: (abs(offset - learned), -offset)
+        ))
+
+    def get_offset(
+        self,
+        key: str
+    ) -> int:
+        """Return the learned step offset for a key (0 if unknown)"""
+        return self._offsets.get(key) or 0
+
+    def candidate_offsets(
+        self,
+        key: str
+    ) -> tuple[int, ...]:
+        """Offsets to check for a key, learned offset first"""
+        return self._search_orders[self.get_offset(key)]
+
+    def record(
+        self,
+        key: str,
+        offset: int
+    ) -> None:
+        """Remember the offset of a successful match"""
+        if abs(offset) > self.max_window:
+            raise ValueError("Offset is outside the drift window")
+
+        if not offset:
+            self._offsets.pop(key, None)
+            return
+
+        self._offsets.set(key, offset)
+
+    def forget(
+        self,
+        key: str
+    ) -> None:
+        """Drop the learned offset for a key"""
+        self._offsets.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import math
+import threading
+from typing import (
+    AsyncIterable,
+    Callable,
+    Iterable,
+    List,
+    Optional,
+    Union
+)
+from .striped import StripedCounter
+
+
+# Returns the ids of every user with 2FA enabled
+EnrollmentSource = Callable[[], Union[AsyncIterable[str], Iterable[str]]]
+
+MAX_COUNT = 255
+# Ids hashed between yields to the event loop while loading
+LOAD_BATCH = 10000
+
+
+class EnrollmentFilter:
+    def __init__(
+        self,
+        capacity: int,
+        *,
+        false_positive_rate: float = 0.01
+    ):
+        """Counting Bloom filter of the user ids with 2FA enabled
+
+        Sized for ``capacity`` enrolled users at ``false_positive_rate``.
+        A user the filter has never seen is definitely not enrolled, so
+        the verifier can let them through without a secret lookup; a
+        false positive only costs the lookup that would have happened
+        anyway. Counters (one byte each) make ``remove`` possible.
+
+        Until the first ``load`` completes every user counts as possibly
+        enrolled, so a cold filter never skips a check.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if not 0 < false_positive_rate < 1:
+            raise ValueError("false_positive_rate must be between 0 and 1")
+
+        self.capacity = capacity
+        self.target_false_positive_rate = false_positive_rate
+        self.size = math.ceil(
+            -capacity * math.log(false_positive_rate) / math.log(2) ** 2
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._counts = bytearray(self.size)
+        self._items = 0
+        self._lock = threading.Lock()
+        # Ids added while a load is running, replayed into its result
+        self._added_during_load: Optional[List[str]] = None
+        self.ready = False
+        self._skipped = StripedCounter()
+        self._false_positives = StripedCounter()
+        self.load_errors = 0
+
+    def _positions(
+        self,
+        user_id: str
+    ) -> List[int]:
+        digest = hashlib.blake2b(user_id.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [
+            (first + i * second) % self.size
+            for i in range(self.hashes)
+        ]
+
+    def add(
+        self,
+        user_id: str
+    ) -> None:
+        """Record an enrollment"""
+        with self._lock:
+            self._increment(self._counts, user_id)
+            self._items += 1
+            if self._added_during_load is not None:
+                self._added_during_load.append(user_id)
+
+    def remove(
+        self,
+        user_id: str
+    ) -> None:
+        """Record that an enrolled user disabled 2FA
+
+        Only remove ids that were added: removing anything else can make
+        the filter forget an enrolled user.
+        """
+        positions = self._positions(user_id)
+        with self._lock:
+            if not all(self._counts[p] for p in positions):
+                return
+            for position in positions:
+                # Saturated counters have lost count and stay put
+                if self._counts[position] < MAX_COUNT:
+                    self._counts[position] -= 1
+            self._items -= 1
+
+    def might_be_enrolled(
+        self,
+        user_id: str
+    ) -> bool:
+        """False only for users that are definitely not enrolled"""
+        if not self.ready:
+            return True
+        counts = self._counts
+        if all(counts[p] for p in self._positions(user_id)):
+            return True
+        self._skipped.add()
+        return False
+
+    def record_false_positive(self) -> None:
+        """The filter passed a user whose lookup found no secret"""
+        if self.ready:
+            self._false_positives.add()
+
+    async def load(
+        self,
+        user_ids: Union[AsyncIterable[str], Iterable[str]]
+    ) -> int:
+        """Replace the contents with ``user_ids`` and mark the filter ready
+
+        Enrollments recorded with ``add`` while the load runs are kept.
+        Returns the number of ids loaded.
+        """
+        counts = bytearray(self.size)
+        loaded = 0
+        with self._lock:
+            self._added_during_load = []
+        try:
+            if isinstance(user_ids, AsyncIterable):
+                async for user_id in user_ids:
+                    self._increment(counts, user_id)
+                    loaded += 1
+            else:
+                for user_id in user_ids:
+                    self._increment(counts, user_id)
+                    loaded += 1
+                    if not loaded % LOAD_BATCH:
+                        await asyncio.sleep(0)
+            with self._lock:
+                for user_id in self._added_during_load:
+                    self._increment(counts, user_id)
+                self._counts = counts
+                self._items = loaded + len(self._added_during_load)
+                self.ready = True
+        except Exception:
+            self.load_errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._added_during_load = None
+        return loaded
+
+    @property
+    def skipped(self) -> int:
+        """Lookups avoided for users that are not enrolled"""
+        return self._skipped.value
+
+    @property
+    def false_positives(self) -> int:
+        return self._false_positives.value
+
+    def estimated_false_positive_rate(self) -> float:
+        """Expected false positive rate at the current number of ids"""
+        return (
+            1 - math.exp(-self.hashes * self._items / self.size)
+        ) ** self.hashes
+
+    def stats(self) -> dict[str, float]:
+        skipped = self.skipped
+        false_positives = self.false_positives
+        observed = skipped + false_positives
+        return {
+            "items": self._items,
+            "capacity": self.capacity,
+            "size_bytes": self.size,
+            "hashes": self.hashes,
+            "skipped": skipped,
+            "false_positives": false_positives,
+            "load_errors": self.load_errors,
+            "estimated_false_positive_rate": (
+                self.estimated_false_positive_rate()
+            ),
+            # Of the lookups for users without 2FA, the share not skipped
+            "observed_false_positive_rate": (
+                false_positives / observed if observed else 0.0
+            )
+        }
+
+    def _increment(
+        self,
+        counts: bytearray,
+        user_id: str
+    ) -> None:
+        for position in self._positions(user_id):
+            if counts[position] < MAX_COUNT:
+                counts[position] += 1
+
+    def __contains__(self, user_id: object) -> bool:
+        return isinstance(user_id, str) and all(
+            self._counts[p] for p in self._positions(user_id)
+        )
+
+    def __len__(self) -> int:
+        return self._items
@@ -0,0 +1,369 @@
+import binascii
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import (
+    Callable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Protocol,
+    runtime_checkable
+)
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from .compact import (
+    _b64decode,
+    _b64encode
+)
+from .lru import LRUCache
+from .striped import StripedCounter
+
+
+ENVELOPE_PREFIX = "e1:"
+NONCE_SIZE = 12
+DEFAULT_TENANT = "default"
+
+
+def is_envelope(token: str) -> bool:
+    """True for ciphertexts encrypted under a provider's data key"""
+    return token.startswith(ENVELOPE_PREFIX)
+
+
+class DataKey(NamedTuple):
+    key_id: str
+    key: bytes
+
+
+@runtime_checkable
+class KeyProvider(Protocol):
+    """Source of data keys, accepted wherever an ``encryption_key`` is"""
+
+    # Static Fernet key for ciphertexts written before envelope encryption
+    legacy_key: Optional[bytes]
+
+    def encryption_key(
+        self,
+        tenant: str = DEFAULT_TENANT
+    ) -> DataKey:
+        """The tenant's current data key, for encrypting"""
+        ...
+
+    def decryption_key(
+        self,
+        key_id: str,
+        tenant: str = DEFAULT_TENANT
+    ) -> bytes:
+        """The data key a ciphertext names, for decrypting
+
+        Raises ``ValueError`` when the key belongs to another tenant.
+        """
+        ...
+
+
+class KeyManagementService(Protocol):
+    """Holds the master key; data keys only leave it wrapped"""
+
+    def current_key_id(
+        self,
+        tenant: str
+    ) -> Optional[str]:
+        ...
+
+    def create_data_key(
+        self,
+        tenant: str
+    ) -> str:
+        """Generate and store a wrapped data key; return its id"""
+        ...
+
+    def unwrap(
+        self,
+        key_id: str,
+        tenant: str
+    ) -> bytes:
+        """Plaintext of a stored data key, if it belongs to ``tenant``"""
+        ...
+
+
+def envelope_encrypt(
+    provider: KeyProvider,
+    secret: str,
+    tenant: str = DEFAULT_TENANT
+) -> str:
+    """Encrypt under the tenant's data key as ``e1:<key id>:<payload>``"""
+    data_key = provider.encryption_key(tenant)
+    header = f"{ENVELOPE_PREFIX}{data_key.key_id}:"
+    nonce = os.urandom(NONCE_SIZE)
+    ciphertext = AESGCM(data_key.key).encrypt(
+        nonce,
+        secret.encode(),
+        header.encode()
+    )
+    return header + _b64encode(nonce + ciphertext)
+
+
+def envelope_decrypt(
+    provider: KeyProvider,
+    token: str,
+    tenant: str = DEFAULT_TENANT
+) -> str:
+    key_id, separator, payload = token[len(ENVELOPE_PREFIX):].partition(":")
+    if not key_id or not separator:
+        raise ValueError("Invalid envelope token")
+    header = f"{ENVELOPE_PREFIX}{key_id}:"
+    key = provider.decryption_key(key_id, tenant)
+    try:
+        data = _b64decode(payload)
+        return AESGCM(key).decrypt(
+            data[:NONCE_SIZE],
+            data[NONCE_SIZE:],
+            header.encode()
+        ).decode()
+    except (InvalidTag, binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError("Invalid envelope token") from e
+
+
+class _Flight:
+    __slots__ = ("lock", "waiters")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.waiters = 0
+
+
+class CachingKeyProvider:
+    def __init__(
+        self,
+        kms: KeyManagementService,
+        *,
+        ttl: float = 300.0,
+        max_entries: int = 1024,
+        legacy_key: Optional[bytes] = None,
+        clock: Optional[Callable[[], float]] = None
+    ):
+        """Key provider keeping unwrapped data keys for ``ttl`` seconds
+
+        Concurrent misses for the same key id share one ``unwrap`` call
+        across threads; a miss blocks on the KMS, so call it from a
+        worker thread rather than the event loop (``TwoFactorVerifier``
+        does). Each key is cached with the tenant it belongs to and only
+        returned for that tenant. ``legacy_key`` keeps ciphertexts
+        written with a static Fernet key readable.
+        """
+        if ttl <= 0:
+            raise ValueError("ttl must be positive")
+
+        self.kms = kms
+        self.ttl = ttl
+        self.legacy_key = legacy_key
+        self._clock = clock or time.monotonic
+        # key id -> (tenant, key, expiry)
+        self._keys: LRUCache[str, tuple[str, bytes, float]] = LRUCache(
+            max_entries
+        )
+        self._current: LRUCache[str, tuple[str, float]] = LRUCache(
+            max_entries
+        )
+        self._lock = threading.Lock()
+        # Locks of the unwraps in progress, dropped when the last waiter
+        # is done
+        self._flights: dict[str, _Flight] = {}
+        self._hits = StripedCounter()
+        self._unwraps = StripedCounter()
+
+    def encryption_key(
+        self,
+        tenant: str = DEFAULT_TENANT
+    ) -> DataKey:
+        now = self._clock()
+        cached = self._current.get(tenant)
+        if cached is not None and now < cached[1]:
+            key_id = cached[0]
+        else:
+            with self._flight(f"tenant:{tenant}"):
+                key_id = (
+                    self.kms.current_key_id(tenant)
+                    or self.kms.create_data_key(tenant)
+                )
+            self._current.set(tenant, (key_id, now + self.ttl))
+        return DataKey(key_id, self.decryption_key(key_id, tenant))
+
+    def decryption_key(
+        self,
+        key_id: str,
+        tenant: str = DEFAULT_TENANT
+    ) -> bytes:
+        cached = self._cached(key_id, tenant)
+        if cached is not None:
+            self._hits.add()
+            return cached
+
+        with self._flight(key_id):
+            # Another thread may have unwrapped it while this one waited
+            cached = self._cached(key_id, tenant)
+            if cached is not None:
+                self._hits.add()
+                return cached
+            key = self.kms.unwrap(key_id, tenant)
+            self._unwraps.add()
+            self._keys.set(key_id, (tenant, key, self._clock() + self.ttl))
+            return key
+
+    def invalidate(
+        self,
+        key_id: Optional[str] = None
+    ) -> None:
+        """Drop one cached data key, or all of them (e.g. after rotation)"""
+        if key_id is None:
+            self._keys.clear()
+            self._current.clear()
+        else:
+            self._keys.pop(key_id)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "cached_keys": len(self._keys),
+            "hits": self._hits.value,
+            "unwraps": self._unwraps.value
+        }
+
+    def _cached(
+        self,
+        key_id: str,
+        tenant: str
+    ) -> Optional[bytes]:
+        entry = self._keys.get(key_id)
+        if entry is None or self._clock() >= entry[2]:
+            return None
+        if entry[0] != tenant:
+            raise ValueError(
+                f"Data key {key_id} does not belong to tenant {tenant}"
+            )
+        return entry[1]
+
+    @contextmanager
+    def _flight(
+        self,
+        name: str
+    ) -> Iterator[None]:
+        """Hold the lock shared by every thread loading ``name``"""
+        with self._lock:
+            flight = self._flights.get(name)
+            if flight is None:
+                flight = self._flights[name] = _Flight()
+            flight.waiters += 1
+        try:
+            with flight.lock:
+                yield
+        finally:
+            with self._lock:
+                flight.waiters -= 1
+                if not flight.waiters:
+                    del self._flights[name]
+
+
+class LocalKMS:
+    def __init__(
+        self,
+        path: str
+    ):
+        """File-based stand-in for a KMS, for development and tests
+
+        The master key and the wrapped data keys live in one JSON file
+        (created with mode 0600). Data keys are wrapped with AES-GCM
+        under the master key, bound to their id. Not for production:
+        anyone who can read the file can unwrap every key.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.unwrap_calls = 0
+        if os.path.exists(path):
+            self._state = self._read()
+        else:
+            self._state = {
+                "master_key": _b64encode(AESGCM.generate_key(256)),
+                "keys": {},
+                "current": {}
+            }
+            self._write()
+
+    def current_key_id(
+        self,
+        tenant: str
+    ) -> Optional[str]:
+        with self._lock:
+            key_id: Optional[str] = self._state["current"].get(tenant)
+            return key_id
+
+    def create_data_key(
+        self,
+        tenant: str
+    ) -> str:
+        """New current data key for the tenant (also used to rotate)"""
+        key_id = secrets.token_urlsafe(6)
+        nonce = os.urandom(NONCE_SIZE)
+        wrapped = self._master().encrypt(
+            nonce,
+            AESGCM.generate_key(256),
+            key_id.encode()
+        )
+        with self._lock:
+            self._state["keys"][key_id] = {
+                "tenant": tenant,
+                "wrapped": _b64encode(nonce + wrapped)
+            }
+            self._state["current"][tenant] = key_id
+            self._write()
+        return key_id
+
+    def unwrap(
+        self,
+        key_id: str,
+        tenant: str
+    ) -> bytes:
+        with self._lock:
+            self.unwrap_calls += 1
+            record = self._state["keys"].get(key_id)
+            if record is None:
+                # Possibly created by another process since loading
+                self._state = self._read()
+                record = self._state["keys"].get(key_id)
+        if record is None:
+            raise ValueError(f"Unknown data key: {key_id}")
+        if record["tenant"] != tenant:
+            raise ValueError(
+                f"Data key {key_id} does not belong to tenant {tenant}"
+            )
+        wrapped = _b64decode(record["wrapped"])
+        try:
+            return self._master().decrypt(
+                wrapped[:NONCE_SIZE],
+                wrapped[NONCE_SIZE:],
+                key_id.encode()
+            )
+        except InvalidTag as e:
+            raise ValueError(f"Cannot unwrap data key: {key_id}") from e
+
+    def _master(self) -> AESGCM:
+        return AESGCM(_b64decode(self._state["master_key"]))
+
+    def _read(self) -> dict:
+        with open(self.path) as file:
+            state: dict = json.load(file)
+        return state
+
+    def _write(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(self._state, file)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
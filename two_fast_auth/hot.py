@@ -0,0 +1,372 @@
+import asyncio
+import threading
+import time
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Generic,
+    Hashable,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    TypeVar
+)
+from .clock import StepClock
+from .striped import (
+    StripedCounter,
+    StripedLock
+)
+from .tasks import (
+    cancel_task,
+    stop_task,
+    task_alive
+)
+
+if TYPE_CHECKING:
+    from .core import TwoFactorAuth
+
+
+K = TypeVar("K", bound=Hashable)
+
+# What a precomputed code resolves to: device id (None for a single
+# secret), time step and decrypted secret
+CodeMatch = tuple[Optional[str], int, str]
+
+
+class SpaceSaving(Generic[K]):
+    def __init__(
+        self,
+        capacity: int
+    ):
+        """Space-Saving heavy-hitters sketch over at most ``capacity`` keys
+
+        Counts are exact for keys that stay tracked and overestimate by
+        at most the smallest tracked count otherwise; any key seen more
+        than ``total / capacity`` times is guaranteed to be tracked.
+        Updates are O(1) through buckets of keys sharing a count.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+
+        self.capacity = capacity
+        self._counts: dict[K, int] = {}
+        # count -> keys with that count, oldest first
+        self._buckets: dict[int, dict[K, None]] = {}
+        self._min = 0
+
+    def offer(
+        self,
+        key: K
+    ) -> int:
+        """Count one occurrence of ``key`` and return its estimate"""
+        count = self._counts.get(key)
+        if count is None:
+            if len(self._counts) < self.capacity:
+                self._counts[key] = 1
+                self._buckets.setdefault(1, {})[key] = None
+                self._min = 1
+                return 1
+            # Replace a key with the smallest count, inheriting it
+            count = self._min
+            evicted = next(iter(self._buckets[count]))
+            del self._counts[evicted]
+            self._unlink(evicted, count)
+        else:
+            self._unlink(key, count)
+
+        self._counts[key] = count + 1
+        self._buckets.setdefault(count + 1, {})[key] = None
+        return count + 1
+
+    def _unlink(
+        self,
+        key: K,
+        count: int
+    ) -> None:
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if count == self._min:
+                # The key moves to count + 1, so that is the new minimum
+                self._min = count + 1
+
+    def top(
+        self,
+        n: int
+    ) -> list[tuple[K, int]]:
+        """The ``n`` keys with the highest counts, highest first"""
+        top: list[tuple[K, int]] = []
+        for count in sorted(self._buckets, reverse=True):
+            for key in self._buckets[count]:
+                top.append((key, count))
+                if len(top) == n:
+                    return top
+        return top
+
+    def decay(
+        self,
+        factor: float
+    ) -> None:
+        """Scale every count down so that old activity fades"""
+        counts = {
+            key: int(count * factor)
+            for key, count in self._counts.items()
+            if int(count * factor) > 0
+        }
+        self._counts = counts
+        self._buckets = {}
+        for key, count in counts.items():
+            self._buckets.setdefault(count, {})[key] = None
+        self._min = min(self._buckets, default=0)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._counts
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+
+class HotKeys(NamedTuple):
+    # Encrypted secret(s) the keys were derived from
+    fingerprint: Hashable
+    auths: Mapping[Optional[str], "TwoFactorAuth"]
+    offsets: Sequence[int]
+
+
+def _step_codes(
+    keys: HotKeys,
+    step: int
+) -> dict[str, tuple[Optional[str], int]]:
+    """Code to (device id, step) for every offset from ``step``
+
+    Nearer offsets are computed first and win a collision.
+    """
+    codes: dict[str, tuple[Optional[str], int]] = {}
+    for offset in sorted(keys.offsets, key=abs):
+        counter = (step + offset).to_bytes(8, "big")
+        for device_id, auth in keys.auths.items():
+            codes.setdefault(
+                auth._generate_packed(counter),
+                (device_id, step + offset)
+            )
+    return codes
+
+
+class HotCodes:
+    def __init__(
+        self,
+        *,
+        top_k: int = 1000,
+        sketch_size: Optional[int] = None,
+        lead_time: float = 1.0,
+        decay: float = 0.5,
+        interval: int = 30,
+        clock: Optional[StepClock] = None
+    ):
+        """Codes of the most active users, computed before they are due
+
+        A ``SpaceSaving`` sketch of ``sketch_size`` counters (default
+        ``4 * top_k``) tracks who verifies most. The keyed HMACs of at
+        most ``top_k`` of those users are kept, and a background task
+        computes their codes for the next step ``lead_time`` seconds
+        before each step boundary, so their verification is a dict
+        lookup. Counts are multiplied by ``decay`` every step so the hot
+        set follows current traffic. A user's keys are dropped as soon as
+        a verification presents a different encrypted secret.
+        """
+        if top_k < 1:
+            raise ValueError("top_k must be at least 1")
+        if not 0 < decay <= 1:
+            raise ValueError("decay must be in (0, 1]")
+        clock = clock or StepClock.shared(interval)
+        if not 0 <= lead_time < clock.interval:
+            raise ValueError("lead_time must be shorter than the interval")
+
+        self.top_k = top_k
+        self.lead_time = lead_time
+        self.decay = decay
+        self.clock = clock
+        self._sketch: SpaceSaving[str] = SpaceSaving(
+            sketch_size if sketch_size is not None else 4 * top_k
+        )
+        # Smallest count that currently makes a user hot
+        self._threshold = 0
+        # Guards the sketch, the threshold and the background task
+        self._lock = threading.Lock()
+        # Guards a user's entries in _keys and _codes
+        self._user_locks = StripedLock()
+        self._keys: dict[str, HotKeys] = {}
+        self._codes: dict[
+            str,
+            tuple[Hashable, dict[int, dict[str, tuple[Optional[str], int]]]]
+        ] = {}
+        self._task: Optional[asyncio.Task[None]] = None
+        self._hits = StripedCounter()
+        self._misses = StripedCounter()
+        self.runs = 0
+        self.last_run_seconds = 0.0
+
+    def match(
+        self,
+        user_id: str,
+        fingerprint: Hashable,
+        code: str,
+        step: int
+    ) -> Optional[CodeMatch]:
+        """Resolve a code from the precomputed table, if it is there
+
+        ``step`` is the current time step; ``fingerprint`` identifies the
+        encrypted secret(s) so a changed secret never matches old codes
+        and the keys derived from the old one are dropped.
+        """
+        with self._user_locks.lock_for(user_id):
+            stored = self._keys.get(user_id)
+            if stored is None:
+                return None
+            if stored.fingerprint != fingerprint:
+                self._forget(user_id)
+                return None
+            entry = self._codes.get(user_id)
+            if entry is None:
+                return None
+            codes = entry[1].get(step)
+            match = codes.get(code) if codes is not None else None
+            if match is None:
+                self._misses.add()
+                return None
+            device_id, matched_step = match
+            secret = stored.auths[device_id].secret
+
+        self._hits.add()
+        # A hit is a successful verification, so it counts like observe
+        with self._lock:
+            self._sketch.offer(user_id)
+        return device_id, matched_step, secret
+
+    def observe(
+        self,
+        user_id: str,
+        fingerprint: Hashable,
+        keys: Callable[[], HotKeys]
+    ) -> None:
+        """Count a successful verification; keep the user's keys if hot
+
+        ``keys`` is only called when the keys need to be stored.
+        """
+        with self._lock:
+            self._ensure_task()
+            count = self._sketch.offer(user_id)
+            threshold = self._threshold
+        with self._user_locks.lock_for(user_id):
+            stored = self._keys.get(user_id)
+            if stored is not None:
+                if stored.fingerprint != fingerprint:
+                    self._forget(user_id)
+                    self._keys[user_id] = keys()
+            elif count >= threshold and len(self._keys) < self.top_k:
+                self._keys[user_id] = keys()
+
+    def forget(
+        self,
+        user_id: str
+    ) -> None:
+        """Drop a user's keys and codes, e.g. after a secret change"""
+        with self._user_locks.lock_for(user_id):
+            self._forget(user_id)
+
+    def _forget(
+        self,
+        user_id: str
+    ) -> None:
+        self._keys.pop(user_id, None)
+        self._codes.pop(user_id, None)
+
+    def precompute(
+        self,
+        step: int
+    ) -> None:
+        """Compute every hot user's codes for ``step``"""
+        started = time.perf_counter()
+        with self._lock:
+            hot = {user_id for user_id, _ in self._sketch.top(self.top_k)}
+        # A copy, as other threads add and drop users meanwhile
+        for user_id, keys in list(self._keys.items()):
+            if user_id in hot:
+                self._store(user_id, keys, step, _step_codes(keys, step))
+            else:
+                self.forget(user_id)
+
+        with self._lock:
+            self._sketch.decay(self.decay)
+            top = self._sketch.top(self.top_k)
+            self._threshold = top[-1][1] if len(top) == self.top_k else 0
+            self.runs += 1
+            self.last_run_seconds = time.perf_counter() - started
+
+    def _store(
+        self,
+        user_id: str,
+        keys: HotKeys,
+        step: int,
+        codes: dict[str, tuple[Optional[str], int]]
+    ) -> None:
+        """Publish a user's codes for ``step``, unless their keys changed"""
+        steps = {step: codes}
+        with self._user_locks.lock_for(user_id):
+            if self._keys.get(user_id) is not keys:
+                # Dropped or replaced while its codes were computed
+                return
+            previous = self._codes.get(user_id)
+            if previous is not None and previous[0] == keys.fingerprint:
+                # Keep the current step's codes until the boundary passes
+                if step - 1 in previous[1]:
+                    steps[step - 1] = previous[1][step - 1]
+            self._codes[user_id] = (keys.fingerprint, steps)
+
+    @property
+    def hits(self) -> int:
+        return self._hits.value
+
+    @property
+    def misses(self) -> int:
+        return self._misses.value
+
+    async def close(self) -> None:
+        """Stop the background task"""
+        with self._lock:
+            task, self._task = self._task, None
+        await stop_task(task)
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "tracked": len(self._sketch),
+            "hot_users": len(self._keys),
+            "precomputed_users": len(self._codes),
+            "hits": self.hits,
+            "misses": self.misses,
+            "runs": self.runs,
+            "last_run_seconds": self.last_run_seconds
+        }
+
+    def _ensure_task(self) -> None:
+        # One task serves every loop; replace it only once its own loop
+        # has stopped, so verifications from several loops share it
+        if not task_alive(self._task):
+            cancel_task(self._task)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        interval = self.clock.interval
+        while True:
+            step = self.clock.step() + 1
+            delay = step * interval - self.lead_time - self.clock.now()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.precompute(step)
+            # Wait for the boundary before planning the next run
+            while self.clock.step() < step:
+                await asyncio.sleep(
+                    max(step * interval - self.clock.now(), 0.01)
+                )
@@ -0,0 +1,91 @@
+import asyncio
+from typing import (
+    Awaitable,
+    Callable,
+    TypeVar
+)
+
+
+T = TypeVar("T")
+
+
+class LookupRejected(Exception):
+    """Raised when a lookup is shed or times out"""
+
+
+class LookupLimiter:
+    def __init__(
+        self,
+        max_concurrency: int = 32,
+        *,
+        max_queue: int = 128,
+        timeout: float = 2.0
+    ):
+        """Bound concurrent secret lookups
+
+        At most ``max_concurrency`` lookups run at once and at most
+        ``max_queue`` wait for a slot; further lookups are shed
+        immediately. ``timeout`` caps the wait plus the lookup itself.
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        if max_queue < 0:
+            raise ValueError("max_queue cannot be negative")
+        if timeout <= 0:
+            raise ValueError("timeout must be positive")
+
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+        self.timeouts = 0
+
+    async def run(
+        self,
+        lookup: Callable[[], Awaitable[T]]
+    ) -> T:
+        """Run a lookup within the limits, raising ``LookupRejected``"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        if not self._semaphore.locked():
+            # A free slot is taken without suspending
+            await self._semaphore.acquire()
+        elif self.waiting >= self.max_queue:
+            self.shed += 1
+            raise LookupRejected("Lookup queue is full")
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError as e:
+                self.timeouts += 1
+                raise LookupRejected(
+                    "Timed out waiting for a lookup slot"
+                ) from e
+            finally:
+                self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            return await asyncio.wait_for(
+                lookup(),
+                max(deadline - loop.time(), 0)
+            )
+        except asyncio.TimeoutError as e:
+            self.timeouts += 1
+            raise LookupRejected("Lookup timed out") from e
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "shed": self.shed,
+            "timeouts": self.timeouts
+        }
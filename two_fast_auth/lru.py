@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict
+from typing import (
+    Generic,
+    Optional,
+    TypeVar
+)
+from .striped import DEFAULT_STRIPES
+
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+# Smaller caches keep a single shard and so an exact LRU order
+MIN_SHARD_SIZE = 64
+
+
+class _Shard(Generic[K, V]):
+    __slots__ = ("data", "lock", "max_entries")
+
+    def __init__(
+        self,
+        max_entries: int
+    ):
+        self.data: OrderedDict[K, V] = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_entries = max_entries
+
+
+class LRUCache(Generic[K, V]):
+    def __init__(
+        self,
+        max_entries: int,
+        *,
+        stripes: int = DEFAULT_STRIPES
+    ):
+        """Fixed-capacity LRU cache, safe to share between threads
+
+        Keys are spread by hash over up to ``stripes`` shards, each with
+        its own lock and an equal share of ``max_entries``, so threads
+        touching different keys rarely contend. Eviction is least
+        recently used within a shard.
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        if stripes < 1:
+            raise ValueError("stripes must be at least 1")
+
+        self.max_entries = max_entries
+        count = max(1, min(stripes, max_entries // MIN_SHARD_SIZE))
+        self._shards: tuple[_Shard[K, V], ...] = tuple(
+            _Shard(max_entries // count + (i < max_entries % count))
+            for i in range(count)
+        )
+
+    def _shard(
+        self,
+        key: object
+    ) -> _Shard[K, V]:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def get(
+        self,
+        key: K,
+        default: Optional[V] = None
+    ) -> Optional[V]:
+        """Return a value and mark it as recently used"""
+        shard = self._shard(key)
+        with shard.lock:
+            try:
+                value = shard.data[key]
+            except KeyError:
+                return default
+            shard.data.move_to_end(key)
+            return value
+
+    def set(
+        self,
+        key: K,
+        value: V
+    ) -> None:
+        """Store a value, evicting the least recently used entries"""
+        shard = self._shard(key)
+        with shard.lock:
+            shard.data[key] = value
+            shard.data.move_to_end(key)
+            while len(shard.data) > shard.max_entries:
+                shard.data.popitem(last=False)
+
+    def pop(
+        self,
+        key: K,
+        default: Optional[V] = None
+    ) -> Optional[V]:
+        """Remove and return a value"""
+        shard = self._shard(key)
+        with shard.lock:
+            return shard.data.pop(key, default)
+
+    def clear(self) -> None:
+        for shard in self._shards:
+            with shard.lock:
+                shard.data.clear()
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._shard(key).data
+
+    def __len__(self) -> int:
+        return sum(len(shard.data) for shard in self._shards)
@@ -1,53 +1,424 @@
-from cryptography.fernet import Fernet
+import asyncio
 from typing import (
+    Any,
     Awaitable,
     Callable,
     List,
     Optional,
-    Union
+    Protocol
+)
+from .callbacks import SecretCallback
+from .enrollment import EnrollmentSource
+from .envelope import DEFAULT_TENANT
+from .profiling import RequestProfiler
+from .tenants import (
+    TenantPolicy,
+    TenantResolver
+)
+from .verifier import TwoFactorVerifier
+from .warmup import (
+    WarmUpReport,
+    WarmUpSource,
+    warm_up
 )
-from .core import TwoFactorAuth
 from fastapi import (
     HTTPException,
     Request,
     Response,
+    WebSocket,
     status
 )
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import HTTPConnection
+from starlette.types import (
+    Message,
+    Receive,
+    Scope,
+    Send
+)
+
+
+class _Closable(Protocol):
+    async def close(self) -> None:
+        ...
+
+
+def _verifier_attribute(name: str) -> property:
+    """Read-only middleware attribute kept from before the verifier split"""
+    def get(self: "TwoFactorMiddleware") -> Any:
+        if self.verifier is None:
+            raise AttributeError(
+                f"{name} is set per tenant; use policy_for(request).verifier"
+            )
+        return getattr(self.verifier, name)
+
+    return property(get, doc=f"The verifier's ``{name}``")
+
+
+def _check_tenant_options(
+    verifier_settings: bool,
+    warm_up_source: Optional[WarmUpSource],
+    enrollment_source: Optional[EnrollmentSource]
+) -> None:
+    """Reject middleware options that only apply without ``tenants``"""
+    if verifier_settings:
+        raise ValueError(
+            "tenants cannot be combined with a verifier, its options "
+            "or excluded_paths; set them per TenantPolicy"
+        )
+    if warm_up_source is not None or enrollment_source is not None:
+        raise ValueError(
+            "warm_up_source and enrollment_source are not supported "
+            "with tenants"
+        )
+
+
+def _build_verifier(
+    get_user_secret_callback: Optional[SecretCallback],
+    verifier: Optional[TwoFactorVerifier],
+    verifier_options: dict[str, Any]
+) -> TwoFactorVerifier:
+    """The shared verifier, or one built from the callback and options"""
+    if verifier is not None:
+        if verifier_options:
+            raise ValueError(
+                "Verifier options cannot be combined with verifier"
+            )
+        return verifier
+    if get_user_secret_callback is None:
+        raise ValueError(
+            "Either get_user_secret_callback or verifier is required"
+        )
+    return TwoFactorVerifier(get_user_secret_callback, **verifier_options)
+
+
+def _check_sources(
+    verifier: TwoFactorVerifier,
+    warm_up_source: Optional[WarmUpSource],
+    enrollment_source: Optional[EnrollmentSource]
+) -> None:
+    if warm_up_source is not None and verifier.secret_cache is None:
+        raise ValueError("warm_up_source requires a secret_cache")
+    if enrollment_source is not None and verifier.enrollment_filter is None:
+        raise ValueError("enrollment_source requires an enrollment_filter")
+
+
+def _closables(
+    policies: List[TenantPolicy],
+    profiler: Optional[RequestProfiler]
+) -> List[_Closable]:
+    """The verifiers' background tasks and pools, each once"""
+    closables: List[_Closable] = []
+    for policy in policies:
+        for closable in (
+            policy.verifier.secret_cache,
+            policy.verifier.audit,
+            policy.verifier.hot_codes,
+            policy.verifier.callback_pool
+        ):
+            if closable is not None and closable not in closables:
+                closables.append(closable)
+    if profiler is not None:
+        closables.append(profiler)
+    return closables
 
 
 class TwoFactorMiddleware(BaseHTTPMiddleware):
+    encryption_key = _verifier_attribute("encryption_key")
+    get_user_secret = _verifier_attribute("get_user_secret")
+    header_name = _verifier_attribute("header_name")
+    drift_tracker = _verifier_attribute("drift_tracker")
+    digits = _verifier_attribute("digits")
+    interval = _verifier_attribute("interval")
+    algorithm = _verifier_attribute("algorithm")
+    clock = _verifier_attribute("clock")
+    device_window = _verifier_attribute("device_window")
+
     def __init__(
         self,
         app: Callable[
             [Request],
             Awaitable[Response]
         ],
-        get_user_secret_callback: Callable[
-            [str],
-            Awaitable[Optional[str]]
-        ],
+        get_user_secret_callback: Optional[SecretCallback] = None,
         *,
-        encryption_key: Optional[Union[str, bytes]] = None,
         excluded_paths: Optional[List[str]] = None,
-        header_name: str = "X-2FA-Code"
+        verifier: Optional[TwoFactorVerifier] = None,
+        tenants: Optional[TenantResolver] = None,
+        warm_up_source: Optional[WarmUpSource] = None,
+        warm_up_time_budget: float = 10.0,
+        warm_up_memory_budget: int = 64 * 1024 * 1024,
+        enrollment_source: Optional[EnrollmentSource] = None,
+        enrollment_refresh_interval: Optional[float] = 60.0,
+        websocket_subprotocol_prefix: Optional[str] = "2fa.",
+        websocket_query_param: Optional[str] = None,
+        profiler: Optional[RequestProfiler] = None,
+        **verifier_options: Any
     ):
+        """Enforce 2FA on every request outside ``excluded_paths``
+
+        Pass a shared ``verifier``, or the secret callback plus any
+        ``TwoFactorVerifier`` option (``encryption_key``,
+        ``header_name``, ``drift_tracker``, ...). For several tenants,
+        pass ``tenants`` instead: each request then uses the policy
+        (verifier and excluded paths) its tenant resolves to.
+
+        With ``warm_up_source`` the secret cache is filled from it during
+        application startup, before the server reports ready. A verifier
+        ``audit`` queue is flushed, and ``hot_codes``, the
+        ``secret_cache`` refresher and the ``callback_pool`` threads
+        stopped, during application shutdown.
+
+        With ``enrollment_source`` the verifier's ``enrollment_filter`` is
+        loaded from it at startup and rebuilt from it every
+        ``enrollment_refresh_interval`` seconds, so enrollments made
+        through other workers are picked up; ``None`` turns the refresh
+        off.
+
+        WebSocket connections are verified once, at the handshake. The
+        code is read from the verifier's header, else from a subprotocol
+        starting with ``websocket_subprotocol_prefix`` (removed before the
+        app sees the list), else from the ``websocket_query_param`` query
+        parameter. A rejected handshake is closed with 1008 (policy
+        violation), or 1013 (try again later) when throttled or when
+        lookups are shed.
+
+        With ``profiler``, one verification in ``profiler.every`` is run
+        under cProfile; other requests only count down to the next sample.
+        """
         super().__init__(app)
-        self.encryption_key = (
-            encryption_key.encode()
-            if isinstance(encryption_key, str)
-            else encryption_key
-        ) if encryption_key else None
+        if (
+            enrollment_refresh_interval is not None
+            and enrollment_refresh_interval <= 0
+        ):
+            raise ValueError("enrollment_refresh_interval must be positive")
+
+        self.tenants = tenants
+        self.verifier: Optional[TwoFactorVerifier] = None
+        self.excluded_paths = excluded_paths or ["/login", "/setup-2fa"]
+        self._resolve: Callable[[HTTPConnection], TenantPolicy]
+        if tenants is not None:
+            _check_tenant_options(
+                get_user_secret_callback is not None
+                or verifier is not None
+                or excluded_paths is not None
+                or bool(verifier_options),
+                warm_up_source,
+                enrollment_source
+            )
+            self._resolve = tenants.resolve
+            policies = tenants.policies
+        else:
+            self.verifier = _build_verifier(
+                get_user_secret_callback,
+                verifier,
+                verifier_options
+            )
+            _check_sources(self.verifier, warm_up_source, enrollment_source)
+            policy = TenantPolicy(
+                DEFAULT_TENANT,
+                self.verifier,
+                frozenset(self.excluded_paths)
+            )
+            self._resolve = lambda connection: policy
+            policies = [policy]
+        self.profiler = profiler
+        # Background tasks of the verifiers, stopped at shutdown
+        self._closables = _closables(policies, profiler)
+        self.warm_up_source = warm_up_source
+        self.warm_up_time_budget = warm_up_time_budget
+        self.warm_up_memory_budget = warm_up_memory_budget
+        self.warm_up_report: Optional[WarmUpReport] = None
+        self.enrollment_source = enrollment_source
+        self.enrollment_refresh_interval = enrollment_refresh_interval
+        self._enrollment_refresher: Optional[asyncio.Task[None]] = None
+        self.websocket_subprotocol_prefix = websocket_subprotocol_prefix
+        self.websocket_query_param = websocket_query_param
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send
+    ) -> None:
+        if scope["type"] == "websocket":
+            await self.verify_websocket(scope, receive, send)
+            return
+        if scope["type"] != "lifespan" or (
+            self.warm_up_source is None
+            and self.enrollment_source is None
+            and not self._closables
+        ):
+            await super().__call__(scope, receive, send)
+            return
+
+        async def send_lifespan(message: Message) -> None:
+            # Warm up once the app's own startup (e.g. its DB pool) is done
+            # and before the server is told startup is complete
+            if message["type"] == "lifespan.startup.complete":
+                await self.warm_up()
+                try:
+                    await self.load_enrollment()
+                except Exception:
+                    # Counted in the filter's load_errors; a filter that
+                    # never loaded skips nothing, so serving stays safe
+                    pass
+                if (
+                    self.enrollment_source is not None
+                    and self.enrollment_refresh_interval is not None
+                ):
+                    self._enrollment_refresher = asyncio.create_task(
+                        self._refresh_enrollment(
+                            self.enrollment_refresh_interval
+                        )
+                    )
+            elif message["type"] == "lifespan.shutdown.complete":
+                if self._enrollment_refresher is not None:
+                    self._enrollment_refresher.cancel()
+                    self._enrollment_refresher = None
+                for closable in self._closables:
+                    await closable.close()
+            await send(message)
 
-        if self.encryption_key:
+        await self.app(scope, receive, send_lifespan)
+
+    async def verify_websocket(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send
+    ) -> None:
+        """Verify a WebSocket handshake, then hand the connection over
+
+        Messages after the handshake go straight to the app. A rejected
+        handshake is accepted and closed at once, so clients see the close
+        code and reason rather than a bare HTTP 403.
+        """
+        connection = HTTPConnection(scope)
+        # Before the code subprotocol is taken out of the scope
+        offered = list(scope.get("subprotocols") or [])
+        try:
+            policy = self.policy_for(connection)
+            if policy.is_excluded(connection.url.path):
+                await self.app(scope, receive, send)
+                return
+            verification = policy.verifier.verify_request(
+                connection,
+                code=self._websocket_code(connection, policy.verifier)
+            )
+            profiler = self.profiler
+            if profiler is not None and profiler.should_sample():
+                await profiler.run(verification)
+            else:
+                await verification
+        except HTTPException as e:
+            retry = e.status_code in (
+                status.HTTP_429_TOO_MANY_REQUESTS,
+                status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            websocket = WebSocket(scope, receive, send)
+            # Browsers drop a connection that offered subprotocols and had
+            # none accepted, hiding the close code
+            subprotocols = scope.get("subprotocols") or offered
+            await websocket.accept(
+                subprotocol=subprotocols[0] if subprotocols else None
+            )
+            await websocket.close(
+                code=(
+                    status.WS_1013_TRY_AGAIN_LATER
+                    if retry
+                    else status.WS_1008_POLICY_VIOLATION
+                ),
+                reason=str(e.detail)
+            )
+            return
+        await self.app(scope, receive, send)
+
+    def _websocket_code(
+        self,
+        connection: HTTPConnection,
+        verifier: TwoFactorVerifier
+    ) -> Optional[str]:
+        """Code from the header, a subprotocol or the query string"""
+        # Taken first, so the code subprotocol leaves the scope either way
+        subprotocol_code = self._subprotocol_code(connection)
+        return (
+            connection.headers.get(verifier.header_name)
+            or subprotocol_code
+            or self._query_code(connection)
+        )
+
+    def _subprotocol_code(
+        self,
+        connection: HTTPConnection
+    ) -> Optional[str]:
+        """Code from the first prefixed subprotocol, removed from the scope"""
+        prefix = self.websocket_subprotocol_prefix
+        if not prefix:
+            return None
+        subprotocols = connection.scope.get("subprotocols") or []
+        offered = [p for p in subprotocols if p.startswith(prefix)]
+        if not offered:
+            return None
+        connection.scope["subprotocols"] = [
+            p for p in subprotocols if not p.startswith(prefix)
+        ]
+        return str(offered[0][len(prefix):])
+
+    def _query_code(
+        self,
+        connection: HTTPConnection
+    ) -> Optional[str]:
+        if not self.websocket_query_param:
+            return None
+        return connection.query_params.get(self.websocket_query_param)
+
+    def policy_for(
+        self,
+        connection: HTTPConnection
+    ) -> TenantPolicy:
+        """The policy a request is checked against"""
+        return self._resolve(connection)
+
+    async def load_enrollment(self) -> Optional[int]:
+        """(Re)build the enrollment filter from ``enrollment_source``"""
+        enrollment = (
+            self.verifier.enrollment_filter
+            if self.verifier is not None
+            else None
+        )
+        if self.enrollment_source is None or enrollment is None:
+            return None
+        try:
+            user_ids = self.enrollment_source()
+        except Exception:
+            enrollment.load_errors += 1
+            raise
+        return await enrollment.load(user_ids)
+
+    async def _refresh_enrollment(
+        self,
+        interval: float
+    ) -> None:
+        while True:
+            await asyncio.sleep(interval)
             try:
-                Fernet(self.encryption_key)
-            except ValueError as e:
-                raise ValueError(f"Invalid encryption key: {str(e)}") from e
+                await self.load_enrollment()
+            except Exception:
+                # Counted in load_errors; the previous contents stay
+                continue
 
-        self.get_user_secret = get_user_secret_callback
-        self.excluded_paths = excluded_paths or ["/login", "/setup-2fa"]
-        self.header_name = header_name
+    async def warm_up(self) -> Optional[WarmUpReport]:
+        """Preload the secret cache from ``warm_up_source``"""
+        if self.warm_up_source is None or self.verifier is None:
+            return None
+        self.warm_up_report = await warm_up(
+            self.verifier,
+            self.warm_up_source(),
+            time_budget=self.warm_up_time_budget,
+            memory_budget=self.warm_up_memory_budget
+        )
+        return self.warm_up_report
 
     async def dispatch(
         self,
@@ -57,39 +428,13 @@ class TwoFactorMiddleware(BaseHTTPMiddleware):
             Awaitable[Response]
         ]
     ) -> Response:
-        if any(request.url.path == path for path in self.excluded_paths):
-            return await call_next(request)
-
-        user = request.scope.get("user")
-        if not user or not user.is_authenticated:
-            return await call_next(request)
-
-        encrypted_secret = await self.get_user_secret(str(user.id))
-
-        if not encrypted_secret:
+        policy = self.policy_for(request)
+        if policy.is_excluded(request.url.path):
             return await call_next(request)
 
-        try:
-            user_secret = (
-                TwoFactorAuth.decrypt_secret(
-                    encrypted_secret,
-                    self.encryption_key
-                )
-                if self.encryption_key
-                else encrypted_secret
-            )
-        except ValueError as e:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail=str(e)
-            )
-
-        two_fa_code = request.headers.get(self.header_name)
-        auth = TwoFactorAuth(user_secret)
-        if not two_fa_code or not auth.verify_code(two_fa_code):
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid or missing 2FA code"
-            )
-
+        profiler = self.profiler
+        if profiler is not None and profiler.should_sample():
+            await profiler.run(policy.verifier.verify_request(request))
+        else:
+            await policy.verifier.verify_request(request)
         return await call_next(request)
@@ -0,0 +1,206 @@
+import asyncio
+import cProfile
+import os
+import pstats
+import tempfile
+import threading
+import time
+import types
+from typing import (
+    Any,
+    Coroutine,
+    Generator,
+    Optional,
+    TypeVar
+)
+from .tasks import (
+    cancel_task,
+    stop_task,
+    task_alive
+)
+
+
+T = TypeVar("T")
+
+
+class RequestProfiler:
+    def __init__(
+        self,
+        path: str,
+        *,
+        every: int = 100,
+        dump_interval: float = 60.0
+    ):
+        """cProfile one verification in ``every``, aggregated in one file
+
+        Only the sampled request's own coroutine steps are profiled, not
+        other requests running while it awaits. Results accumulate and
+        are written to ``path`` in pstats format every
+        ``dump_interval`` seconds and on ``close``; load them with
+        ``pstats.Stats(path)`` or a viewer such as snakeviz.
+        """
+        if dump_interval <= 0:
+            raise ValueError("dump_interval must be positive")
+
+        self.path = path
+        self.dump_interval = dump_interval
+        self.every = every
+        self._profile = cProfile.Profile()
+        # One profiler can be enabled at a time; a step that finds it busy
+        # (another thread's loop, or another tool) runs unprofiled
+        self._lock = threading.Lock()
+        self._task_lock = threading.Lock()
+        self._task: Optional[asyncio.Task[None]] = None
+        self.sampled = 0
+        self.busy_steps = 0
+        self.dumps = 0
+        self.dump_errors = 0
+        self.last_dump: Optional[float] = None
+
+    @property
+    def every(self) -> int:
+        """Profile one request in this many; 0 turns profiling off"""
+        return self._every
+
+    @every.setter
+    def every(self, every: int) -> None:
+        if every < 0:
+            raise ValueError("every cannot be negative")
+        self._every = every
+        self._countdown = every
+
+    def should_sample(self) -> bool:
+        """Count a request and say whether to profile it
+
+        The countdown is not locked: with several threads a sample may
+        occasionally be skipped or doubled.
+        """
+        if not self._every:
+            return False
+        self._countdown -= 1
+        if self._countdown > 0:
+            return False
+        self._countdown = self._every
+        return True
+
+    async def run(
+        self,
+        coro: Coroutine[Any, Any, T]
+    ) -> T:
+        """Await ``coro`` with the profiler enabled during its steps"""
+        self.sampled += 1
+        self._ensure_task()
+        return await self._profiled(coro)
+
+    @types.coroutine
+    def _profiled(
+        self,
+        coro: Coroutine[Any, Any, T]
+    ) -> Generator[Any, Any, T]:
+        value: Any = None
+        error: Optional[BaseException] = None
+        while True:
+            profiling = self._enable()
+            try:
+                if error is None:
+                    yielded = coro.send(value)
+                else:
+                    yielded = coro.throw(error)
+            except StopIteration as e:
+                # The coroutine's return value
+                result: T = e.value
+                return result
+            finally:
+                if profiling:
+                    self._profile.disable()
+                    self._lock.release()
+            try:
+                value, error = (yield yielded), None
+            except BaseException as e:
+                value, error = None, e
+
+    def _enable(self) -> bool:
+        if not self._lock.acquire(blocking=False):
+            self.busy_steps += 1
+            return False
+        try:
+            self._profile.enable()
+        except ValueError:
+            # Another profiler is active in this interpreter
+            self._lock.release()
+            self.busy_steps += 1
+            return False
+        return True
+
+    async def dump(self) -> None:
+        """Write the aggregated profile to ``path`` now"""
+        with self._lock:
+            try:
+                stats = pstats.Stats(self._profile)
+            except TypeError:
+                # Nothing profiled yet
+                return
+        try:
+            await asyncio.to_thread(self._write, stats)
+        except Exception:
+            self.dump_errors += 1
+            raise
+        self.dumps += 1
+        self.last_dump = time.time()
+
+    def _write(
+        self,
+        stats: pstats.Stats
+    ) -> None:
+        # Replace the file in one step so readers never see a partial dump;
+        # the temporary name is unique so concurrent dumps cannot collide
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            os.close(fd)
+            stats.dump_stats(temp_path)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def reset(self) -> None:
+        """Drop the samples gathered so far"""
+        with self._lock:
+            self._profile = cProfile.Profile()
+            self.sampled = 0
+
+    async def close(self) -> None:
+        """Stop the periodic dumps and write a final one"""
+        with self._task_lock:
+            task, self._task = self._task, None
+        await stop_task(task)
+        await self.dump()
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "every": self._every,
+            "sampled": self.sampled,
+            "busy_steps": self.busy_steps,
+            "dumps": self.dumps,
+            "dump_errors": self.dump_errors
+        }
+
+    def _ensure_task(self) -> None:
+        # One dump task serves every loop; replace it only once its own
+        # loop has stopped
+        with self._task_lock:
+            if not task_alive(self._task):
+                cancel_task(self._task)
+                self._task = asyncio.get_running_loop().create_task(
+                    self._dump_loop()
+                )
+
+    async def _dump_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.dump_interval)
+            try:
+                await self.dump()
+            except Exception:
+                # Counted in dump_errors; the next dump tries again
+                continue
@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import importlib
+import os
+import sys
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Optional,
+    Sequence
+)
+from .cache import SecretCache
+from .callbacks import SecretCallback
+from .throttle import (
+    AttemptThrottle,
+    MemoryThrottleBackend
+)
+from .verifier import TwoFactorVerifier
+from fastapi import (
+    FastAPI,
+    HTTPException,
+    Request,
+    Response,
+    status
+)
+
+
+STATUS_HEADER = "X-2FA-Status"
+VERIFY_METHODS = ["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+
+
+@dataclass(frozen=True)
+class SidecarUser:
+    """Minimal authenticated user built from the proxy's user id header"""
+    id: str
+
+    @property
+    def is_authenticated(self) -> bool:
+        return True
+
+
+@dataclass
+class BatchItem:
+    user_id: str
+    code: Optional[str] = None
+
+
+@dataclass
+class BatchResult:
+    user_id: str
+    status: int
+    detail: Optional[str] = None
+
+
+def create_sidecar_app(
+    verifier: TwoFactorVerifier,
+    *,
+    user_id_header: str = "X-User-Id",
+    max_batch: int = 100
+) -> FastAPI:
+    """ASGI app answering 2FA checks for a reverse proxy
+
+    ``/verify`` (any method, any sub-path, for nginx ``auth_request`` or
+    Envoy ``ext_authz``) reads the user id from ``user_id_header`` and the
+    code from the verifier's ``header_name``, and answers 204 when the
+    request may pass or 401 when it may not. ``/verify/batch`` checks up
+    to ``max_batch`` distinct users at once; ``/metrics`` and
+    ``/healthz`` are for monitoring.
+    """
+    app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+    counters = {"verified": 0, "not_enrolled": 0, "rejected": 0}
+
+    async def check(request: Request, user_id: str) -> str:
+        request.scope["user"] = SidecarUser(user_id)
+        try:
+            result = await verifier.verify_request(request)
+        except HTTPException:
+            counters["rejected"] += 1
+            raise
+        outcome = "verified" if result is not None else "not_enrolled"
+        counters[outcome] += 1
+        return outcome
+
+    @app.get("/healthz")
+    async def healthz() -> Response:
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+
+    @app.get("/metrics")
+    async def metrics() -> dict[str, Any]:
+        return {"sidecar": dict(counters), **verifier.metrics()}
+
+    @app.post("/verify/batch")
+    async def verify_batch(
+        request: Request,
+        items: list[BatchItem]
+    ) -> list[BatchResult]:
+        if len(items) > max_batch:
+            raise HTTPException(
+                status_code=413,
+                detail=f"At most {max_batch} items per batch"
+            )
+        # Several codes for one user in a batch would be guesses made in
+        # parallel
+        if len({item.user_id for item in items}) < len(items):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Each user_id may appear once per batch"
+            )
+
+        async def check_item(item: BatchItem) -> BatchResult:
+            headers = []
+            if item.code is not None:
+                headers.append((
+                    verifier.header_name.lower().encode(),
+                    item.code.encode()
+                ))
+            item_request = Request(scope={
+                "type": "http",
+                "method": "POST",
+                "path": request.url.path,
+                "headers": headers,
+                "client": request.scope.get("client")
+            })
+            try:
+                await check(item_request, item.user_id)
+            except HTTPException as e:
+                return BatchResult(item.user_id, e.status_code, e.detail)
+            return BatchResult(item.user_id, status.HTTP_204_NO_CONTENT)
+
+        return list(await asyncio.gather(*map(check_item, items)))
+
+    @app.api_route("/verify", methods=VERIFY_METHODS)
+    @app.api_route("/verify/{path:path}", methods=VERIFY_METHODS)
+    async def verify(request: Request) -> Response:
+        user_id = request.headers.get(user_id_header)
+        if not user_id:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Missing user id"
+            )
+        outcome = await check(request, user_id)
+        return Response(
+            status_code=status.HTTP_204_NO_CONTENT,
+            headers={STATUS_HEADER: outcome}
+        )
+
+    return app
+
+
+def import_callback(path: str) -> SecretCallback:
+    """Resolve a ``module:attribute`` secret callback"""
+    module_name, _, attribute = path.partition(":")
+    if not module_name or not attribute:
+        raise ValueError(f"Expected module:attribute, got {path!r}")
+    target: Any = importlib.import_module(module_name)
+    for name in attribute.split("."):
+        target = getattr(target, name)
+    if not callable(target):
+        raise ValueError(f"{path} is not callable")
+    callback: SecretCallback = target
+    return callback
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="two-fast-auth-sidecar",
+        description="Standalone 2FA verification service for proxies"
+    )
+    parser.add_argument(
+        "callback",
+        help="secret callback as module:attribute (async or sync)"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--user-id-header", default="X-User-Id")
+    parser.add_argument("--code-header", default="X-2FA-Code")
+    parser.add_argument(
+        "--encryption-key-env",
+        default="TWO_FA_ENCRYPTION_KEY",
+        help="environment variable holding the Fernet key, if any"
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=300.0,
+        help="secret cache TTL in seconds (0 disables the cache)"
+    )
+    parser.add_argument("--cache-size", type=int, default=100000)
+    parser.add_argument("--max-batch", type=int, default=100)
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=5,
+        help="failed codes allowed per user in a burst (0 disables)"
+    )
+    parser.add_argument(
+        "--attempt-interval",
+        type=float,
+        default=60.0,
+        help="seconds after which a user regains one attempt"
+    )
+    parser.add_argument(
+        "--keep-alive",
+        type=int,
+        default=75,
+        help="seconds idle proxy connections are kept open"
+    )
+    return parser.parse_args(argv)
+
+
+def build_app(args: argparse.Namespace) -> FastAPI:
+    """Sidecar app configured from parsed command-line arguments"""
+    secret_cache: Optional[SecretCache[str, Any]] = None
+    if args.cache_ttl > 0:
+        secret_cache = SecretCache(
+            ttl=args.cache_ttl,
+            max_entries=args.cache_size
+        )
+    throttle: Optional[AttemptThrottle] = None
+    if args.max_attempts > 0:
+        # Every request comes from the proxy, so only users are throttled
+        throttle = AttemptThrottle(
+            MemoryThrottleBackend(
+                capacity=args.max_attempts,
+                refill_per_second=1 / args.attempt_interval
+            ),
+            per_client=False
+        )
+    verifier = TwoFactorVerifier(
+        import_callback(args.callback),
+        encryption_key=os.environ.get(args.encryption_key_env),
+        header_name=args.code_header,
+        secret_cache=secret_cache,
+        throttle=throttle
+    )
+    return create_sidecar_app(
+        verifier,
+        user_id_header=args.user_id_header,
+        max_batch=args.max_batch
+    )
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    """Console entry point: ``two-fast-auth-sidecar module:callback``"""
+    args = parse_args(argv)
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit(
+            "The sidecar needs uvicorn: "
+            "pip install 'two_fast_auth[sidecar]'"
+        )
+
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    uvicorn.run(
+        build_app(args),
+        host=args.host,
+        port=args.port,
+        # Proxies reuse connections; keep them open longer than theirs
+        timeout_keep_alive=args.keep_alive,
+        access_log=False,
+        server_header=False
+    )
@@ -0,0 +1,250 @@
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import (
+    Awaitable,
+    Callable,
+    Iterable,
+    Optional
+)
+from .devices import SecretSet
+
+
+# magic, version, key width, value width, record count
+HEADER = struct.Struct("<4sHHHxxQ")
+MAGIC = b"2FAS"
+VERSION = 1
+
+
+def export_snapshot(
+    path: str,
+    secrets: Iterable[tuple[str, str]]
+) -> int:
+    """Write ``(user_id, encrypted_secret)`` pairs to a snapshot file
+
+    Records are fixed-width and sorted by user id, so readers can
+    binary-search the file in place. The file is written next to
+    ``path`` and moved over it atomically; readers see either the old
+    or the new snapshot, never a partial one. Returns the record count.
+    """
+    records: dict[bytes, bytes] = {}
+    for user_id, secret in secrets:
+        key = str(user_id).encode()
+        value = secret.encode()
+        if b"\0" in key or b"\0" in value:
+            raise ValueError("User ids and secrets cannot contain NUL bytes")
+        if key in records:
+            raise ValueError(f"Duplicate user id in snapshot: {user_id}")
+        records[key] = value
+
+    key_width = max(map(len, records), default=0)
+    value_width = max(map(len, records.values()), default=0)
+    if key_width > 0xFFFF or value_width > 0xFFFF:
+        raise ValueError("User ids and secrets must be under 64 KiB")
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(HEADER.pack(
+                MAGIC,
+                VERSION,
+                key_width,
+                value_width,
+                len(records)
+            ))
+            for key in sorted(records):
+                file.write(key.ljust(key_width, b"\0"))
+                file.write(records[key].ljust(value_width, b"\0"))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return len(records)
+
+
+class _Keys:
+    """Sequence view of the snapshot keys, read straight from the map
+
+    Each probe copies one key-width slice into a small ``bytes``; a
+    ``memoryview`` slice would avoid that, but memoryviews do not order,
+    so ``bisect`` could not compare them.
+    """
+
+    def __init__(
+        self,
+        data: mmap.mmap,
+        key_width: int,
+        record_width: int,
+        count: int
+    ):
+        self.data = data
+        self.key_width = key_width
+        self.record_width = record_width
+        self.count = count
+
+    def __getitem__(self, index: int) -> bytes:
+        start = HEADER.size + index * self.record_width
+        return self.data[start:start + self.key_width]
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class Snapshot:
+    def __init__(
+        self,
+        path: str
+    ):
+        """Read-only, memory-mapped view of a snapshot file
+
+        The file is mapped, not read: every worker process mapping the
+        same file shares one copy in the page cache.
+        """
+        with open(path, "rb") as file:
+            stat = os.fstat(file.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if stat.st_size < HEADER.size:
+                raise ValueError(f"Snapshot {path} is truncated")
+            self._data = mmap.mmap(
+                file.fileno(),
+                0,
+                access=mmap.ACCESS_READ
+            )
+
+        magic, version, key_width, value_width, count = HEADER.unpack_from(
+            self._data
+        )
+        record_width = key_width + value_width
+        if (
+            magic != MAGIC
+            or version != VERSION
+            or len(self._data) != HEADER.size + count * record_width
+        ):
+            self._data.close()
+            raise ValueError(f"{path} is not a valid secret snapshot")
+
+        self.key_width = key_width
+        self.record_width = record_width
+        self._keys = _Keys(self._data, key_width, record_width, count)
+
+    def get(
+        self,
+        user_id: str
+    ) -> Optional[str]:
+        """Binary-search the mapped records for a user id"""
+        key = user_id.encode()
+        if len(key) > self.key_width:
+            return None
+        key = key.ljust(self.key_width, b"\0")
+        index = bisect.bisect_left(self._keys, key)
+        if index == len(self._keys) or self._keys[index] != key:
+            return None
+
+        start = HEADER.size + index * self.record_width + self.key_width
+        end = start + self.record_width - self.key_width
+        return self._data[start:end].rstrip(b"\0").decode()
+
+    def close(self) -> None:
+        self._data.close()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class SnapshotResolver:
+    def __init__(
+        self,
+        path: str,
+        fallback: Optional[Callable[
+            [str],
+            Awaitable[Optional[SecretSet]]
+        ]] = None,
+        *,
+        check_interval: float = 1.0,
+        clock: Optional[Callable[[], float]] = None
+    ):
+        """Secret callback backed by a shared snapshot file
+
+        Use it as ``get_user_secret_callback``. Users missing from the
+        snapshot (or all users, while the file does not exist) are looked
+        up through ``fallback``. The file is checked for replacement at
+        most every ``check_interval`` seconds and remapped when
+        ``export_snapshot`` swaps in a new one.
+        """
+        self.path = path
+        self.fallback = fallback
+        self.check_interval = check_interval
+        self._clock = clock or time.monotonic
+        self._snapshot: Optional[Snapshot] = None
+        self._next_check = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.errors = 0
+
+    async def __call__(
+        self,
+        user_id: str
+    ) -> Optional[SecretSet]:
+        snapshot = self.current()
+        if snapshot is not None:
+            secret = snapshot.get(user_id)
+            if secret is not None:
+                self.hits += 1
+                return secret
+
+        self.misses += 1
+        if self.fallback is None:
+            return None
+        return await self.fallback(user_id)
+
+    def current(self) -> Optional[Snapshot]:
+        """The mapped snapshot, remapped if the file has been replaced"""
+        now = self._clock()
+        if now < self._next_check:
+            return self._snapshot
+        self._next_check = now + self.check_interval
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return self._snapshot
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if self._snapshot is None or self._snapshot.identity != identity:
+            try:
+                self._swap(Snapshot(self.path))
+            except (OSError, ValueError):
+                # Keep serving the previous snapshot; retried next check
+                self.errors += 1
+        return self._snapshot
+
+    def close(self) -> None:
+        self._swap(None)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "records": (
+                len(self._snapshot) if self._snapshot is not None else 0
+            ),
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "errors": self.errors
+        }
+
+    def _swap(
+        self,
+        snapshot: Optional[Snapshot]
+    ) -> None:
+        previous = self._snapshot
+        self._snapshot = snapshot
+        if snapshot is not None:
+            self.reloads += 1
+        if previous is not None:
+            previous.close()
@@ -0,0 +1,63 @@
+import threading
+from typing import Hashable
+
+
+DEFAULT_STRIPES = 16
+
+
+class StripedLock:
+    def __init__(
+        self,
+        stripes: int = DEFAULT_STRIPES
+    ):
+        """A fixed set of locks, one picked per key by hash
+
+        Threads working on different keys rarely share a lock, so
+        unrelated updates do not serialize on one mutex, and the number of
+        locks stays bounded however many keys there are.
+        """
+        if stripes < 1:
+            raise ValueError("stripes must be at least 1")
+
+        self._locks = tuple(threading.Lock() for _ in range(stripes))
+
+    def lock_for(
+        self,
+        key: Hashable
+    ) -> threading.Lock:
+        return self._locks[hash(key) % len(self._locks)]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class StripedCounter:
+    def __init__(
+        self,
+        stripes: int = DEFAULT_STRIPES
+    ):
+        """Counter that threads increment on their own stripe
+
+        ``+=`` on a shared int can lose updates without the GIL; one lock
+        per counter would make every thread contend on it. Each thread
+        adds to the stripe picked by its id and reads sum all stripes.
+        """
+        if stripes < 1:
+            raise ValueError("stripes must be at least 1")
+
+        self._locks = StripedLock(stripes)
+        self._counts = [0] * stripes
+
+    def add(
+        self,
+        amount: int = 1
+    ) -> None:
+        # Native ids are small sequential numbers; get_ident() values are
+        # aligned addresses that would all land on the same stripe
+        stripe = threading.get_native_id() % len(self._counts)
+        with self._locks.lock_for(stripe):
+            self._counts[stripe] += amount
+
+    @property
+    def value(self) -> int:
+        return sum(self._counts)
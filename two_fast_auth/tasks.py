@@ -0,0 +1,58 @@
+import asyncio
+from typing import (
+    Any,
+    Optional
+)
+
+
+def task_alive(
+    task: Optional["asyncio.Task[Any]"],
+    loop: Optional[asyncio.AbstractEventLoop] = None
+) -> bool:
+    """Whether ``task`` can still run: not done and its loop running
+
+    With ``loop``, the task must also belong to that loop.
+    """
+    if task is None or task.done():
+        return False
+    task_loop = task.get_loop()
+    if loop is not None and task_loop is not loop:
+        return False
+    # A closed loop is never running
+    return task_loop.is_running()
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def cancel_task(task: Optional["asyncio.Task[Any]"]) -> None:
+    """Cancel ``task`` from any thread, without waiting for it"""
+    if task is None or task.done():
+        return
+    task_loop = task.get_loop()
+    if task_loop is _running_loop():
+        task.cancel()
+        return
+    try:
+        task_loop.call_soon_threadsafe(task.cancel)
+    except RuntimeError:
+        # Its loop is closed, so the task can never run again
+        pass
+
+
+async def stop_task(task: Optional["asyncio.Task[Any]"]) -> None:
+    """Cancel ``task`` and wait for it if it runs in the current loop"""
+    if task is None:
+        return
+    if task.get_loop() is not asyncio.get_running_loop():
+        cancel_task(task)
+        return
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
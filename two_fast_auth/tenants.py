@@ -0,0 +1,222 @@
+import pyotp
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Iterable,
+    Mapping,
+    Optional
+)
+from .callbacks import SecretCallback
+from .core import TwoFactorAuth
+from .envelope import KeyProvider
+from .verifier import TwoFactorVerifier
+from fastapi import (
+    HTTPException,
+    status
+)
+from starlette.requests import HTTPConnection
+
+
+@dataclass(frozen=True)
+class TenantPolicy:
+    """Everything a request needs for one tenant, built once"""
+    name: str
+    verifier: TwoFactorVerifier
+    excluded_paths: frozenset[str] = frozenset()
+    issuer_name: str = "2FastAuth"
+    qr_fill_color: str = "black"
+    qr_back_color: str = "white"
+
+    @classmethod
+    def build(
+        cls,
+        name: str,
+        get_user_secret_callback: Optional[SecretCallback] = None,
+        *,
+        verifier: Optional[TwoFactorVerifier] = None,
+        excluded_paths: Optional[Iterable[str]] = None,
+        issuer_name: str = "2FastAuth",
+        qr_fill_color: str = "black",
+        qr_back_color: str = "white",
+        **verifier_options: Any
+    ) -> "TenantPolicy":
+        """Validate a tenant's settings and build its verifier
+
+        Takes a shared ``verifier`` or the secret callback plus any
+        ``TwoFactorVerifier`` option, like ``TwoFactorMiddleware``. The
+        built verifier only accepts the tenant's own envelope data keys.
+        """
+        if verifier is None:
+            if get_user_secret_callback is None:
+                raise ValueError(
+                    "Either get_user_secret_callback or verifier is required"
+                )
+            verifier_options.setdefault("tenant", name)
+            verifier = TwoFactorVerifier(
+                get_user_secret_callback,
+                **verifier_options
+            )
+        elif verifier_options:
+            raise ValueError("Verifier options cannot be combined with verifier")
+        elif (
+            isinstance(verifier.encryption_key, KeyProvider)
+            and verifier.tenant != name
+        ):
+            raise ValueError(
+                f"Verifier decrypts for tenant {verifier.tenant}, not {name}"
+            )
+
+        return cls(
+            name,
+            verifier,
+            frozenset(
+                excluded_paths
+                if excluded_paths is not None
+                else ("/login", "/setup-2fa")
+            ),
+            issuer_name,
+            qr_fill_color,
+            qr_back_color
+        )
+
+    def is_excluded(
+        self,
+        path: str
+    ) -> bool:
+        return path in self.excluded_paths
+
+    def auth(
+        self,
+        secret: Optional[str] = None
+    ) -> TwoFactorAuth:
+        """``TwoFactorAuth`` with the tenant's branding and OTP settings,
+        e.g. for enrollment QR codes, with a new secret if none is given"""
+        return TwoFactorAuth(
+            secret or pyotp.random_base32(),
+            qr_fill_color=self.qr_fill_color,
+            qr_back_color=self.qr_back_color,
+            issuer_name=self.issuer_name,
+            digits=self.verifier.digits,
+            interval=self.verifier.interval,
+            algorithm=self.verifier.algorithm,
+            clock=self.verifier.clock
+        )
+
+    def encrypt_secret(
+        self,
+        secret: str,
+        *,
+        compact: bool = False
+    ) -> str:
+        """Encrypt a secret with the tenant's key, for storage"""
+        return TwoFactorAuth.encrypt_secret(
+            secret,
+            self.verifier.encryption_key,
+            compact=compact,
+            tenant=self.name
+        )
+
+
+def _index_policies(
+    policies: Iterable[TenantPolicy]
+) -> dict[str, TenantPolicy]:
+    by_name: dict[str, TenantPolicy] = {}
+    for policy in policies:
+        if policy.name in by_name:
+            raise ValueError(f"Duplicate tenant: {policy.name}")
+        by_name[policy.name] = policy
+    return by_name
+
+
+class TenantResolver:
+    def __init__(
+        self,
+        policies: Iterable[TenantPolicy],
+        *,
+        header: Optional[str] = None,
+        hosts: Optional[Mapping[str, str]] = None,
+        default: Optional[str] = None
+    ):
+        """Pick a request's ``TenantPolicy`` with one dict lookup
+
+        The ``Host`` header is looked up in ``hosts`` (host name to
+        tenant name); a request to a mapped host whose ``header`` names
+        another tenant is rejected with 400. Requests to other hosts use
+        the tenant named in ``header`` (set it at a trusted proxy), else
+        the ``default`` tenant, or are rejected with 400 when there is
+        none.
+        """
+        self._by_name = _index_policies(policies)
+        hosts = hosts or {}
+        if header is None and not hosts:
+            raise ValueError("Resolve tenants from a header, hosts or both")
+
+        unknown = {
+            name
+            for name in [*hosts.values(), default]
+            if name is not None and name not in self._by_name
+        }
+        if unknown:
+            raise ValueError(f"Unknown tenants: {', '.join(sorted(unknown))}")
+
+        self.header = header
+        self._by_host = {
+            host.lower(): self._by_name[name]
+            for host, name in hosts.items()
+        }
+        self.default = self._by_name[default] if default is not None else None
+
+    @property
+    def policies(self) -> list[TenantPolicy]:
+        return list(self._by_name.values())
+
+    def resolve(
+        self,
+        connection: HTTPConnection
+    ) -> TenantPolicy:
+        claimed = self._claimed_tenant(connection)
+        policy = self._host_policy(connection)
+        if policy is not None:
+            # A mapped host decides; the header may only agree with it
+            if claimed and claimed != policy.name:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Tenant does not match host"
+                )
+            return policy
+        policy = self._by_name.get(claimed) if claimed else None
+        if policy is None:
+            policy = self.default
+        if policy is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Unknown tenant"
+            )
+        return policy
+
+    def _claimed_tenant(
+        self,
+        connection: HTTPConnection
+    ) -> Optional[str]:
+        if self.header is None:
+            return None
+        return connection.headers.get(self.header)
+
+    def _host_policy(
+        self,
+        connection: HTTPConnection
+    ) -> Optional[TenantPolicy]:
+        if not self._by_host:
+            return None
+        host = connection.headers.get("host", "").partition(":")[0]
+        return self._by_host.get(host.lower())
+
+    def __getitem__(
+        self,
+        name: str
+    ) -> TenantPolicy:
+        return self._by_name[name]
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
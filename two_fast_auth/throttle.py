@@ -0,0 +1,185 @@
+import math
+import time
+from typing import (
+    Callable,
+    Optional,
+    Protocol
+)
+from .lru import LRUCache
+from .striped import StripedLock
+from fastapi import (
+    HTTPException,
+    status
+)
+from starlette.requests import HTTPConnection
+
+
+class ThrottleBackend(Protocol):
+    async def try_acquire(
+        self,
+        key: str
+    ) -> float:
+        """Take one attempt for the key in a single atomic step
+
+        Returns 0 when an attempt was taken, else the seconds until one
+        is available (nothing is taken then).
+        """
+        ...
+
+    async def refund(
+        self,
+        key: str
+    ) -> None:
+        """Give back an attempt taken by ``try_acquire``"""
+        ...
+
+
+class MemoryThrottleBackend:
+    def __init__(
+        self,
+        *,
+        capacity: int = 5,
+        refill_per_second: float = 1 / 60,
+        max_entries: int = 100000,
+        clock: Optional[Callable[[], float]] = None
+    ):
+        """Token buckets per key in a fixed-capacity LRU
+
+        Each key may make ``capacity`` attempts in a burst and regains
+        one every ``1 / refill_per_second`` seconds. When full, the
+        least recently used bucket is dropped.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if refill_per_second <= 0:
+            raise ValueError("refill_per_second must be positive")
+
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._clock = clock or time.monotonic
+        self._buckets: LRUCache[str, tuple[float, float]] = LRUCache(
+            max_entries
+        )
+        self._locks = StripedLock()
+
+    def _tokens(
+        self,
+        key: str,
+        now: float
+    ) -> float:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return float(self.capacity)
+        tokens, updated = bucket
+        return min(
+            float(self.capacity),
+            tokens + (now - updated) * self.refill_per_second
+        )
+
+    async def blocked_for(
+        self,
+        key: str
+    ) -> float:
+        """Seconds until the key may try again (0 if not throttled)"""
+        tokens = self._tokens(key, self._clock())
+        if tokens >= 1:
+            return 0.0
+        return (1 - tokens) / self.refill_per_second
+
+    async def try_acquire(
+        self,
+        key: str
+    ) -> float:
+        # Read-modify-write; unlocked, parallel attempts could share a token
+        with self._locks.lock_for(key):
+            now = self._clock()
+            tokens = self._tokens(key, now)
+            if tokens < 1:
+                return (1 - tokens) / self.refill_per_second
+            self._buckets.set(key, (tokens - 1, now))
+            return 0.0
+
+    async def refund(
+        self,
+        key: str
+    ) -> None:
+        with self._locks.lock_for(key):
+            now = self._clock()
+            tokens = min(self._tokens(key, now) + 1, float(self.capacity))
+            self._buckets.set(key, (tokens, now))
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def client_host(request: HTTPConnection) -> Optional[str]:
+    """Default client key: the peer address"""
+    return request.client.host if request.client else None
+
+
+class AttemptThrottle:
+    def __init__(
+        self,
+        backend: Optional[ThrottleBackend] = None,
+        *,
+        per_user: bool = True,
+        per_client: bool = True,
+        client_key: Callable[[HTTPConnection], Optional[str]] = client_host
+    ):
+        if not per_user and not per_client:
+            raise ValueError("Enable per_user, per_client or both")
+
+        self.backend: ThrottleBackend = (
+            backend if backend is not None else MemoryThrottleBackend()
+        )
+        self.per_user = per_user
+        self.per_client = per_client
+        self.client_key = client_key
+
+    def keys(
+        self,
+        request: HTTPConnection,
+        user_id: str
+    ) -> list[str]:
+        """Bucket keys charged for an attempt"""
+        keys = []
+        if self.per_user:
+            keys.append(f"user:{user_id}")
+        if self.per_client:
+            client = self.client_key(request)
+            if client:
+                keys.append(f"client:{client}")
+        return keys
+
+    async def check(
+        self,
+        request: HTTPConnection,
+        user_id: str
+    ) -> None:
+        """Take an attempt from the user and the client
+
+        Raises 429 when either has none left, giving back what was
+        already taken. Concurrent requests each take their own attempt,
+        so no more than the bucket holds get through to a comparison.
+        """
+        taken: list[str] = []
+        for key in self.keys(request, user_id):
+            wait = await self.backend.try_acquire(key)
+            if wait > 0:
+                for taken_key in taken:
+                    await self.backend.refund(taken_key)
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many failed 2FA attempts",
+                    headers={"Retry-After": str(math.ceil(wait))}
+                )
+            taken.append(key)
+
+    async def refund(
+        self,
+        request: HTTPConnection,
+        user_id: str
+    ) -> None:
+        """Give back the attempt taken by ``check``"""
+        for key in self.keys(request, user_id):
+            await self.backend.refund(key)
@@ -0,0 +1,728 @@
+import asyncio
+from cryptography.fernet import Fernet
+from dataclasses import (
+    dataclass,
+    field
+)
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    TypeVar,
+    Union
+)
+from .audit import (
+    AuditEvent,
+    AuditQueue
+)
+from .cache import SecretCache
+from .callbacks import (
+    AsyncSecretCallback,
+    CallbackPool,
+    SecretCallback,
+    is_async_callable
+)
+from .clock import StepClock
+from .core import (
+    EncryptionKey,
+    TwoFactorAuth
+)
+from .devices import (
+    DeviceCodeIndex,
+    SecretSet,
+    normalize_secrets
+)
+from .drift import DriftTracker
+from .enrollment import EnrollmentFilter
+from .envelope import (
+    DEFAULT_TENANT,
+    KeyProvider
+)
+from .hot import (
+    HotCodes,
+    HotKeys
+)
+from .limits import (
+    LookupLimiter,
+    LookupRejected
+)
+from .lru import LRUCache
+from .throttle import AttemptThrottle
+from fastapi import (
+    HTTPException,
+    status
+)
+from starlette.requests import HTTPConnection
+
+
+T = TypeVar("T")
+
+STATE_KEY = "two_fa"
+INVALID_CODE_DETAIL = "Invalid or missing 2FA code"
+
+
+@dataclass(frozen=True)
+class TwoFactorResult:
+    user_id: str
+    step: int
+    device_id: Optional[str] = None
+    secret: Optional[str] = field(default=None, repr=False)
+
+
+@dataclass
+class VerificationContext:
+    request: HTTPConnection
+    user: Any
+    user_id: str
+    code: Optional[str]
+    encrypted_secret: Optional[Union[str, dict[str, str]]] = None
+    result: Optional[TwoFactorResult] = None
+    # Set once the throttle has taken an attempt for the code
+    throttled: bool = False
+    # Set once a well-formed code is matched against the secret(s)
+    compared: bool = False
+
+
+# A stage returns True to continue, False to let the request through
+# without 2FA, or raises HTTPException to reject it.
+Stage = Callable[[VerificationContext], Awaitable[bool]]
+
+
+def _validated_key(
+    encryption_key: Optional[EncryptionKey]
+) -> Optional[Union[bytes, KeyProvider]]:
+    """Fernet key bytes or a KeyProvider, checked before first use"""
+    if not encryption_key:
+        return None
+    key = (
+        encryption_key.encode()
+        if isinstance(encryption_key, str)
+        else encryption_key
+    )
+    if isinstance(key, bytes):
+        try:
+            Fernet(key)
+        except ValueError as e:
+            raise ValueError(f"Invalid encryption key: {str(e)}") from e
+    elif not isinstance(key, KeyProvider):
+        raise ValueError("Invalid encryption key: expected a KeyProvider")
+    return key
+
+
+def _check_intervals(
+    interval: int,
+    clock: Optional[StepClock],
+    hot_codes: Optional[HotCodes]
+) -> None:
+    if clock is not None and clock.interval != interval:
+        raise ValueError("Clock interval does not match the OTP interval")
+    if hot_codes is not None and hot_codes.clock.interval != interval:
+        raise ValueError(
+            "hot_codes interval does not match the OTP interval"
+        )
+
+
+def _decrypted_capacity(
+    device_index_size: int,
+    secret_cache: Optional[SecretCache[str, Optional[SecretSet]]]
+) -> int:
+    """Users whose decrypted secrets are kept, at least one per cached secret
+
+    Otherwise a secret cache hit would decrypt again once the cache holds
+    more users than ``device_index_size``.
+    """
+    if secret_cache is None:
+        return device_index_size
+    return max(device_index_size, secret_cache.max_entries)
+
+
+class TwoFactorVerifier:
+    def __init__(
+        self,
+        get_user_secret_callback: SecretCallback,
+        *,
+        encryption_key: Optional[EncryptionKey] = None,
+        tenant: str = DEFAULT_TENANT,
+        header_name: str = "X-2FA-Code",
+        drift_tracker: Optional[DriftTracker] = None,
+        digits: int = 6,
+        interval: int = 30,
+        algorithm: str = "sha1",
+        device_window: int = 0,
+        device_index_size: int = 1024,
+        clock: Optional[StepClock] = None,
+        expose_secret: bool = False,
+        user_secret_attribute: Optional[Union[
+            str,
+            Callable[[Any], Optional[SecretSet]]
+        ]] = None,
+        reject_missing_code: bool = False,
+        pre_lookup_stages: Optional[Sequence[Stage]] = None,
+        throttle: Optional[AttemptThrottle] = None,
+        lookup_limiter: Optional[LookupLimiter] = None,
+        secret_cache: Optional[SecretCache[str, Optional[SecretSet]]] = None,
+        callback_pool: Optional[CallbackPool] = None,
+        audit: Optional[AuditQueue] = None,
+        enrollment_filter: Optional[EnrollmentFilter] = None,
+        hot_codes: Optional[HotCodes] = None
+    ):
+        self.encryption_key = _validated_key(encryption_key)
+        self.tenant = tenant
+        # Unwrapping a data key may block on the KMS, so decryptions with
+        # a KeyProvider run in a worker thread
+        self._decrypt_in_thread = isinstance(self.encryption_key, KeyProvider)
+
+        TwoFactorAuth.validate_parameters(
+            digits=digits,
+            interval=interval,
+            algorithm=algorithm
+        )
+        _check_intervals(interval, clock, hot_codes)
+
+        self.get_user_secret: AsyncSecretCallback
+        if is_async_callable(get_user_secret_callback):
+            self.get_user_secret = get_user_secret_callback
+        else:
+            # Blocking callbacks run in their own pool, off the event loop
+            if callback_pool is None:
+                callback_pool = CallbackPool()
+            self.get_user_secret = callback_pool.wrap(
+                get_user_secret_callback
+            )
+        self.callback_pool = callback_pool
+        self.header_name = header_name
+        self.drift_tracker = drift_tracker
+        self.digits = digits
+        self.interval = interval
+        self.algorithm = algorithm
+        self.clock = clock or StepClock.shared(interval)
+        self.device_window = device_window
+        self.expose_secret = expose_secret
+        self.user_secret_attribute = user_secret_attribute
+        self.reject_missing_code = reject_missing_code
+        self.throttle = throttle
+        self.lookup_limiter = lookup_limiter
+        self.secret_cache = secret_cache
+        self.audit = audit
+        self.enrollment_filter = enrollment_filter
+        self.hot_codes = hot_codes
+        self.stages: List[Stage] = [
+            self.check_code_format,
+            *((self.check_throttle,) if throttle is not None else ()),
+            *(pre_lookup_stages or ()),
+            self.lookup_secret,
+            self.require_code,
+            self.verify_code
+        ]
+        capacity = _decrypted_capacity(device_index_size, secret_cache)
+        self._device_indexes: LRUCache[
+            str,
+            tuple[tuple[tuple[str, str], ...], DeviceCodeIndex]
+        ] = LRUCache(capacity)
+        # Decrypted single secrets, keyed by the ciphertext they came from
+        self._secret_auths: LRUCache[str, tuple[str, TwoFactorAuth]] = (
+            LRUCache(capacity)
+        )
+
+    async def verify_request(
+        self,
+        request: HTTPConnection,
+        code: Optional[str] = None
+    ) -> Optional[TwoFactorResult]:
+        """Enforce 2FA for the request's authenticated user
+
+        Raises ``HTTPException`` (401) when the user has 2FA enabled and
+        the code header is missing or invalid. ``code`` replaces the
+        header, e.g. for a code sent another way on a WebSocket
+        handshake. A successful verification
+        is stored in ``request.state.two_fa`` and reused by later checks
+        of the same request. With ``audit`` set, every success and
+        rejection is queued as an ``AuditEvent``.
+        """
+        user = request.scope.get("user")
+        if not user or not user.is_authenticated:
+            return None
+
+        user_id = str(user.id)
+        existing: Optional[TwoFactorResult] = getattr(
+            request.state,
+            STATE_KEY,
+            None
+        )
+        if existing is not None and existing.user_id == user_id:
+            return existing
+
+        context = VerificationContext(
+            request,
+            user,
+            user_id,
+            code if code is not None else request.headers.get(self.header_name)
+        )
+        result = await self._run_stages(context)
+        if result is not None:
+            setattr(request.state, STATE_KEY, result)
+            self._audit(
+                request,
+                user_id,
+                status.HTTP_200_OK,
+                device_id=result.device_id
+            )
+        return result
+
+    async def _run_stages(
+        self,
+        context: VerificationContext
+    ) -> Optional[TwoFactorResult]:
+        """Run the stages, auditing rejections and settling the throttle"""
+        failed_comparison = False
+        try:
+            for stage in self.stages:
+                if not await stage(context):
+                    return None
+            return context.result
+        except HTTPException as e:
+            failed_comparison = (
+                context.compared and e.detail == INVALID_CODE_DETAIL
+            )
+            self._audit(
+                context.request,
+                context.user_id,
+                e.status_code,
+                detail=e.detail
+            )
+            raise
+        finally:
+            # Only a code that was compared and did not match keeps its
+            # attempt; a match, a user without 2FA or an error gives it back
+            if context.throttled and not failed_comparison:
+                await self._refund_attempt(context)
+
+    async def _refund_attempt(
+        self,
+        context: VerificationContext
+    ) -> None:
+        if self.throttle is not None:
+            await self.throttle.refund(context.request, context.user_id)
+
+    def _audit(
+        self,
+        request: HTTPConnection,
+        user_id: str,
+        status_code: int,
+        *,
+        device_id: Optional[str] = None,
+        detail: Optional[str] = None
+    ) -> None:
+        if self.audit is None:
+            return
+        self.audit.emit(AuditEvent(
+            user_id=user_id,
+            outcome="success" if status_code < 400 else "failure",
+            status_code=status_code,
+            path=request.url.path,
+            client=request.client.host if request.client else None,
+            device_id=device_id,
+            detail=detail
+        ))
+
+    async def resolve_secret(
+        self,
+        user: Any,
+        user_id: str
+    ) -> Optional[SecretSet]:
+        """Encrypted secret(s) for a user
+
+        Taken from the already-loaded scope user when
+        ``user_secret_attribute`` is set, falling back to the secret
+        callback only when the user object does not carry one. Users the
+        ``enrollment_filter`` knows are not enrolled skip the callback.
+        """
+        attribute = self.user_secret_attribute
+        if attribute is not None:
+            secret = (
+                attribute(user)
+                if callable(attribute)
+                else getattr(user, attribute, None)
+            )
+            if secret:
+                return secret
+
+        enrollment = self.enrollment_filter
+        if enrollment is not None and not enrollment.might_be_enrolled(user_id):
+            return None
+
+        if self.secret_cache is not None:
+            secret = await self.secret_cache.get(
+                user_id,
+                lambda: self._load_secret(user_id)
+            )
+        else:
+            secret = await self._load_secret(user_id)
+        if enrollment is not None and not secret:
+            enrollment.record_false_positive()
+        return secret
+
+    def invalidate(
+        self,
+        user_id: str
+    ) -> None:
+        """Forget everything cached for a user, e.g. after a 2FA reset"""
+        if self.secret_cache is not None:
+            self.secret_cache.invalidate(user_id)
+        self._device_indexes.pop(user_id)
+        self._secret_auths.pop(user_id)
+        if self.drift_tracker is not None:
+            self.drift_tracker.forget(user_id)
+        if self.hot_codes is not None:
+            self.hot_codes.forget(user_id)
+
+    def preload_secret(
+        self,
+        user_id: str,
+        encrypted_secret: SecretSet
+    ) -> None:
+        """Decrypt a user's secret(s) ahead of their first request
+
+        The decrypted secrets are kept as a verification would keep them,
+        so that request only computes codes. Raises ``HTTPException``
+        when a secret does not decrypt. Safe to call from worker threads.
+        """
+        if isinstance(encrypted_secret, str):
+            self._secret_auth(user_id, encrypted_secret)
+        else:
+            self._device_index(user_id, normalize_secrets(encrypted_secret))
+
+    @property
+    def decrypted_capacity(self) -> int:
+        """Users whose decrypted secrets the verifier keeps in memory"""
+        return min(
+            self._secret_auths.max_entries,
+            self._device_indexes.max_entries
+        )
+
+    async def _load_secret(
+        self,
+        user_id: str
+    ) -> Optional[SecretSet]:
+        """Call the secret callback, within the lookup limiter if any"""
+        try:
+            if self.lookup_limiter is None:
+                return await self.get_user_secret(user_id)
+            return await self.lookup_limiter.run(
+                lambda: self.get_user_secret(user_id)
+            )
+        except LookupRejected as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="2FA verification temporarily unavailable",
+                headers={"Retry-After": "1"}
+            ) from e
+
+    def metrics(self) -> dict[str, Mapping[str, float]]:
+        """Counters of the verifier's optional components"""
+        metrics: dict[str, Mapping[str, float]] = {}
+        if self.lookup_limiter is not None:
+            metrics["lookup"] = self.lookup_limiter.stats()
+        if self.secret_cache is not None:
+            metrics["secret_cache"] = self.secret_cache.stats()
+        if self.callback_pool is not None:
+            metrics["callback_pool"] = self.callback_pool.stats()
+        if self.audit is not None:
+            metrics["audit"] = self.audit.stats()
+        if self.enrollment_filter is not None:
+            metrics["enrollment_filter"] = self.enrollment_filter.stats()
+        if self.hot_codes is not None:
+            metrics["hot_codes"] = self.hot_codes.stats()
+        return metrics
+
+    async def check_throttle(
+        self,
+        context: VerificationContext
+    ) -> bool:
+        """Take an attempt for a presented code before any lookup
+
+        Users or clients out of attempts are rejected with 429. Requests
+        without a code are never throttled, so a locked-out client
+        address does not block its users who have no 2FA.
+        """
+        if self.throttle is not None and context.code:
+            await self.throttle.check(context.request, context.user_id)
+            context.throttled = True
+        return True
+
+    async def check_code_format(
+        self,
+        context: VerificationContext
+    ) -> bool:
+        """Treat a malformed code as a missing one
+
+        Users without 2FA still pass through whatever header they send;
+        enrolled users are rejected by ``require_code`` before any
+        decryption. With ``reject_missing_code`` (every user has 2FA)
+        both are rejected here, before any I/O.
+        """
+        code = context.code
+        if code is not None and (
+            len(code) != self.digits
+            or not code.isascii()
+            or not code.isdigit()
+        ):
+            code = context.code = None
+        if code is None and self.reject_missing_code:
+            raise self._reject()
+        return True
+
+    async def lookup_secret(
+        self,
+        context: VerificationContext
+    ) -> bool:
+        """Load the user's encrypted secret(s); skip users without 2FA"""
+        secret = await self.resolve_secret(context.user, context.user_id)
+        if secret is not None and not isinstance(secret, str):
+            secret = normalize_secrets(secret)
+        context.encrypted_secret = secret
+        return bool(secret)
+
+    async def require_code(
+        self,
+        context: VerificationContext
+    ) -> bool:
+        """Reject enrolled users without a code before decrypting"""
+        if not context.code:
+            raise self._reject()
+        return True
+
+    async def verify_code(
+        self,
+        context: VerificationContext
+    ) -> bool:
+        """Decrypt the secret(s) and match the code
+
+        Codes of ``hot_codes`` users are looked up in its precomputed
+        table first, without decrypting or hashing.
+        """
+        code = context.code or ""
+        encrypted_secret = context.encrypted_secret or {}
+        context.compared = True
+        hot = self.hot_codes
+        if hot is None:
+            await self._verify_secrets(context, encrypted_secret, code)
+            return True
+
+        fingerprint = (
+            encrypted_secret
+            if isinstance(encrypted_secret, str)
+            else tuple(sorted(encrypted_secret.items()))
+        )
+        if not self._verify_hot(context, hot, fingerprint, code):
+            auths, window = await self._verify_secrets(
+                context,
+                encrypted_secret,
+                code
+            )
+            hot.observe(context.user_id, fingerprint, lambda: HotKeys(
+                fingerprint,
+                auths(),
+                range(-window, window + 1)
+            ))
+        return True
+
+    async def _verify_secrets(
+        self,
+        context: VerificationContext,
+        encrypted_secret: Union[str, dict[str, str]],
+        code: str
+    ) -> tuple[Callable[[], Mapping[Optional[str], TwoFactorAuth]], int]:
+        """Match the code against the decrypted secret(s)
+
+        Returns what ``hot_codes`` derives the user's codes from: their
+        decrypted secrets, by device, and the steps either side of now
+        they are accepted at.
+        """
+        user_id = context.user_id
+        if isinstance(encrypted_secret, str):
+            auth = self._cached_secret_auth(user_id, encrypted_secret)
+            if auth is None:
+                auth = await self._decrypting(
+                    self._secret_auth,
+                    user_id,
+                    encrypted_secret
+                )
+            context.result = TwoFactorResult(
+                user_id,
+                self._verify_secret(user_id, auth, code),
+                secret=auth.secret if self.expose_secret else None
+            )
+            window = (
+                self.drift_tracker.max_window
+                if self.drift_tracker is not None
+                else 0
+            )
+            return lambda: {None: auth}, window
+
+        index = self._cached_device_index(user_id, encrypted_secret)
+        if index is None:
+            index = await self._decrypting(
+                self._device_index,
+                user_id,
+                encrypted_secret
+            )
+        device_id, step = self._verify_devices(index, code)
+        context.result = TwoFactorResult(
+            user_id,
+            step,
+            device_id,
+            index.secret(device_id) if self.expose_secret else None
+        )
+        return lambda: dict(index.auths.items()), self.device_window
+
+    def _verify_hot(
+        self,
+        context: VerificationContext,
+        hot: HotCodes,
+        fingerprint: Union[str, tuple[tuple[str, str], ...]],
+        code: str
+    ) -> bool:
+        """Match a code against the user's precomputed codes, if any"""
+        user_id = context.user_id
+        current = self.clock.step()
+        match = hot.match(user_id, fingerprint, code, current)
+        if match is None:
+            return False
+
+        device_id, step, secret = match
+        if device_id is None and self.drift_tracker is not None:
+            self.drift_tracker.record(user_id, step - current)
+        context.result = TwoFactorResult(
+            user_id,
+            step,
+            device_id,
+            secret if self.expose_secret else None
+        )
+        return True
+
+    def _reject(self) -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=INVALID_CODE_DETAIL
+        )
+
+    def _decrypt(
+        self,
+        encrypted_secret: str
+    ) -> str:
+        if not self.encryption_key:
+            return encrypted_secret
+        try:
+            return TwoFactorAuth.decrypt_secret(
+                encrypted_secret,
+                self.encryption_key,
+                tenant=self.tenant
+            )
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=str(e)
+            )
+
+    def _verify_secret(
+        self,
+        user_id: str,
+        auth: TwoFactorAuth,
+        two_fa_code: str
+    ) -> int:
+        step = auth.match_code(two_fa_code, user_id)
+        if step is None:
+            raise self._reject()
+        return step
+
+    async def _decrypting(
+        self,
+        function: Callable[..., T],
+        *args: Any
+    ) -> T:
+        """Run a call that decrypts, in a thread if it may block on a KMS"""
+        if self._decrypt_in_thread:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    def _cached_secret_auth(
+        self,
+        user_id: str,
+        encrypted_secret: str
+    ) -> Optional[TwoFactorAuth]:
+        cached = self._secret_auths.get(user_id)
+        if cached is not None and cached[0] == encrypted_secret:
+            return cached[1]
+        return None
+
+    def _secret_auth(
+        self,
+        user_id: str,
+        encrypted_secret: str
+    ) -> TwoFactorAuth:
+        """The user's decrypted secret, decrypting only when it changed"""
+        cached = self._cached_secret_auth(user_id, encrypted_secret)
+        if cached is not None:
+            return cached
+
+        auth = TwoFactorAuth(
+            self._decrypt(encrypted_secret),
+            drift_tracker=self.drift_tracker,
+            digits=self.digits,
+            interval=self.interval,
+            algorithm=self.algorithm,
+            clock=self.clock
+        )
+        self._secret_auths.set(user_id, (encrypted_secret, auth))
+        return auth
+
+    def _cached_device_index(
+        self,
+        user_id: str,
+        devices: dict[str, str]
+    ) -> Optional[DeviceCodeIndex]:
+        cached = self._device_indexes.get(user_id)
+        if cached is not None and cached[0] == tuple(sorted(devices.items())):
+            return cached[1]
+        return None
+
+    def _device_index(
+        self,
+        user_id: str,
+        devices: dict[str, str]
+    ) -> DeviceCodeIndex:
+        """Return the user's code index, rebuilding it when devices change"""
+        cached = self._cached_device_index(user_id, devices)
+        if cached is not None:
+            return cached
+
+        fingerprint = tuple(sorted(devices.items()))
+        index = DeviceCodeIndex(
+            {
+                device_id: self._decrypt(encrypted_secret)
+                for device_id, encrypted_secret in devices.items()
+            },
+            window=self.device_window,
+            digits=self.digits,
+            interval=self.interval,
+            algorithm=self.algorithm,
+            clock=self.clock
+        )
+        self._device_indexes.set(user_id, (fingerprint, index))
+        return index
+
+    def _verify_devices(
+        self,
+        index: DeviceCodeIndex,
+        two_fa_code: str
+    ) -> tuple[str, int]:
+        """Match a code against all of a user's devices"""
+        match = index.match(two_fa_code)
+        if match is None:
+            raise self._reject()
+        return match
@@ -0,0 +1,245 @@
+import asyncio
+import sys
+import threading
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    List,
+    Optional
+)
+from .cache import SecretCache
+from .devices import SecretSet
+from fastapi import HTTPException
+
+if TYPE_CHECKING:
+    from .verifier import TwoFactorVerifier
+
+
+# Returns the (user_id, encrypted_secret) pairs to preload
+WarmUpSource = Callable[[], AsyncIterable[tuple[str, SecretSet]]]
+
+Chunk = List[tuple[str, SecretSet]]
+
+# Rough per-entry overhead of a cache slot (tuple, floats, dict entry)
+ENTRY_OVERHEAD = 200
+
+# Rough size of one decrypted secret kept by the verifier (TwoFactorAuth,
+# plaintext, HMAC state); a device set also keeps its code index
+DECRYPTED_SIZE = 512
+
+
+@dataclass
+class WarmUpReport:
+    loaded: int = 0
+    invalid: int = 0
+    bytes_used: int = 0
+    elapsed: float = 0.0
+    # "time", "memory" or "capacity" when a budget ended the warm-up,
+    # "error" when the source failed
+    stopped: Optional[str] = None
+    error: Optional[BaseException] = None
+
+
+def entry_size(
+    user_id: str,
+    secret: SecretSet
+) -> int:
+    """Approximate memory held by one cached and decrypted secret"""
+    size = ENTRY_OVERHEAD + sys.getsizeof(user_id) + sys.getsizeof(secret)
+    if isinstance(secret, str):
+        size += DECRYPTED_SIZE
+    else:
+        size += DECRYPTED_SIZE * (len(secret) + 1)
+        size += sum(sys.getsizeof(item) for item in secret)
+        if isinstance(secret, dict):
+            size += sum(sys.getsizeof(value) for value in secret.values())
+    return size
+
+
+def _decrypt_chunk(
+    verifier: "TwoFactorVerifier",
+    chunk: Chunk,
+    expired: threading.Event
+) -> tuple[Chunk, int]:
+    """Decrypt a chunk into the verifier; runs in a worker thread
+
+    Returns the entries whose secrets decrypted and the number that did
+    not. Entries left once ``expired`` is set are neither.
+    """
+    valid = []
+    invalid = 0
+    for user_id, secret in chunk:
+        if expired.is_set():
+            break
+        try:
+            verifier.preload_secret(user_id, secret)
+        except HTTPException:
+            invalid += 1
+            continue
+        valid.append((user_id, secret))
+    return valid, invalid
+
+
+class _WarmUp:
+    def __init__(
+        self,
+        verifier: "TwoFactorVerifier",
+        cache: SecretCache[str, Optional[SecretSet]],
+        chunk_size: int,
+        parallelism: int,
+        time_budget: float,
+        memory_budget: int
+    ):
+        self.verifier = verifier
+        self.cache = cache
+        self.chunk_size = chunk_size
+        self.parallelism = parallelism
+        self.memory_budget = memory_budget
+        # Entries beyond what the verifier keeps would be decrypted for
+        # nothing
+        self.capacity = min(cache.max_entries, verifier.decrypted_capacity)
+        self.loop = asyncio.get_running_loop()
+        self.start = self.loop.time()
+        self.deadline = self.start + time_budget
+        self.report = WarmUpReport()
+        self.pending: List["asyncio.Future[tuple[Chunk, int]]"] = []
+        self.expired = threading.Event()
+        self.chunk: Chunk = []
+        self.queued = 0
+
+    def remaining(self) -> float:
+        return max(self.deadline - self.loop.time(), 0)
+
+    async def collect(
+        self,
+        future: "asyncio.Future[tuple[Chunk, int]]"
+    ) -> None:
+        # wait_for cancels the future on timeout; a done one is collected
+        # even past the deadline
+        valid, invalid = await asyncio.wait_for(future, self.remaining())
+        self.report.invalid += invalid
+        for user_id, secret in valid:
+            self.cache.prime(user_id, secret)
+            self.report.loaded += 1
+
+    async def submit(self) -> None:
+        """Decrypt the current chunk, waiting for a worker if all are busy"""
+        self.pending.append(self.loop.run_in_executor(
+            None,
+            _decrypt_chunk,
+            self.verifier,
+            self.chunk,
+            self.expired
+        ))
+        self.chunk = []
+        if len(self.pending) >= self.parallelism:
+            await self.collect(self.pending.pop(0))
+
+    def admit(
+        self,
+        user_id: str,
+        secret: SecretSet
+    ) -> bool:
+        """Queue a pair, or set ``stopped`` when a budget is reached"""
+        size = entry_size(user_id, secret)
+        if self.report.bytes_used + size > self.memory_budget:
+            self.report.stopped = "memory"
+        elif self.queued >= self.capacity:
+            self.report.stopped = "capacity"
+        else:
+            self.report.bytes_used += size
+            self.queued += 1
+            self.chunk.append((str(user_id), secret))
+        return self.report.stopped is None
+
+    async def read(
+        self,
+        iterator: AsyncIterator[tuple[str, SecretSet]]
+    ) -> None:
+        """Queue pairs until the source ends or a budget is reached"""
+        while self.report.stopped is None:
+            if self.remaining() <= 0:
+                raise asyncio.TimeoutError
+            try:
+                user_id, secret = await asyncio.wait_for(
+                    iterator.__anext__(),
+                    self.remaining()
+                )
+            except StopAsyncIteration:
+                return
+            if secret and self.admit(user_id, secret):
+                if len(self.chunk) >= self.chunk_size:
+                    await self.submit()
+
+    async def finish(self) -> None:
+        """Collect the chunks in flight, abandoning them past the deadline"""
+        if self.chunk and self.report.stopped != "time":
+            await self.submit()
+        try:
+            for future in self.pending:
+                try:
+                    await self.collect(future)
+                except asyncio.TimeoutError:
+                    self.report.stopped = "time"
+        finally:
+            # Workers still running stop at their next entry
+            self.expired.set()
+
+    async def run(
+        self,
+        secrets: AsyncIterable[tuple[str, SecretSet]]
+    ) -> WarmUpReport:
+        iterator = secrets.__aiter__()
+        try:
+            await self.read(iterator)
+        except asyncio.TimeoutError:
+            self.report.stopped = "time"
+        except Exception as e:
+            self.report.stopped = "error"
+            self.report.error = e
+
+        await self.finish()
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        self.report.elapsed = self.loop.time() - self.start
+        return self.report
+
+
+async def warm_up(
+    verifier: "TwoFactorVerifier",
+    secrets: AsyncIterable[tuple[str, SecretSet]],
+    *,
+    chunk_size: int = 256,
+    parallelism: int = 4,
+    time_budget: float = 10.0,
+    memory_budget: int = 64 * 1024 * 1024
+) -> WarmUpReport:
+    """Fill the verifier's secret cache from a bulk source
+
+    Pairs are read in chunks of ``chunk_size`` and decrypted in up to
+    ``parallelism`` worker threads while the next chunk is read;
+    secrets that do not decrypt are skipped. Reading stops once
+    ``time_budget`` seconds have passed, the cached and decrypted
+    entries would exceed ``memory_budget`` bytes, or the cache or the
+    verifier's decrypted secrets (``decrypted_capacity``) are full.
+    Chunks still being decrypted when the time budget runs out are
+    abandoned.
+    """
+    cache = verifier.secret_cache
+    if cache is None:
+        raise ValueError("Warm-up requires a verifier with a secret_cache")
+    if chunk_size < 1 or parallelism < 1:
+        raise ValueError("chunk_size and parallelism must be at least 1")
+
+    return await _WarmUp(
+        verifier,
+        cache,
+        chunk_size,
+        parallelism,
+        time_budget,
+        memory_budget
+    ).run(secrets)